@@ -0,0 +1,487 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Stand-ins for the WikiApi used by EuropeanaHarvester
+
+Each of these provides the httpGET(action, params) of WikiApi so that a
+harvest can be run, measured or regression tested without depending on
+a live Commons login:
+RecordingApi: forwards to a live api and saves every request and reply
+ReplayApi: serves the replies saved by RecordingApi, fully offline
+SyntheticApi: generates replies for a given number of files, fully offline
+DumpApi (in DumpBackend): serves replies from local database dumps, fully offline
+
+The archive of RecordingApi is a gzipped file with one json entry per
+line, each holding the action, the parameters and the reply.
+'''
+
+import gzip
+import json
+import random
+import threading
+import zlib
+
+
+def requestKey(action, params):
+    '''
+    the key identifying a request in an archive, regardless of its
+    maxlag (which only affects whether the request is served)
+    returns: string
+    '''
+    return json.dumps([action, [list(p) for p in params if p[0] != 'maxlag']], separators=(',', ':'))
+
+
+class RecordingApi(object):
+    '''
+    Forwards each request to a live api and saves the request together
+    with its reply to an archive, which can then be served by ReplayApi.
+    '''
+    def __init__(self, api, filename):
+        '''
+        api: the live WikiApi
+        filename: the (unicode)string pathname of the archive to create
+        raises: IOError
+        '''
+        self.api = api
+        self.lock = threading.Lock()  # shared by the worker threads
+        self.f = gzip.open(filename, 'wb')
+        self.count = 0
+
+    def httpGET(self, action, params):
+        reply = self.api.httpGET(action, params)
+        entry = json.dumps({'action': action, 'params': [list(p) for p in params], 'reply': reply},
+                           separators=(',', ':'))
+        with self.lock:
+            self.f.write('%s\n' % entry)
+            self.count += 1
+        return reply
+
+    def close(self):
+        '''finish the archive'''
+        with self.lock:
+            self.f.close()
+
+
+class ReplayApi(object):
+    '''
+    Serves the replies saved by RecordingApi. A request made several
+    times is given its replies in the order they were recorded (the
+    last one once these run out) and a request which was never recorded
+    is given an error reply.
+    '''
+    def __init__(self, filename):
+        '''
+        filename: the (unicode)string pathname of the archive
+        raises: IOError, ValueError
+        '''
+        self.replies = {}  # request key: list of json replies
+        self.served = {}  # request key: number of replies served
+        self.lock = threading.Lock()  # shared by the worker threads
+        f = gzip.open(filename, 'rb')
+        for line in f:
+            e = json.loads(line)
+            key = requestKey(e['action'], e['params'])
+            self.replies.setdefault(key, []).append(json.dumps(e['reply']))
+        f.close()
+        self.count = 0
+
+    def httpGET(self, action, params):
+        key = requestKey(action, params)
+        with self.lock:
+            self.count += 1
+            replies = self.replies.get(key)
+            if not replies:
+                return {u'error': {u'code': u'notrecorded', u'info': u'No recorded reply for the request %s' % key}}
+            i = self.served.get(key, 0)
+            self.served[key] = i + 1
+        return json.loads(replies[min(i, len(replies) - 1)])  # decoded anew, as with a live reply
+
+    def close(self):
+        '''nothing to finish'''
+        pass
+
+
+class SyntheticApi(object):
+    '''
+    Generates replies for a given number of files, numbered from 1, of
+    the requests sent by EuropeanaHarvester. The metadata and content
+    of each file is varied, but always the same for the same file and
+    seed, so that it includes e.g. long html descriptions, credits to
+    be filtered, coordinates, several licenses, non-images, hidden and
+    missing categories and links matching the id-templates.
+    Lists are continued as by the live api, using the limits of an
+    account without apihighlimits unless highlimits is set. Missing
+    categories and pages are replied to as such and requests which are
+    not supported are given an error reply, as are every failEvery:th
+    request if set.
+    '''
+    LIMIT = 500  # max limit of most lists
+    LIMIT_HIGH = 5000  # as above but with apihighlimits
+    CREDITS = (u'<span class="int-own-work">Own work</span>',
+               u'<span class="int-own-work" lang="sv">Eget arbete</span>',
+               u'Riksantikvarieämbetet, Kulturmiljöbild',
+               u'<a href="//commons.wikimedia.org/wiki/User:Example" title="User:Example">Example</a>')
+    LICENSES = ((u'CC BY-SA 3.0', u'http://creativecommons.org/licenses/by-sa/3.0', u'True'),
+                (u'CC BY-SA 4.0', u'http://creativecommons.org/licenses/by-sa/4.0', u'True'),
+                (u'CC BY 2.0', u'http://creativecommons.org/licenses/by/2.0', u'True'),
+                (u'Public domain', None, u'False'),
+                (u'CC0', u'http://creativecommons.org/publicdomain/zero/1.0/deed.en', u'False'),
+                (u'GFDL', u'http://www.gnu.org/copyleft/fdl.html', u'True'))
+    WORDS = (u'kyrka', u'gård', u'bro', u'fyr', u'kvarn', u'slott', u'church', u'view', u'from', u'the',
+             u'north', u'södra', u'interior', u'detail', u'1890s', u'monument', u'Malmö', u'Göteborg')
+
+    def __init__(self, files=1000, categories=None, subcategories=None, idTemplates=None,
+                 credits=None, seed=0, highlimits=False, failEvery=None):
+        '''
+        files: the number of files
+        categories: dict of category title: list of the files in it, if
+                    None then any category exists and contains all files
+        subcategories: dict of category title: list of subcategory titles
+        idTemplates: dict of template: list of link prefixes (as in a
+                     project file) used for the links of the files,
+                     by default those of Template:BBR
+        credits: list of credit blobs (e.g. the creditStrings) of which
+                 some of the credits are made up, by default CREDITS
+        seed: varies the generated files
+        highlimits: whether to use the limits of an account with apihighlimits
+        failEvery: give an error reply to every failEvery:th request
+        '''
+        self.files = files
+        self.categories = categories
+        self.subcategories = subcategories or {}
+        if idTemplates is None:
+            idTemplates = {u'Template:BBR': [u'http://kulturarvsdata.se/raa/bbr/html/']}
+        self.idTemplates = sorted((k, v) for k, v in idTemplates.iteritems() if v)
+        self.seed = seed
+        self.highlimits = highlimits
+        self.failEvery = failEvery
+        self.credits = list(credits or SyntheticApi.CREDITS)
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def close(self):
+        '''nothing to finish'''
+        pass
+
+    def httpGET(self, action, params):
+        with self.lock:
+            self.count += 1
+            count = self.count
+        p = dict((k, v.decode('utf-8') if isinstance(v, str) else v) for k, v in params)
+        if self.failEvery and count % self.failEvery == 0:
+            return SyntheticApi.error(u'internal_api_error_DBQueryError', u'Synthetic database query error')
+        if action == 'parse' and 'pageid' in p:
+            pageId = int(p['pageid'])
+            if not self.exists(pageId):
+                return SyntheticApi.error(u'nosuchpageid', u'There is no page with ID %d' % pageId)
+            return {u'parse': self.parse(pageId)}
+        if action != 'query':
+            return SyntheticApi.error(u'unknown_action', u'Unrecognized value for parameter "action": %s' % action)
+        if p.get('meta') == 'userinfo':
+            rights = [u'read', u'edit'] + ([u'apihighlimits'] if self.highlimits else [])
+            return {u'query': {u'userinfo': {u'id': 1, u'name': u'Synthetic', u'rights': rights}}}
+        if p.get('prop') == 'categoryinfo' and 'titles' in p:
+            return self.categoryInfo(p['titles'].split('|'))
+        if p.get('list') == 'categorymembers':
+            return self.listMembers(p)
+        if p.get('generator') == 'categorymembers':
+            return self.generateMembers(p)
+        if 'pageids' in p:
+            return self.pages(p)
+        if p.get('prop') == 'info' and 'titles' in p:
+            return self.titleInfo(p['titles'].split('|'))
+        return SyntheticApi.error(u'unsupported', u'The synthetic api does not support this request: %s' % requestKey(action, params))
+
+    @staticmethod
+    def error(code, info):
+        '''an error reply'''
+        return {u'error': {u'code': code, u'info': info}}
+
+    def limit(self, value, maximum=None):
+        '''the limit given by a request parameter'''
+        maximum = maximum or (SyntheticApi.LIMIT_HIGH if self.highlimits else SyntheticApi.LIMIT)
+        if value in (None, u'max'):
+            return maximum
+        return min(int(value), maximum)
+
+    def members(self, title):
+        '''the files in a category, or None if it does not exist'''
+        if self.categories is None:
+            if title.startswith(u'Category:Missing'):
+                return None
+            return range(1, self.files + 1)
+        if title not in self.categories:
+            return None
+        return [i for i in self.categories[title] if self.exists(i)]
+
+    def exists(self, pageId):
+        '''whether there is a file with this pageId'''
+        return 1 <= pageId <= self.files
+
+    def categoryInfo(self, titles):
+        pages = {}
+        for n, t in enumerate(titles):
+            members = self.members(t)
+            if members is None:
+                pages[unicode(-1 - n)] = {u'ns': 14, u'title': t, u'missing': u''}
+            else:
+                pageId = self.categoryId(t)
+                subcats = len(self.subcategories.get(t, []))
+                pages[unicode(pageId)] = {u'pageid': pageId, u'ns': 14, u'title': t,
+                                          u'categoryinfo': {u'size': len(members) + subcats, u'pages': 0,
+                                                            u'files': len(members), u'subcats': subcats}}
+        return {u'query': {u'pages': pages}}
+
+    def titleInfo(self, titles):
+        pages = {}
+        for n, t in enumerate(titles):
+            template = t.startswith(u'Template:')
+            ns = 10 if template else 14
+            if not (self.templateExists(t) if template else self.categoryExists(t)):
+                pages[unicode(-1 - n)] = {u'ns': ns, u'title': t, u'missing': u''}
+            else:
+                pageId = self.templateId(t) if template else self.categoryId(t)
+                pages[unicode(pageId)] = {u'pageid': pageId, u'ns': ns, u'title': t, u'contentmodel': u'wikitext',
+                                          u'pagelanguage': u'en', u'touched': u'2014-09-01T00:00:00Z',
+                                          u'lastrevid': pageId, u'length': 120}
+        return {u'query': {u'pages': pages}}
+
+    def categoryExists(self, title):
+        '''whether a category has a category page'''
+        return not title.startswith(u'Category:Missing')
+
+    def categoryId(self, title):
+        '''a stable pageId for a category, not overlapping the files'''
+        return 100000000 + zlib.crc32(title.encode('utf-8')) % 100000000
+
+    def templateExists(self, title):
+        '''whether a template has a page'''
+        return True
+
+    def templateId(self, title):
+        '''a stable pageId for a template, not overlapping the files or categories'''
+        return 200000000 + zlib.crc32(title.encode('utf-8')) % 100000000
+
+    @staticmethod
+    def window(items, params, key, limit):
+        '''
+        the part of a list given by a continue parameter
+        returns: (part, continue value or None if complete)
+        '''
+        start = int(params.get(key) or 0)
+        end = start + limit
+        return items[start:end], (unicode(end) if end < len(items) else None)
+
+    def listMembers(self, p):
+        title = p.get('cmtitle')
+        if title is None:
+            return SyntheticApi.error(u'cmmissingparam', u'One of the parameters "cmtitle" and "cmpageid" is required.')
+        members = self.members(title)
+        if members is None:
+            return SyntheticApi.error(u'invalidcategory', u'The category name you entered is not valid.')
+        limit = self.limit(p.get('cmlimit'))
+        if p.get('cmtype') == 'subcat':
+            part, nxt = SyntheticApi.window(self.subcategories.get(title, []), p, 'cmcontinue', limit)
+            items = [{u'pageid': self.categoryId(t), u'ns': 14, u'title': t} for t in part]
+        else:
+            part, nxt = SyntheticApi.window(members, p, 'cmcontinue', limit)
+            items = [{u'pageid': i, u'ns': 6, u'title': self.title(i)} for i in part]
+        reply = {u'query': {u'categorymembers': items}}
+        if nxt is not None:
+            reply[u'continue'] = {u'cmcontinue': nxt, u'continue': u'-||'}
+        else:
+            reply[u'batchcomplete'] = u''
+        return reply
+
+    def generateMembers(self, p):
+        members = self.members(p.get('gcmtitle', u''))
+        if members is None:
+            return SyntheticApi.error(u'invalidcategory', u'The category name you entered is not valid.')
+        props = p.get('prop', u'').split('|')
+        limit = self.limit(p.get('gcmlimit'))
+        part, nxt = SyntheticApi.window(members, p, 'gcmcontinue', limit)
+        reply = {u'query': {u'pages': self.pageInfo(part, props, p)}} if part else {u'batchcomplete': u''}
+        if nxt is not None:
+            if 'rawcontinue' in p:
+                reply[u'query-continue'] = {u'categorymembers': {u'gcmcontinue': nxt}}
+            else:
+                reply[u'continue'] = {u'gcmcontinue': nxt, u'continue': u'gcmcontinue||'}
+        return reply
+
+    def pages(self, p):
+        try:
+            pageIds = [int(i) for i in p['pageids'].split('|')]
+        except ValueError:
+            return SyntheticApi.error(u'badinteger', u'Invalid value for parameter "pageids"')
+        if len(pageIds) > (500 if self.highlimits else 50):
+            return SyntheticApi.error(u'toomanyvalues', u'Too many values supplied for parameter "pageids"')
+        props = p.get('prop', u'').split('|')
+        pages = self.pageInfo(pageIds, props, p)
+        cont = {}
+        for prop, prefix, f in (('categories', 'cl', self.pageCategories),
+                                ('templates', 'tl', self.pageTemplates),
+                                ('extlinks', 'el', self.pageLinks)):
+            if prop not in props:
+                continue
+            if any(k.endswith('continue') and k != 'continue' for k in p) and '%scontinue' % prefix not in p:
+                continue  # completed in an earlier part
+            items = [(i, item) for i in pageIds if self.exists(i) for item in f(i)]
+            part, nxt = SyntheticApi.window(items, p, '%scontinue' % prefix, self.limit(p.get('%slimit' % prefix)))
+            for i, item in part:
+                pages[unicode(i)].setdefault(prop, []).append(item)
+            if nxt is not None:
+                cont[u'%scontinue' % prefix] = nxt
+        if cont:
+            cont[u'continue'] = u'||'
+            return {u'continue': cont, u'query': {u'pages': pages}}
+        return {u'batchcomplete': u'', u'query': {u'pages': pages}}
+
+    def pageInfo(self, pageIds, props, p):
+        '''the pages of a reply, with the info and imageinfo props'''
+        pages = {}
+        for n, i in enumerate(pageIds):
+            if not self.exists(i):
+                pages[unicode(-1 - n)] = {u'pageid': i, u'missing': u''}
+                continue
+            page = {u'pageid': i, u'ns': 6, u'title': self.title(i)}
+            if 'info' in props:
+                page.update({u'contentmodel': u'wikitext', u'pagelanguage': u'en',
+                             u'touched': u'2014-09-01T00:00:00Z', u'lastrevid': self.revision(i),
+                             u'length': self.length(i)})
+            if 'imageinfo' in props:
+                info = self.imageInfo(i)
+                if p.get('iiextmetadatafilter'):
+                    wanted = p['iiextmetadatafilter'].split('|')
+                    info[u'extmetadata'] = dict((k, v) for k, v in info[u'extmetadata'].iteritems() if k in wanted)
+                page[u'imagerepository'] = u'local'
+                page[u'imageinfo'] = [info]
+            pages[unicode(i)] = page
+        return pages
+
+    def rng(self, pageId):
+        '''the random generator for a file, the same for each request'''
+        return random.Random(self.seed * 1000003 + pageId)
+
+    def title(self, pageId):
+        return u'File:%s.jpg' % self.name(pageId)
+
+    def name(self, pageId):
+        r = self.rng(pageId)
+        return u'%s %s %d' % (r.choice(SyntheticApi.WORDS).capitalize(), r.choice(SyntheticApi.WORDS), pageId)
+
+    def revision(self, pageId):
+        return 100000000 + pageId * 7 + self.seed
+
+    def length(self, pageId):
+        return 1500 + pageId % 1000
+
+    def imageInfo(self, pageId):
+        '''the imageinfo of a file, with all of its extmetadata'''
+        r = self.rng(pageId)
+        user = u'Uploader %d' % r.randint(1, max(1, self.files // 20))
+        name = self.name(pageId).replace(u' ', u'_')
+        words = [r.choice(SyntheticApi.WORDS) for k in range(r.choice((3, 10, 40, 120)))]
+        description = u'%s, <b>%s</b> <a href="//commons.wikimedia.org/wiki/File:%s" class="new">link</a>' % (u' '.join(words[:-1]), words[-1], name)
+        kind = r.random()
+        if kind < 0.2:
+            # descriptions in several languages
+            description = u''.join(u'<div class="description %s" lang="%s"><span class="language %s" title=""><b>%s:</b></span> %s</div>' % (l, l, l, l, description)
+                                   for l in (u'sv', u'en')[:r.randint(1, 2)])
+        elif kind < 0.3:
+            # a template left in the description
+            description = u'%s<table class="toccolours"><tr><td><div style="float:left">%s</div></td></tr></table>' % (description, u' '.join(words[:5]))
+        credit = r.choice(SyntheticApi.CREDITS)
+        if r.random() < 0.3:
+            credit = u'%s %s' % (r.choice(self.credits), credit)
+        licenseName, licenseUrl, copyrighted = r.choice(SyntheticApi.LICENSES)
+        date = u'%d-%02d-%02d' % (r.randint(2011, 2014), r.randint(1, 12), r.randint(1, 28))
+        metadata = {
+            u'DateTime': {u'value': u'%s 12:00:00' % date, u'source': u'mediawiki-metadata', u'hidden': u''},
+            u'ObjectName': {u'value': self.name(pageId), u'source': u'mediawiki-metadata'},
+            u'CommonsMetadataExtension': {u'value': 1.2, u'source': u'extension', u'hidden': u''},
+            u'Categories': {u'value': u'|'.join(c[u'title'][len(u'Category:'):] for c in self.pageCategories(pageId)),
+                            u'source': u'commons-categories', u'hidden': u''},
+            u'Assessments': {u'value': u'', u'source': u'commons-categories', u'hidden': u''},
+            u'ImageDescription': {u'value': description, u'source': u'commons-desc-page'},
+            u'Credit': {u'value': credit, u'source': u'commons-desc-page', u'hidden': u''},
+            u'LicenseShortName': {u'value': licenseName, u'source': u'commons-desc-page', u'hidden': u''},
+            u'UsageTerms': {u'value': u'Creative Commons Attribution-Share Alike', u'source': u'commons-desc-page', u'hidden': u''},
+            u'AttributionRequired': {u'value': u'true', u'source': u'commons-desc-page', u'hidden': u''},
+            u'Copyrighted': {u'value': copyrighted, u'source': u'commons-desc-page', u'hidden': u''},
+            u'Restrictions': {u'value': u'', u'source': u'commons-desc-page', u'hidden': u''},
+            u'License': {u'value': licenseName.lower().replace(u' ', u'-'), u'source': u'commons-templates', u'hidden': u''},
+        }
+        if r.random() < 0.9:
+            metadata[u'Artist'] = {u'value': u'<a href="//commons.wikimedia.org/wiki/User:%s" title="User:%s">%s</a>' % (user.replace(u' ', u'_'), user, user),
+                                   u'source': u'commons-desc-page'}
+        if r.random() < 0.8:
+            metadata[u'DateTimeOriginal'] = {u'value': u'<time class="dtstart" datetime="%s">%s</time>, 09:51:00' % (date, date),
+                                             u'source': u'commons-desc-page'}
+        if licenseUrl:
+            metadata[u'LicenseUrl'] = {u'value': licenseUrl, u'source': u'commons-desc-page', u'hidden': u''}
+        if r.random() < 0.4:
+            metadata[u'GPSLatitude'] = {u'value': u'%.6f' % r.uniform(55.3, 69.0), u'source': u'commons-desc-page', u'hidden': u''}
+            metadata[u'GPSLongitude'] = {u'value': u'%.6f' % r.uniform(11.0, 24.0), u'source': u'commons-desc-page', u'hidden': u''}
+            metadata[u'GPSMapDatum'] = {u'value': u'WGS-84', u'source': u'commons-desc-page', u'hidden': u''}
+        return {u'timestamp': u'%sT12:00:00Z' % date, u'user': user,
+                u'url': u'https://upload.wikimedia.org/wikipedia/commons/%x/%s.jpg' % (pageId % 16, name),
+                u'descriptionurl': u'https://commons.wikimedia.org/wiki/File:%s.jpg' % name,
+                u'mime': u'video/ogg' if r.random() < 0.02 else u'image/jpeg',
+                u'extmetadata': metadata}
+
+    def pageCategories(self, pageId):
+        r = self.rng(pageId + 1)
+        cats = [{u'ns': 14, u'title': u'Category:%s in %s' % (r.choice(SyntheticApi.WORDS).capitalize(), r.choice((u'Sweden', u'Skåne', u'Uppland')))},
+                {u'ns': 14, u'title': u'Category:Images from Wiki Loves Monuments %d in Sweden' % r.randint(2011, 2014), u'hidden': u''}]
+        for k in range(r.randint(0, 5)):
+            cats.append({u'ns': 14, u'title': u'Category:Subject %d' % r.randint(1, max(1, self.files // 10))})
+        if r.random() < 0.1:
+            cats.append({u'ns': 14, u'title': u'Category:Missing red %d' % r.randint(1, 50)})
+        if r.random() < 0.05:
+            cats.append({u'ns': 14, u'title': u'Category:Media needing categories'})
+        return cats
+
+    def pageTemplates(self, pageId):
+        r = self.rng(pageId + 2)
+        templates = [{u'ns': 10, u'title': u'Template:%s' % t} for t in (u'Self', u'Cc-by-sa-3.0', u'Location')]
+        if r.random() < 0.95:
+            templates.append({u'ns': 10, u'title': u'Template:Information'})
+        templates += [{u'ns': 10, u'title': k} for k, prefix in self.pageIdTemplates(pageId)]
+        templates += [{u'ns': 10, u'title': u'Template:Helper %d' % k} for k in range(r.randint(0, 12))]
+        return templates
+
+    def pageIdTemplates(self, pageId):
+        '''the id-templates used by a file, with the prefix of its link'''
+        r = self.rng(pageId + 3)
+        return [(k, prefixes[pageId % len(prefixes)]) for k, prefixes in self.idTemplates if r.random() < 0.6]
+
+    def pageLinks(self, pageId):
+        r = self.rng(pageId + 4)
+        links = [{u'*': u'%s%d' % (prefix, 21300000000000 + pageId)} for k, prefix in self.pageIdTemplates(pageId)]
+        links += [{u'*': u'http://example.org/%d/%d' % (pageId, k)} for k in range(r.randint(0, 6))]
+        return links
+
+    def parse(self, pageId):
+        '''the reply to action=parse for a file'''
+        categories = []
+        for c in self.pageCategories(pageId):
+            cat = {u'sortkey': u'', u'*': c[u'title'][len(u'Category:'):].replace(u' ', u'_')}
+            if 'hidden' in c:
+                cat[u'hidden'] = u''
+            if not self.categoryExists(c[u'title']):
+                cat[u'missing'] = u''
+            categories.append(cat)
+        templates = []
+        for t in self.pageTemplates(pageId):
+            template = {u'ns': 10, u'*': t[u'title']}
+            if self.templateExists(t[u'title']):
+                template[u'exists'] = u''
+            templates.append(template)
+        links = [l[u'*'] for l in self.pageLinks(pageId)]
+        return {u'title': self.title(pageId), u'pageid': pageId, u'categories': categories,
+                u'templates': templates, u'externallinks': links}
@@ -0,0 +1,627 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Offline harvests from local database dumps of Commons
+
+DumpApi serves the requests sent by EuropeanaHarvester from the dumps
+found in a directory (as published on dumps.wikimedia.org, plain or
+compressed with gzip or bzip2) rather than from the live api:
+*-page.sql: the pages, their titles and latest revisions (and which
+            categories and templates have a page)
+*-categorylinks.sql: the members of each category (and, for the newer
+                     schema, *-linktarget.sql)
+*-page_props.sql: which categories are hidden (optional)
+*-templatelinks.sql: the templates used by each page (and, for the
+                     newer schema, *-linktarget.sql)
+*-externallinks.sql: the external links of each page
+*-image.sql: the mime type and uploader of each file (the newer schema
+             has no names of uploaders, the latest editor of the file
+             page stands in for them)
+*-pages-articles*.xml: the wikitext of the file pages
+
+Each dump is read once (categorylinks and page once per level of
+subcategories) by streaming parsers and only what concerns the files of
+the harvested categories is kept. The columns are found from the table
+definitions of the dumps, so that both older and newer schemas can be
+read.
+
+The extmetadata of a file, as given by the live api, is made up from
+its wikitext: the fields of its {{Information}} template, its license
+templates, its {{Location}} and its upload. The description, credit and
+artist are rendered as the simple html the api would give for common
+wikitext (links, bold, italics and language templates), other templates
+in them are dropped.
+'''
+
+import bz2
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+import urllib
+from ApiBackend import SyntheticApi
+from lxml import etree  # for the xml dump
+
+INSERT = re.compile(r"^INSERT INTO `(\w+)` VALUES ")
+COLUMN = re.compile(r"^\s+`(\w+)` ")
+TUPLE = re.compile(r"\(((?:'(?:[^'\\]|\\.)*'|[^'()])*)\)")
+FIELD = re.compile(r"'((?:[^'\\]|\\.)*)'|([^,']+)")
+ESCAPE = re.compile(r"\\(.)")
+ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+ISODATE = re.compile(r'(?<![0-9])([0-9]{4}-[0-9]{2}(?:-[0-9]{2})?)(?:[ T]([0-9]{2}:[0-9]{2}(?::[0-9]{2})?))?(?![0-9])')
+LANGUAGE = re.compile(r'^[a-z]{2,3}(?:-[a-z]+)?$')
+TEMPLATE = re.compile(r'\{\{\s*(?:template:)?([^|{}]*)', re.I)
+
+
+def openDump(filename):
+    '''open a dump, decompressing it if needed'''
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    if filename.endswith('.bz2'):
+        return bz2.BZ2File(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def unescape(value):
+    '''a string value of an sql dump, as (unicode)string'''
+    if '\\' in value:
+        value = ESCAPE.sub(lambda m: ESCAPES.get(m.group(1), m.group(1)), value)
+    return value.decode('utf-8', 'replace')
+
+
+def sqlColumns(filename):
+    '''
+    the columns of the table of an sql dump, from its table definition
+    returns: list of strings
+    '''
+    f = openDump(filename)
+    names = []
+    for line in f:
+        m = COLUMN.match(line)
+        if m:
+            names.append(m.group(1))
+        elif INSERT.match(line):
+            break
+    f.close()
+    return names
+
+
+def sqlRows(filename, columns):
+    '''
+    stream the rows of an sql dump
+    columns: the names of the columns to return, those which are not in
+             the table are returned as None
+    returns: generator of tuples of (unicode)strings (or None for NULL)
+    '''
+    f = openDump(filename)
+    names = []
+    indices = None
+    for line in f:
+        if indices is None:
+            m = COLUMN.match(line)
+            if m:
+                names.append(m.group(1))
+                continue
+            if not INSERT.match(line):
+                continue
+            indices = [names.index(c) if c in names else None for c in columns]
+        elif not line.startswith('INSERT INTO'):
+            continue
+        for row in TUPLE.finditer(line, line.index(' VALUES ')):
+            fields = FIELD.findall(row.group(1))
+            yield tuple(None if i is None or fields[i][1] == 'NULL' else fields[i][1] or unescape(fields[i][0])
+                        for i in indices)
+    f.close()
+
+
+def templateParams(text, names):
+    '''
+    the parameters of the first use of any of the named templates
+    names: lowercase template names, without prefix
+    returns: dict of parameter name (or position): wikitext, or None if not used
+    '''
+    for start in (m.start() for m in re.finditer(r'\{\{', text)):
+        name = TEMPLATE.match(text, start).group(1).strip().replace(u'_', u' ').lower()
+        if name not in names:
+            continue
+        params = {}
+        depth = 0
+        part = []
+        parts = []
+        i = start + 2
+        while i < len(text):
+            two = text[i:i + 2]
+            if two in (u'{{', u'[['):
+                depth += 1
+                part.append(two)
+                i += 2
+                continue
+            if two in (u'}}', u']]'):
+                if depth == 0 and two == u'}}':
+                    break
+                depth -= 1
+                part.append(two)
+                i += 2
+                continue
+            if text[i] == u'|' and depth == 0:
+                parts.append(u''.join(part))
+                part = []
+            else:
+                part.append(text[i])
+            i += 1
+        parts.append(u''.join(part))
+        position = 0
+        for p in parts[1:]:
+            if u'=' in p and re.match(r'^\s*[^=\[\]{}]+=', p):
+                k, v = p.split(u'=', 1)
+                params[k.strip().lower()] = v.strip()
+            else:
+                position += 1
+                params[position] = p.strip()
+        return params
+    return None
+
+
+class DumpApi(SyntheticApi):
+    '''
+    Serves the requests sent by EuropeanaHarvester from local database
+    dumps, see the module description. The dumps are indexed for the
+    given categories when created, after which the requests are served
+    as by SyntheticApi (as for an account with apihighlimits).
+    '''
+    LICENSES = ((re.compile(r'^cc-zero$'), u'CC0', u'http://creativecommons.org/publicdomain/zero/1.0/deed.en', u'False'),
+                (re.compile(r'^cc-(by(?:-nc)?(?:-sa|-nd)?)-([0-9]\.[0-9])(?:-([a-z]{2}))?'), None, None, u'True'),
+                (re.compile(r'^(?:pd-|public domain)'), u'Public domain', None, u'False'),
+                (re.compile(r'^gfdl'), u'GFDL', u'http://www.gnu.org/copyleft/fdl.html', u'True'))
+
+    def __init__(self, directory, categories, depth=0, exclude=(), idTemplates=None, verbose=False):
+        '''
+        Indexes the dumps
+        directory: the directory holding the dumps
+        categories: the (base) categories to harvest, with "Category:"-prefix
+        depth: levels of subcategories also harvested
+        exclude: categories not to harvest, nor their subcategories
+        idTemplates: dict of template: list of link prefixes (as in a
+                     project file), only matching external links are kept
+                     (all of them if None)
+        verbose: whether to report the progress to the terminal
+        raises: IOError
+        '''
+        SyntheticApi.__init__(self, highlimits=True)
+        self.directory = directory
+        self.verbose = verbose
+        self.prefixes = None
+        if idTemplates is not None:
+            self.prefixes = tuple(p.encode('utf-8') if isinstance(p, unicode) else p for v in idTemplates.itervalues() for p in v)
+        self.categories = {}  # category title: list of files
+        self.subcategories = {}  # category title: list of subcategory titles
+        self.filePages = {}  # pageId: (title, revision, length)
+        self.fileCategories = {}  # pageId: list of category titles
+        self.existing = {}  # category title: pageId of its category page
+        self.existingTemplates = {}  # template title: pageId of its page
+        self.hidden = set()  # hidden category titles
+        self.templates = {}  # pageId: list of template titles
+        self.links = {}  # pageId: list of external links
+        self.images = {}  # pageId: (mime, uploader, upload timestamp)
+        self.texts = {}  # pageId: (wikitext, latest contributor)
+
+        start = time.time()
+        self.indexCategories([c for c in categories if c not in exclude], depth, set(exclude))
+        files = set(i for members in self.categories.itervalues() for i in members)
+        self.progress(u'Found %d files in %d categories' % (len(files), len(self.categories)))
+        self.indexFileCategories(files)
+        self.indexTemplates(files)
+        self.indexPages(files)
+        self.indexHidden()
+        self.indexLinks()
+        self.indexImages()
+        self.indexTexts()
+        self.categories = dict((k, sorted(i for i in v if i in self.filePages)) for k, v in self.categories.iteritems())
+        self.progress(u'Indexed the dumps for %d files in %.0f s' % (len(self.filePages), time.time() - start))
+
+    @staticmethod
+    def fromProjects(directory, projects, verbose=False):
+        '''
+        a DumpApi indexed for the categories of several project files,
+        any project file which cannot be read is left to the harvester
+        to report
+        projects: list of (unicode)string pathnames to project files
+        returns: DumpApi
+        raises: IOError
+        '''
+        categories = []
+        exclude = set()
+        depth = 0
+        idTemplates = {}
+        for filename in projects:
+            try:
+                f = open(filename, 'r')
+                project = json.load(f)
+                f.close()
+                categories += [c for c in project.get(u'base-categories', []) if c not in categories]
+                exclude.update(project.get(u'exclude-categories', []))
+                depth = max(depth, project.get(u'subcategory-depth', 0))
+                for k, v in project.get(u'id-templates', {}).iteritems():
+                    idTemplates.setdefault(k, []).extend(v)
+            except (IOError, ValueError, TypeError, AttributeError):
+                continue
+        return DumpApi(directory, categories, depth=depth, exclude=exclude, idTemplates=idTemplates, verbose=verbose)
+
+    def progress(self, text):
+        if self.verbose:
+            print text
+
+    def dump(self, table, required=True):
+        '''
+        the filename of the dump of a table
+        returns: (unicode)string or None if there is none (and it is not required)
+        raises: IOError
+        '''
+        for pattern in (u'*-%s.sql*' % table, u'%s.sql*' % table):
+            found = sorted(glob.glob(os.path.join(self.directory, pattern)))
+            if found:
+                return found[-1]
+        if required:
+            raise IOError(u'There is no dump of the %s table in %s' % (table, self.directory))
+        return None
+
+    def categoryColumn(self):
+        '''
+        the column of the categorylinks dump naming the category: cl_to,
+        or cl_target_id (a linktarget) for the newer schema
+        returns: string
+        raises: IOError
+        '''
+        columns = sqlColumns(self.dump(u'categorylinks'))
+        for column in ('cl_to', 'cl_target_id'):
+            if column in columns:
+                return column
+        raise IOError(u'The categorylinks dump in %s has neither a cl_to nor a cl_target_id column' % self.directory)
+
+    def linkTargets(self, ns, ids=None, titles=None):
+        '''
+        look up link targets in the linktarget dump
+        ns: the namespace of the targets, as string
+        ids: the target ids (as strings) to look up, or None
+        titles: the titles (with underscores, without prefix) to look up, or None
+        returns: dict of target id (as string): title
+        raises: IOError
+        '''
+        targets = {}
+        for target, namespace, title in sqlRows(self.dump(u'linktarget'), ('lt_id', 'lt_namespace', 'lt_title')):
+            if namespace == ns and (ids is None or target in ids) and (titles is None or title in titles):
+                targets[target] = title
+        return targets
+
+    def indexCategories(self, categories, depth, exclude):
+        '''
+        list the files and subcategories of the categories, walking the
+        subcategories breadth-first for depth levels
+        '''
+        column = self.categoryColumn()
+        level = dict((c[len(u'Category:'):].replace(u' ', u'_'), c) for c in categories)
+        seen = set(level.values())
+        for n in range(depth + 1):
+            self.progress(u'Listing %d categories...' % len(level))
+            keys = level
+            if column == 'cl_target_id':
+                keys = dict((k, level[v]) for k, v in self.linkTargets(u'14', titles=level).iteritems())
+            subcats = {}  # pageId of subcategory: list of parent titles
+            for member, to, kind in sqlRows(self.dump(u'categorylinks'), ('cl_from', column, 'cl_type')):
+                title = keys.get(to)
+                if title is None:
+                    continue
+                if kind == u'subcat':
+                    subcats.setdefault(int(member), []).append(title)
+                elif kind == u'file':
+                    self.categories.setdefault(title, []).append(int(member))
+            for title in level.itervalues():
+                self.categories.setdefault(title, [])
+            if n == depth or not subcats:
+                break
+            # the titles of the subcategories
+            found = {}
+            for pageId, ns, title in sqlRows(self.dump(u'page'), ('page_id', 'page_namespace', 'page_title')):
+                if ns == u'14' and int(pageId) in subcats:
+                    found[int(pageId)] = u'Category:%s' % title.replace(u'_', u' ')
+            level = {}
+            for pageId, parents in subcats.iteritems():
+                if pageId not in found:
+                    continue
+                title = found[pageId]
+                for parent in parents:
+                    self.subcategories.setdefault(parent, []).append(title)
+                if title not in seen and title not in exclude:
+                    seen.add(title)
+                    level[title[len(u'Category:'):].replace(u' ', u'_')] = title
+        for v in self.subcategories.itervalues():
+            v.sort()
+
+    def indexFileCategories(self, files):
+        '''list the categories of each of the files'''
+        column = self.categoryColumn()
+        links = []  # (pageId, category name or linktarget id)
+        for member, to in sqlRows(self.dump(u'categorylinks'), ('cl_from', column)):
+            if int(member) in files and to is not None:
+                links.append((int(member), to))
+        if column == 'cl_target_id':
+            targets = self.linkTargets(u'14', ids=set(to for pageId, to in links))
+            links = [(pageId, targets[to]) for pageId, to in links if to in targets]
+        for pageId, to in links:
+            self.fileCategories.setdefault(pageId, []).append(u'Category:%s' % to.replace(u'_', u' '))
+        for v in self.fileCategories.itervalues():
+            v.sort()  # as listed by the api
+
+    def indexPages(self, files):
+        '''look up the files and the pages of their categories and templates'''
+        categories = set(c for cats in self.fileCategories.itervalues() for c in cats)
+        categories.update(self.categories.iterkeys())
+        templates = set(t for temps in self.templates.itervalues() for t in temps)
+        for pageId, ns, title, latest, length in sqlRows(self.dump(u'page'), ('page_id', 'page_namespace', 'page_title',
+                                                                              'page_latest', 'page_len')):
+            if ns == u'6' and int(pageId) in files:
+                self.filePages[int(pageId)] = (u'File:%s' % title.replace(u'_', u' '), int(latest), int(length or 0))
+            elif ns == u'14':
+                title = u'Category:%s' % title.replace(u'_', u' ')
+                if title in categories:
+                    self.existing[title] = int(pageId)
+            elif ns == u'10':
+                title = u'Template:%s' % title.replace(u'_', u' ')
+                if title in templates:
+                    self.existingTemplates[title] = int(pageId)
+
+    def indexHidden(self):
+        '''find which of the categories are hidden'''
+        filename = self.dump(u'page_props', required=False)
+        if filename is None:
+            return
+        titles = dict((v, k) for k, v in self.existing.iteritems())
+        for pageId, name in sqlRows(filename, ('pp_page', 'pp_propname')):
+            if name == u'hiddencat' and int(pageId) in titles:
+                self.hidden.add(titles[int(pageId)])
+
+    def indexTemplates(self, files):
+        '''list the templates used by each of the files'''
+        targets = {}  # linktarget id (as string): list of pageIds, for the newer schema
+        for pageId, ns, title, target in sqlRows(self.dump(u'templatelinks'), ('tl_from', 'tl_namespace', 'tl_title', 'tl_target_id')):
+            pageId = int(pageId)
+            if pageId not in files:
+                continue
+            if target is not None:
+                targets.setdefault(target, []).append(pageId)
+            elif ns == u'10':
+                self.templates.setdefault(pageId, []).append(u'Template:%s' % title.replace(u'_', u' '))
+        if targets:
+            for target, title in self.linkTargets(u'10', ids=targets).iteritems():
+                for pageId in targets[target]:
+                    self.templates.setdefault(pageId, []).append(u'Template:%s' % title.replace(u'_', u' '))
+        for v in self.templates.itervalues():
+            v.sort()  # as listed by the api
+
+    def indexLinks(self):
+        '''list the external links of each of the files (those matching the id-templates)'''
+        for pageId, to, domain, path in sqlRows(self.dump(u'externallinks'), ('el_from', 'el_to', 'el_to_domain_index', 'el_to_path')):
+            pageId = int(pageId)
+            if pageId not in self.filePages:
+                continue
+            if to is None and domain is not None:
+                to = DumpApi.linkFromIndex(domain, path or u'')
+            if to is None:
+                continue  # a row without any link
+            if self.prefixes is not None and not to.encode('utf-8').startswith(self.prefixes):
+                continue
+            self.links.setdefault(pageId, []).append(to)
+
+    @staticmethod
+    def linkFromIndex(domain, path):
+        '''
+        the link of the newer externallinks schema, given as the
+        reversed domain (e.g. https://se.kulturarvsdata.) and the path
+        '''
+        scheme, sep, host = domain.partition(u'://')
+        host = u'.'.join(reversed(host.rstrip(u'.').split(u'.')))
+        return u'%s%s%s%s' % (scheme, sep, host, path)
+
+    def indexImages(self):
+        '''look up the mime type, uploader and time of upload of each of the files'''
+        names = dict((v[0][len(u'File:'):].replace(u' ', u'_'), k) for k, v in self.filePages.iteritems())
+        for name, major, minor, user, timestamp in sqlRows(self.dump(u'image'), ('img_name', 'img_major_mime', 'img_minor_mime',
+                                                                                 'img_user_text', 'img_timestamp')):
+            pageId = names.get(name)
+            if pageId is not None:
+                self.images[pageId] = (u'%s/%s' % (major, minor), user, timestamp)
+
+    def indexTexts(self):
+        '''read the wikitext of each of the files'''
+        filename = None
+        for pattern in (u'*pages-articles*.xml*', u'*pages-meta-current*.xml*'):
+            found = sorted(glob.glob(os.path.join(self.directory, pattern)))
+            if found:
+                filename = found[-1]
+                break
+        if filename is None:
+            raise IOError(u'There is no pages-articles dump in %s' % self.directory)
+        f = openDump(filename)
+        for event, page in etree.iterparse(f, events=('end', ), tag='{*}page'):
+            ns = DumpApi.child(page, 'ns')
+            pageId = DumpApi.child(page, 'id')
+            if ns == u'6' and pageId is not None and int(pageId) in self.filePages:
+                revision = [e for e in page if e.tag.endswith('}revision')]
+                if revision:
+                    contributor = [e for e in revision[-1] if e.tag.endswith('}contributor')]
+                    user = DumpApi.child(contributor[0], 'username') if contributor else None
+                    self.texts[int(pageId)] = (DumpApi.child(revision[-1], 'text') or u'', user)
+            page.clear()
+            while page.getprevious() is not None:
+                del page.getparent()[0]
+        f.close()
+
+    @staticmethod
+    def child(element, name):
+        '''the text of the named child of an element of the xml dump'''
+        for e in element:
+            if e.tag.endswith('}%s' % name):
+                return e.text if isinstance(e.text, unicode) or e.text is None else e.text.decode('utf-8')
+        return None
+
+    # the data of the files, as used by SyntheticApi
+    def members(self, title):
+        return self.categories.get(title)
+
+    def exists(self, pageId):
+        return pageId in self.filePages
+
+    def categoryExists(self, title):
+        return title in self.existing
+
+    def categoryId(self, title):
+        return self.existing.get(title) or SyntheticApi.categoryId(self, title)
+
+    def templateExists(self, title):
+        return title in self.existingTemplates
+
+    def templateId(self, title):
+        return self.existingTemplates.get(title) or SyntheticApi.templateId(self, title)
+
+    def title(self, pageId):
+        return self.filePages[pageId][0]
+
+    def revision(self, pageId):
+        return self.filePages[pageId][1]
+
+    def length(self, pageId):
+        return self.filePages[pageId][2]
+
+    def pageCategories(self, pageId):
+        cats = []
+        for c in self.fileCategories.get(pageId, []):
+            cat = {u'ns': 14, u'title': c}
+            if c in self.hidden:
+                cat[u'hidden'] = u''
+            cats.append(cat)
+        return cats
+
+    def pageTemplates(self, pageId):
+        return [{u'ns': 10, u'title': t} for t in self.templates.get(pageId, [])]
+
+    def pageLinks(self, pageId):
+        return [{u'*': l} for l in self.links.get(pageId, [])]
+
+    def imageInfo(self, pageId):
+        '''the imageinfo of a file, with the extmetadata made up from its wikitext'''
+        title = self.title(pageId)
+        name = title[len(u'File:'):].replace(u' ', u'_')
+        mime, uploader, timestamp = self.images.get(pageId, (u'unknown/unknown', None, None))
+        text, contributor = self.texts.get(pageId, (u'', None))
+        uploader = uploader or contributor or u''
+        digest = hashlib.md5(name.encode('utf-8')).hexdigest()
+        quoted = urllib.quote(name.encode('utf-8'))
+        metadata = {u'CommonsMetadataExtension': {u'value': 1.2, u'source': u'extension', u'hidden': u''},
+                    u'ObjectName': {u'value': os.path.splitext(title[len(u'File:'):])[0], u'source': u'mediawiki-metadata'}}
+        if timestamp:
+            metadata[u'DateTime'] = {u'value': u'%s-%s-%s %s:%s:%s' % (timestamp[0:4], timestamp[4:6], timestamp[6:8],
+                                                                        timestamp[8:10], timestamp[10:12], timestamp[12:14]),
+                                     u'source': u'mediawiki-metadata', u'hidden': u''}
+        info = templateParams(text, (u'information', )) or {}
+        for key, field in ((u'description', u'ImageDescription'), (u'source', u'Credit'), (u'author', u'Artist')):
+            if info.get(key):
+                metadata[field] = {u'value': DumpApi.render(info[key]), u'source': u'commons-desc-page'}
+        if info.get(u'date'):
+            metadata[u'DateTimeOriginal'] = {u'value': DumpApi.renderDate(info[u'date']), u'source': u'commons-desc-page'}
+        metadata.update(self.license(pageId))
+        location = templateParams(text, (u'location', u'location dec', u'camera location'))
+        coordinates = DumpApi.coordinates(location) if location else None
+        if coordinates:
+            metadata[u'GPSLatitude'] = {u'value': u'%.6f' % coordinates[0], u'source': u'commons-desc-page', u'hidden': u''}
+            metadata[u'GPSLongitude'] = {u'value': u'%.6f' % coordinates[1], u'source': u'commons-desc-page', u'hidden': u''}
+            metadata[u'GPSMapDatum'] = {u'value': u'WGS-84', u'source': u'commons-desc-page', u'hidden': u''}
+        return {u'timestamp': u'%s-%s-%sT%s:%s:%sZ' % (timestamp[0:4], timestamp[4:6], timestamp[6:8], timestamp[8:10],
+                                                       timestamp[10:12], timestamp[12:14]) if timestamp else u'',
+                u'user': uploader,
+                u'url': u'https://upload.wikimedia.org/wikipedia/commons/%s/%s/%s' % (digest[0], digest[:2], quoted),
+                u'descriptionurl': u'https://commons.wikimedia.org/wiki/File:%s' % quoted,
+                u'mime': mime,
+                u'extmetadata': metadata}
+
+    def license(self, pageId):
+        '''the license extmetadata of a file, from the preferred one of its license templates'''
+        names = [t[len(u'Template:'):].lower() for t in self.templates.get(pageId, [])]
+        for pattern, shortName, url, copyrighted in DumpApi.LICENSES:  # in order of preference
+            for name in names:
+                m = pattern.match(name)
+                if not m:
+                    continue
+                if url is None and shortName is None:  # a cc-license, given by the name
+                    shortName = u'CC %s %s' % (m.group(1).upper(), m.group(2))
+                    url = u'http://creativecommons.org/licenses/%s/%s' % (m.group(1), m.group(2))
+                    if m.group(3):
+                        url += u'/%s' % m.group(3)
+                metadata = {u'LicenseShortName': {u'value': shortName, u'source': u'commons-desc-page', u'hidden': u''},
+                            u'Copyrighted': {u'value': copyrighted, u'source': u'commons-desc-page', u'hidden': u''}}
+                if url:
+                    metadata[u'LicenseUrl'] = {u'value': url, u'source': u'commons-desc-page', u'hidden': u''}
+                return metadata
+        return {}
+
+    @staticmethod
+    def coordinates(params):
+        '''
+        the coordinates given by the parameters of a location template,
+        in decimal or as degrees, minutes and seconds
+        returns: (latitude, longitude) or None
+        '''
+        values = [params.get(i, u'').strip() for i in range(1, 9)]
+        try:
+            for n in (1, 2, 3):  # deg|NS|deg|EW, deg|min|NS|deg|min|EW or deg|min|sec|NS|deg|min|sec|EW
+                if values[n] in (u'N', u'S'):
+                    lat = sum(float(v or 0) / 60 ** k for k, v in enumerate(values[:n]))
+                    lon = sum(float(v or 0) / 60 ** k for k, v in enumerate(values[n + 1:2 * n + 1]))
+                    return (-lat if values[n] == u'S' else lat, -lon if values[2 * n + 1] == u'W' else lon)
+            return (float(values[0]), float(values[1]))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def render(text):
+        '''
+        the simple html the api would give for some wikitext: links,
+        bold and italics, the text of one language template (English if
+        given) and the own-work template, any other template is dropped
+        '''
+        languages = {}
+        for m in re.finditer(r'\{\{\s*([a-z]{2,3}(?:-[a-z]+)?)\s*\|', text):
+            params = templateParams(text[m.start():], (m.group(1), ))
+            if params and LANGUAGE.match(m.group(1)):
+                languages.setdefault(m.group(1), params.get(1, params.get(u'1', u'')))
+        if languages:
+            text = languages.get(u'en', languages[sorted(languages)[0]])
+        text = re.sub(r'\{\{\s*own(?: work)?\s*\}\}', u'<span class="int-own-work">Own work</span>', text, flags=re.I)
+        while re.search(r'\{\{[^{}]*\}\}', text):
+            text = re.sub(r'\{\{[^{}]*\}\}', u'', text)
+        text = re.sub(r'\[\[([^|\]]+)\|([^\]]+)\]\]', lambda m: u'<a href="//commons.wikimedia.org/wiki/%s" title="%s">%s</a>'
+                      % (m.group(1).strip().replace(u' ', u'_'), m.group(1).strip(), m.group(2)), text)
+        text = re.sub(r'\[\[([^\]]+)\]\]', lambda m: u'<a href="//commons.wikimedia.org/wiki/%s" title="%s">%s</a>'
+                      % (m.group(1).strip().replace(u' ', u'_'), m.group(1).strip(), m.group(1).strip()), text)
+        text = re.sub(r'\[((?:https?:)?//[^ \]]+) ([^\]]+)\]', u'<a rel="nofollow" class="external text" href="\\1">\\2</a>', text)
+        text = re.sub(r"'''(.+?)'''", u'<b>\\1</b>', text)
+        text = re.sub(r"''(.+?)''", u'<i>\\1</i>', text)
+        return text.strip()
+
+    @staticmethod
+    def renderDate(text):
+        '''the html the api would give for the date of an {{Information}}'''
+        m = ISODATE.search(text)
+        if not m:
+            return DumpApi.render(text)
+        date = u'<time class="dtstart" datetime="%s">%s</time>' % (m.group(1), m.group(1))
+        if m.group(2):
+            date += u', %s' % m.group(2)
+        return date
@@ -6,16 +6,11 @@
 # 2014
 #
 # @TODO:
-#   getImageInfos() needs more error handling (based on api replies)
 #   make sure no more TODOs =)
 #
 # Known issues:
 #   Does not deal with multiple licenses - see /w/api.php?action=query&prop=imageinfo&format=json&iiprop=commonmetadata%7Cextmetadata&iilimit=1&titles=File%3AKalmar%20cathedral%20Kalmar%20Sweden%20001.JPG
 #   Only supports Template:Information
-#   Although description is cropped to cc0Length the actual size might be
-#       larger (inclusion of closing tags) or
-#       smaller (removal of started tag definitions).
-#   findOpenTags() assumes each tag is only opened once before closing
 #
 # Notes for future implementation of Template:Artwork - see /w/api.php?action=query&prop=imageinfo&format=json&iiprop=extmetadata&iilimit=1&titles=File%3AAivasovsky_Ivan_Constantinovich_caucasus_from_sea_1899_IBI.jpg
 #   ['extmetadata']['Artist'] referes to original creator (i.e. creator in xml)
@@ -39,22 +34,67 @@ For lazy/frequent use stick username/password on Wikimedia Commons into
 config.py as variables user/password (in unicode). If not pressent then
 getpass is imported and used to prompt for username and password.
 
-Usage: python Europeana.py filename option
-\tfilename (required):\t the (unicode)string relative pathname to the json file for the project
-\toption (optional): can be set to:
+Usage: python Europeana.py filename [filename ...] options
+\tfilename (required):\t the (unicode)string relative pathname to the json file for the project,
+\t\t\t\t several files (or a directory of them) are harvested together as a batch
+\toptions (optional): any of:
 \t\tverbose:\t toggles on verbose mode with additional output to the terminal
 \t\ttest:\t\t toggles on testing (a verbose and limited run)
+\t\tnocache:\t toggles off the persistent response cache
+\t\tincremental:\t only processes files added or changed since the previous incremental harvest
+\t\tresume:\t continues from where an earlier, prematurely terminated, run stopped
+\t\tparsers=N:\t parses the imageinfo in N separate processes
+\t\trecord=FILE:\t saves all api requests and replies to the (gzipped) archive FILE
+\t\treplay=FILE:\t runs offline, serving the api replies saved in FILE
+\t\tsynthetic=N:\t runs offline, against generated api replies for N files
+\t\tdumps=DIR:\t runs offline, against the Commons database dumps in DIR
+\t\tprometheus:\t also writes the metrics of the run as a Prometheus textfile
+\t\tthreadedoutput:\t writes each of the output files on a thread of its own
+\t\tcompress=gzip|xz: compresses the xml and csv output files as they are written
+\t\tshard=N:\t splits the xml output into files of N records, listed in a manifest
 '''
 
 import codecs
 import json
 import datetime  # for timestamps  in log
-import operator  # only used by categoryStatistics
-import WikiApi as wikiApi
+import hashlib  # for the checksums of the manifest
+import httplib  # for api request errors
+import os
+import random  # for the jitter of the retries
+import re  # for creditFilter errors and PrefixIndex
+import sys
+import time
+import threading
+import Queue  # for FetchPool
+import multiprocessing  # for the parse processes
+import sqlite3  # only used for ResponseCache errors
+import zlib  # for the cache kind of filtered imageinfo
+from ResponseCache import ResponseCache
+from ApiBackend import RecordingApi, ReplayApi, SyntheticApi
+from Record import Record
+from RecordSink import RecordSink
+from Statistics import Statistics
+from Metrics import Metrics
+import HtmlFilter
 from lxml import etree  # for xml output
 
 
 class EuropeanaHarvester(object):
+    # api error codes (in addition to internal_api_error_*) and http statuses which may pass if retried
+    RETRY_ERRORS = (u'maxlag', u'ratelimited', u'readonly', u'unknownerror')
+    RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+    # the extmetadata each record field is parsed from, see parseImageInfo
+    EXTMETADATA = {'title': ('ObjectName', ),
+                   'description': ('ImageDescription', ),
+                   'credit': ('Credit', ),
+                   'created': ('DateTimeOriginal', 'DateTimeDigitized', 'DateTime', 'DateTimeMetadata'),
+                   'photographer': ('Artist', ),
+                   'uploader': ('Artist', ),
+                   'copyright': ('LicenseUrl', 'Copyrighted', 'LicenseShortName'),
+                   'usageTerms': ('UsageTerms', ),
+                   'lat': ('GPSLatitude', ),
+                   'lon': ('GPSLongitude', )}
+
     def versionInfo(self):
         '''Version specific variables'''
         self.scriptversion = u'0.6'
@@ -62,28 +102,70 @@ class EuropeanaHarvester(object):
         self.infoTemplate = [u'Template:Information', ]  # supported info templates - based on what is suppported by parseImageInfo
         self.commonsMetadataExtension = 1.2  # the version of the extention for which the script was designed
 
-    def loadVariables(self):
-        '''semi-stable variables which are not project specific'''
+    def loadVariables(self, batch=None):
+        '''
+        semi-stable variables which are not project specific
+        batch: the BatchHarvester from which to share the log and creditFilter
+        '''
         self.dudCategories = ('Media needing categories', )  # non-hidden maintanance categories, matched with startswith()
         self.cc0Length = 200  # max allowed length of description field (for Europeana to claim CC0 on metadata)
-        self.gcmlimit = 250  # Images to process per API request in ImageInfo
+        self.contentBatch = 50  # pageIds to process per API request in getContents
+        self.contentBatchHigh = 500  # as above but if the account has apihighlimits
+        self.pageIdLimit = 50  # max pageIds the api accepts per request, the files are retrieved in parts of this many
+        self.pageIdLimitHigh = 500  # as above but if the account has apihighlimits
+        self.imageInfoBatch = 50  # pageIds per imageinfo request to start from, then adapted to the replies (up to pageIdLimit)
+        self.imageInfoBytes = 2*1024**2  # targeted size (in bytes) of an imageinfo reply
+        self.imageInfoSeconds = 5  # targeted time for an imageinfo reply
+        self.extmetadataLanguage = 'en'  # language in which to retrieve the extmetadata
+        self.extmetadataFilter = EuropeanaHarvester.neededExtmetadata(XMLWriter.FIELDS + CSVWriter.FIELDS)
+        self.extmetadataKind = 'imageinfo-%08x' % (zlib.crc32(self.extmetadataFilter) & 0xffffffff)  # cache kind, per filter
+        self.extmetadataProbe = None  # (filtered, unfiltered) size of the reply probed for the bytes saved
+        self.probeKind = 'probe-%08x' % (zlib.crc32(self.extmetadataFilter) & 0xffffffff)  # cache kind of the probe, per filter
+        self.probeLock = threading.Lock()
+        self.parseChunkSize = 25  # imageinfo entries sent to a parse process at a time
+        self.outputBuffer = 1024**2  # bytes buffered by each of the xml and csv output files
+        self.outputQueue = 1000  # records queued for each output written on a thread of its own
+        self.shardWriters = 4  # xml shards written at once with threadedOutput, see ShardedXMLWriter
+        self.journalFlush = 100  # journal entries written between flushes, at most as many files are retrieved again on resume
         self.logFilename = u'EuropeanaHarvester.log'
         self.siteurl = 'https://commons.wikimedia.org'
+        self.workers = 1  # concurrent api requests, can be overridden by project file
+        self.maxRate = None  # max api requests per second, can be overridden by project file
+        self.burst = 1  # api requests which may be sent at once within maxRate, can be overridden by project file
+        self.maxlag = 5  # seconds of database replication lag at which the api should refuse requests
+        self.retries = 6  # times a failed or refused api request is retried
+        self.backoff = 2  # seconds to wait before the first retry, doubled for each following one
+        self.maxBackoff = 300  # max seconds to wait before a retry
+        self.subcatDepth = 0  # levels of subcategories to harvest, can be overridden by project file
+        self.excludeCats = frozenset()  # subcategories not to harvest, can be overridden by project file
+        self.cacheFilename = u'EuropeanaHarvester.cache'
+        self.cacheMaxAge = 90*24*3600  # seconds an unused reply is kept in the cache
+        self.cacheMaxSize = 2*1024**3  # max size (in bytes) of the replies kept in the cache
         self._test_gcmlimit = 5
         self._test_limit = 15
 
+        if batch:
+            # already opened and loaded once for all projects
+            self.log = batch.log
+            self.creditFilter = batch.creditFilter
+            return
+
         # open logfile first to trigger any errors preventing us from handling later errors
         self.log = codecs.open(self.logFilename, 'a', 'utf-8')
 
         # load creditFilterStrings file. Used to filter credits
         try:
             f = codecs.open(u'creditStrings.json', 'r', 'utf-8')
-            self.creditFilterStrings = json.load(f)['creditStrings']
+            jsonr = json.load(f)
             f.close()
+            # compiled once, removes all of them in a single pass
+            self.creditFilter = HtmlFilter.Remover(jsonr['creditStrings'], jsonr.get('creditPatterns', []))
         except IOError, e:
             raise KillException(u'Error opening creditFilterStrings file: %s' % e)
         except (ValueError, KeyError), e:
             raise KillException(u'Error processing creditFilterStrings file as the expected json. Are you sure it is still valid?: %s' % e)
+        except re.error, e:
+            raise KillException(u'Error compiling the creditFilterStrings: %s' % e)
 
     def loadProject(self, project, test):
         '''
@@ -154,47 +236,116 @@ class EuropeanaHarvester(object):
                 if type(s) not in (str, unicode):
                     raise KillException(formaterror)
             self.idTemplates[k] = tuple(v)
+        self.idPrefixes = PrefixIndex(self.idTemplates)  # so that each extlink is matched only once
+
+        # workers - optional
+        p = u'workers'
+        if p in jsonr.keys():
+            if type(jsonr[p]) != int or jsonr[p] < 1:
+                raise KillException(u'Parameter "%s" in project file must be a positive integer' % p)
+            self.workers = jsonr[p]
+
+        # max-requests-per-second - optional
+        p = u'max-requests-per-second'
+        if p in jsonr.keys():
+            if type(jsonr[p]) not in (int, float) or jsonr[p] <= 0:
+                raise KillException(u'Parameter "%s" in project file must be a positive number' % p)
+            self.maxRate = jsonr[p]
+
+        # request-burst - optional
+        p = u'request-burst'
+        if p in jsonr.keys():
+            if type(jsonr[p]) != int or jsonr[p] < 1:
+                raise KillException(u'Parameter "%s" in project file must be a positive integer' % p)
+            self.burst = jsonr[p]
+
+        # subcategory-depth - optional
+        p = u'subcategory-depth'
+        if p in jsonr.keys():
+            if type(jsonr[p]) != int or jsonr[p] < 0:
+                raise KillException(u'Parameter "%s" in project file must be a non-negative integer' % p)
+            self.subcatDepth = jsonr[p]
+
+        # exclude-categories - optional
+        p = u'exclude-categories'
+        if p in jsonr.keys():
+            formaterror = u'Parameter "%s" in project file must be a list of (unicode)strings' % p
+            if type(jsonr[p]) != list:
+                raise KillException(formaterror)
+            for s in jsonr[p]:
+                if type(s) not in (str, unicode):
+                    raise KillException(formaterror)
+                if not s.startswith(u'Category:'):
+                    raise KillException(u'Category names must include "Category:"-prefix')
+            self.excludeCats = frozenset(jsonr[p])
         # success
 
-    def __init__(self, project, verbose=False, test=False):
+    # attributes needed by parseImageInfo, handed to the parse processes
+    PARSER_SETTINGS = ('commonsMetadataExtension', 'cc0Length', 'creditFilter')
+
+    def __init__(self, project, verbose=False, test=False, cache=True, incremental=False, resume=False, parsers=0,
+                 api=None, record=None, prometheus=False, threadedOutput=False, compress=None, shard=0,
+                 batch=None):
         '''
         Sets up environment, loads project file, triggers run/test
         Requires one parameter:
         project: the (unicode)string relative pathname to the project json file
+        Optional parameters:
+        cache: whether to use the persistent response cache
+        incremental: whether to only process files changed since the previous (incremental) harvest
+        resume: whether to continue from where an earlier, terminated, run stopped
+        parsers: number of processes used for parsing imageinfo (0 to parse in this process)
+        api: a stand-in for the api used instead of logging in, see ApiBackend
+        record: the (unicode)string pathname of an archive to which all api
+                requests and replies are saved, see ApiBackend.RecordingApi
+        prometheus: whether to also write the metrics as a Prometheus textfile
+        threadedOutput: whether to write each of the outputs on a thread of its own
+        compress: None, 'gzip' or 'xz', how to compress the xml and csv outputs
+        shard: if not 0, the max number of records per xml file, the files
+               are then listed in a manifest (as they are if compressed)
+        batch: the BatchHarvester running this project together with
+               others, only the project and its output files are then
+               loaded and the batch triggers the run
         '''
         self.versionInfo()
         try:
-            self.loadVariables()  # also opens self.log
+            self.loadVariables(batch)  # also opens self.log
         except KillException, e:
             self.log.write(u'%s\n' % e)
             exit(1)
-        self.data = {}  # container for all the info, using pageid as its key
+        self.data = {}  # container for the info of the files being processed, using pageid as its key
+        self.seen = set()  # pageids which have already been processed (or are being so)
+        self.knownPages = {}  # category or template title: whether the page exists
+        self.revisions = {}  # latest revision of each file being processed, using pageid as its key
+        self.incremental = incremental
+        self.resume = resume
+        self.metrics = Metrics()
+        self.prometheus = prometheus
+        self.threadedOutput = threadedOutput
+        self.compress = compress
+        self.shard = shard
         try:
             self.loadProject(project, test)
         except KillException, e:
             self.log.write(u'Error loading project file: %s\n' % e)
             exit(1)
 
+        self.stateFilename = u'%s.state' % self.output  # only used for incremental harvests
+        if batch:
+            self.openFiles()
+            self.log.write(u'%s: Successfully loaded "%s" for a batch %srun.\n' % (datetime.datetime.utcnow(), self.projName, 'test ' if test else ''))
+            return
+
+        self.startParsers(parsers)
+        self.pool = FetchPool(self.workers)
+        self.rateLimiter = RateLimiter(self.maxRate, self.burst)
+
         # confirm succesful load to log together with timestamp
         self.log.write(u'-----------------------\n%s: Successfully loaded "%s" %srun.\n' % (datetime.datetime.utcnow(), self.projName, 'test ' if test else ''))
 
-        # Look for config file and connect to api
-        scriptidentify = u'%s/%s' % (self.scriptname, self.scriptversion)
-        try:
-            import config
-            self.wpApi = wikiApi.WikiApi.setUpApi(user=config.user, password=config.password, site=self.siteurl, scriptidentify=scriptidentify)
-        except ImportError:
-            from getpass import getpass  # not needed if config file exists
-            self.wpApi = wikiApi.WikiApi.setUpApi(user=getpass(u'Username:'), password=getpass(), site=self.siteurl, scriptidentify=scriptidentify)
-
-        # Create output files (so that any errors occur before the actual run)
-        try:
-            self.fStat = codecs.open(u'%s-CategoryStatistics.csv' % self.output, 'w', 'utf-8')
-            self.fXML = codecs.open(u'%s.xml' % self.output, 'w', 'utf-8')
-            self.fCSV = codecs.open(u'%s.csv' % self.output, 'w', 'utf-8')
-        except IOError, e:
-            self.log.write(u'Error creating output files: %s\n' % e)
-            exit(1)
+        self.connect(api, record)
+        self.openFiles()
+        self.openCache(cache)
 
         # ready to run
         try:
@@ -206,98 +357,352 @@ class EuropeanaHarvester(object):
             if verbose:
                 print u'Terminated prematurely, please check log file'
             self.log.write(u'Error during run: %s\n' % e)
+            self.journal.close()
+            self.writeMetrics()
+            self.closeCache()
+            self.closeApi()
+            self.closeParsers(terminate=True)
             exit(1)
         else:
             # confirm sucessful ending to log together with timestamp
             if verbose:
                 print u'Successfully reached end of run'
             self.log.write(u'%s: Successfully reached end of %srun.\n' % (datetime.datetime.utcnow(), 'test ' if test else ''))
+            self.journal.close(remove=True)
+            self.writeMetrics(verbose=verbose)
 
         # done
+        self.closeCache()
+        self.closeApi()
+        self.closeParsers()
         self.log.close()
 
-    def run(self, verbose=False, testing=False):
+    def startParsers(self, parsers):
         '''
-        Runs through the specified categories, sets up a dict with the
-        imageinfo for each image then checks the parsed content for
-        each image page to identify any of the specified id-templates
-        and if found stores the associate sourcelink.
+        start the parse processes, if any. Must be done before any
+        threads or connections are started, since these should not be
+        forked.
+        parsers: number of processes (0 to parse in this process)
+        returns: Nothing
         '''
-        # Retrieve all ImageInfos
-        imageInfo = {}
-        for basecat in self.baseCats:
-            if verbose:
-                print u'Retrieving ImageInfo for %s...' % basecat
+        self.parsePool = None
+        if parsers:
+            settings = dict((k, getattr(self, k)) for k in EuropeanaHarvester.PARSER_SETTINGS)
+            self.parsePool = multiprocessing.Pool(parsers, initializer=initParser, initargs=(settings, ))
+
+    def connect(self, api=None, record=None):
+        '''
+        log in to the api, using the config file if there is one
+        api: a stand-in for the api used instead of logging in
+        record: the (unicode)string pathname of an archive to which all
+                requests and replies are saved
+        returns: Nothing
+        '''
+        if api is not None:
+            self.wpApi = api
+        else:
+            import WikiApi as wikiApi  # not needed for a stand-in
+            scriptidentify = u'%s/%s' % (self.scriptname, self.scriptversion)
             try:
-                self.getImageInfos(basecat, imageInfo=imageInfo, verbose=verbose, testing=testing)
-            except KillException, e:
-                self.log.write(u'Terminating: Error retrieving imageInfos: %s\n' % e)
-                raise
+                import config
+                self.wpApi = wikiApi.WikiApi.setUpApi(user=config.user, password=config.password, site=self.siteurl, scriptidentify=scriptidentify)
+            except ImportError:
+                from getpass import getpass  # not needed if config file exists
+                self.wpApi = wikiApi.WikiApi.setUpApi(user=getpass(u'Username:'), password=getpass(), site=self.siteurl, scriptidentify=scriptidentify)
+        self.recording = None
+        if record:
+            try:
+                self.wpApi = self.recording = RecordingApi(self.wpApi, record)
+            except IOError, e:
+                self.log.write(u'Error creating api archive: %s\n' % e)
+                exit(1)
+        self.setApiLimits()
+
+    def closeApi(self):
+        '''
+        finish the archive of the api replies, if these are recorded
+        returns: Nothing
+        '''
+        if self.recording:
+            self.recording.close()
+            self.log.write(u'Recorded %d api requests\n' % self.recording.count)
+            self.recording = None
+
+    def writeMetrics(self, verbose=False):
+        '''
+        write the metrics of the run next to the output files, see Metrics
+        returns: Nothing
+        '''
+        self.metrics.end()
+        self.metrics.add('extmetadata-bytes-saved', self.extmetadataSaved())
+        report = self.metrics.report()
+        self.log.write(u'Sent %d api requests (%d bytes of imageinfo, about %d fewer by filtering the extmetadata) and output %d records in %.1f s\n' % (report['total-requests'], report['counters'].get('extmetadata-filtered-bytes', 0), report['counters']['extmetadata-bytes-saved'], report['records'], report['seconds']))
+        try:
+            self.metrics.write(self.output, self.projName, prometheus=self.prometheus)
+        except (IOError, OSError), e:
+            self.log.write(u'Error writing metrics: %s\n' % e)
+            return
+        if verbose:
+            print u'Wrote metrics to %s-metrics.json' % self.output
+
+    def openFiles(self):
+        '''
+        create the output files and open the journal (so that any
+        errors occur before the actual run)
+        returns: Nothing
+        '''
+        extension = OutputFile.EXTENSIONS[self.compress]
+        self.xmlName = u'%s%s.xml%s' % (self.output, '-*' if self.shard else '', extension)
+        self.csvName = u'%s.csv%s' % (self.output, extension)
+        self.deltaName = u'%s-delta.xml%s' % (self.output, extension)
+        try:
+            # each record is handed once to all of the outputs, see RecordFanOut
+            self.outputs = RecordFanOut()
+            self.outputs.add('statistics', Statistics(self.output))
+            checksum = bool(self.shard or self.compress)  # only needed for the manifest, see endOutput
+            if self.shard:
+                xml = ShardedXMLWriter(self.output, self.shard, self.shardWriters, buffering=self.outputBuffer,
+                                       compression=self.compress, queue=self.threadedOutput and self.outputQueue)
+            else:
+                xml = XMLWriter(u'%s.xml' % self.output, self.outputBuffer, self.compress, checksum)
+            csv = CSVWriter(u'%s.csv' % self.output, self.outputBuffer, self.compress, checksum)
+            self.outputs.add('xml', xml)
+            self.outputs.add('csv', csv)
+            self.manifested = [('xml', xml), ('csv', csv)]  # the outputs listed in the manifest
+            if self.incremental:
+                delta = XMLWriter(u'%s-delta.xml' % self.output, self.outputBuffer, self.compress, checksum)
+                self.outputs.add('delta', delta, fresh=True)
+                self.manifested.append(('delta', delta))
+                self.fRemoved = codecs.open(u'%s-removed.csv' % self.output, 'w', 'utf-8')
+                self.fState = open(u'%s.tmp' % self.stateFilename, 'w')
+        except IOError, e:
+            self.log.write(u'Error creating output files: %s\n' % e)
+            exit(1)
+
+        try:
+            self.journal = Journal(u'%s.journal' % self.output, resume=self.resume, flushEvery=self.journalFlush)
+        except IOError, e:
+            self.log.write(u'Error opening journal: %s\n' % e)
+            exit(1)
 
-        # parse all ImageInfos
+    def openCache(self, cache):
+        '''
+        open the response cache
+        cache: whether to use the cache
+        returns: Nothing
+        '''
+        self.cache = None
+        if cache:
+            try:
+                self.cache = ResponseCache(self.cacheFilename, maxAge=self.cacheMaxAge, maxSize=self.cacheMaxSize)
+            except sqlite3.Error, e:
+                self.log.write(u'Error opening cache: %s\n' % e)
+                exit(1)
+
+    def closeCache(self):
+        '''
+        log the hits and misses of the response cache, then close it
+        returns: Nothing
+        '''
+        if self.cache:
+            self.log.write(u'Cache %s\n' % self.cache.stats())
+            self.log.write(u'Cache evicted %d entries\n' % self.cache.close())
+            self.cache = None
+
+    def closeParsers(self, terminate=False):
+        '''
+        stop the parse processes
+        terminate: whether to stop them without waiting for running tasks
+        returns: Nothing
+        '''
+        if self.parsePool:
+            if terminate:
+                self.parsePool.terminate()
+            else:
+                self.parsePool.close()
+            self.parsePool.join()
+            self.parsePool = None
+
+    def run(self, verbose=False, testing=False):
+        '''
+        Lists the files in the specified categories, then retrieves the
+        imageinfo for the unique files one part at a time. Each part is
+        parsed, then the parsed content of each image page is checked
+        to identify any of the specified id-templates and if found
+        stores the associate sourcelink. The finished records are
+        output right away so that only the current parts are kept in
+        memory.
+        '''
+        self.startOutput()
+        with self.metrics.phase('categories'):
+            self.categories = self.expandCategories(verbose=verbose)
+
+        # output the records of an earlier, terminated, run
+        if self.resume:
+            self.replayJournal()
+
+        # list the files of all categories first, so that files found
+        # in several categories are only retrieved once
+        with self.metrics.phase('categories'):
+            members = self.listMembers(verbose=verbose, testing=testing)
+        if self.incremental:
+            # reuse records of unchanged files, retrieve only new or changed ones
+            pageIds = self.reuseState(members, verbose=verbose)
+        else:
+            pageIds = sorted(p for p in members.iterkeys() if p not in self.seen)  # skip files output before resuming
+
+        # Retrieve all ImageInfos together with the content of those pages
         if verbose:
-            print u'Parsing ImageInfo...'
+            print u'Retrieving ImageInfo for %d files...' % len(pageIds)
+        batches = [dict((p, members[p]) for p in pageIds[i:i + self.pageIdLimit]) for i in range(0, len(pageIds), self.pageIdLimit)]
+        parts = self.pool.imap(self.harvestPages, batches)
+
+        # process each part as soon as it has been retrieved
         counter = 0
-        for k, v in imageInfo.iteritems():
-            counter += 1
-            if verbose and (counter % 250) == 0:
-                print u'parsed %d out of %d' % (counter, len(imageInfo))
+        while True:
             try:
-                self.parseImageInfo(v)
+                batch, (imageInfo, contents) = parts.next()
+            except StopIteration:
+                break
             except KillException, e:
-                self.log.write(u'Terminating: error parsing imageInfos: %s\n' % e)
+                self.log.write(u'Terminating: Error retrieving imageInfos/content: %s\n' % e)
                 raise
-            except SkipException, e:
-                self.log.write(u'Skipping: error parsing imageInfos: %s\n' % e)
+            counter += self.processPart(imageInfo, contents)
+            if verbose:
+                print u'Processed %d out of %d files' % (counter, len(pageIds))
 
-        # add data from content
+        # close filewriters
+        self.endOutput()
         if verbose:
-            print u'Retrieving content...'
-        counter = 0
-        unsupported = []
-        for k in self.data.keys():
-            counter += 1
-            if verbose and (counter % 100) == 0:
-                print u'Retrieved %d out of %d' % (counter, len(self.data))
-            # get content for that pageID (can only retrieve one at a time)
+            print u'Wrote to %s, %s and %s-*Statistics.csv' % (self.xmlName, self.csvName, self.output)
+            if self.incremental:
+                print u'Wrote changes to %s and %s-removed.csv' % (self.deltaName, self.output)
+            if self.shard or self.compress:
+                print u'Listed the output files in %s-manifest.json' % self.output
+        # success
+
+    def harvestPages(self, members):
+        '''
+        given a dict of revIds (with pageId as key) this retrieves the
+        imageinfo and content of those files
+        returns: (imageinfo, contents), see lookupImageInfos and getContents
+        raises: KillException
+        '''
+        with self.metrics.phase('imageinfo'):
+            imageInfo = self.lookupImageInfos(members)
+        with self.metrics.phase('content'):
+            contents = self.getContents(members.keys())
+        return imageInfo, contents
+
+    def processPart(self, imageInfo, contents):
+        '''
+        parse a part of the retrieved imageinfo along with the content
+        of the same pages and output the resulting records. Files which
+        have already been processed (e.g. through another category) are
+        ignored.
+        returns: the number of processed files
+        raises: KillException
+        '''
+        entries = []
+        for k, v in imageInfo.iteritems():
+            k = int(k)
+            if k in self.seen:
+                continue
+            self.seen.add(k)
+            entries.append((k, v))
+
+        for k, skip in self.parseImageInfos(entries):
+            if skip is not None:
+                self.log.write(u'Skipping: error parsing imageInfos: %s\n' % skip)
+                with self.metrics.phase('journal'):
+                    self.journal.write(type='skip', pageid=k, revid=self.revisions.get(k), reason=skip.reason)
+                self.outputRecord(k, None, reason=skip.reason)
+                continue
+
+            # add data from content
             try:
-                content = self.getContent(k)
-                self.parseContent(k, content)
+                if k not in contents:
+                    raise SkipException(u'The API did not return any content for this pageId', u'no content')
+                with self.metrics.phase('parse'):
+                    self.parseContent(k, contents[k])
             except SkipException, e:
                 self.log.write(u'Error retrieving/parsing content for PageId %d (%s), removing from dataset: %s\n' % (k, self.data[k]['title'], e))
-                unsupported.append(k)
+                del self.data[k]
+                with self.metrics.phase('journal'):
+                    self.journal.write(type='skip', pageid=k, revid=self.revisions.get(k), reason=e.reason)
+                self.outputRecord(k, None, reason=e.reason)
+                continue
             except KillException, e:
                 self.log.write(u'Serious error retrieving/parsing content for PageId %d (%s), terminating: %s\n' % (k, self.data[k]['title'], e))
                 raise
 
-        # remove problematic entries
-        for k in unsupported:
-            del self.data[k]
+            record = Record(**self.data.pop(k))
+            with self.metrics.phase('journal'):
+                self.journal.write(type='record', pageid=k, revid=self.revisions.get(k), record=record.toDict())
+            self.outputRecord(k, record)
+        return len(entries)
 
-        # output data and close filewriters
-        self.outputCatStat(f=self.fStat)
-        self.outputXML(f=self.fXML)
-        self.outputCSV(f=self.fCSV)
-        if verbose:
-            print u'Wrote to %s.xml, %s.csv and %s-CategoryStatistics.csv' % (self.output, self.output, self.output)
-        # success
+    def parseImageInfos(self, entries):
+        '''
+        parse the imageinfo of several files, in the parse processes
+        if there are any. The parsed files are added to data and any
+        log messages are written in the order of the files.
+        entries: list of (pageId, imageinfo) tuples
+        returns: generator of (pageId, SkipException or None) in the same order
+        raises: KillException
+        '''
+        try:
+            if not self.parsePool:
+                for k, v in entries:
+                    try:
+                        with self.metrics.phase('parse'):
+                            self.parseImageInfo(v)
+                    except SkipException, e:
+                        yield k, e
+                    else:
+                        yield k, None
+                return
 
-    def getImageInfos(self, maincat, imageInfo={}, verbose=False, testing=False):
+            chunks = [entries[i:i + self.parseChunkSize] for i in range(0, len(entries), self.parseChunkSize)]
+            with self.metrics.phase('parse'):
+                results = self.parsePool.map_async(parseImageInfoChunk, chunks).get(timeout=7*24*3600)  # timeout allows for KeyboardInterrupt
+        except KillException, e:
+            self.log.write(u'Terminating: error parsing imageInfos: %s\n' % e)
+            raise
+        for chunk in results:
+            for k, fields, skip, messages in chunk:
+                for m in messages:
+                    self.log.write(m)
+                if fields is not None:
+                    self.data[k] = fields
+                yield k, SkipException(*skip) if skip else None
+
+    def parseChunk(self, chunk):
         '''
-        given a single category this queries the MediaWiki api for
-        the parsed content of that page
-        returns: Nothing
+        parse a chunk of imageinfo in a parse process, collecting the
+        log messages rather than writing them
+        chunk: list of (pageId, imageinfo) tuples
+        returns: list of (pageId, parsed data or None, (skip message, reason) or None, log messages)
         raises: KillException
         '''
-        # @TODO: needs more error handling (based on api replies)
-        # Allows overriding gcmlimit for testing
-        gcmlimit = self.gcmlimit
-        if testing:
-            gcmlimit = self._test_gcmlimit
+        results = []
+        for k, v in chunk:
+            skip = None
+            try:
+                self.parseImageInfo(v)
+            except SkipException, e:
+                skip = (unicode(e), e.reason)
+            results.append((k, self.data.pop(k, None), skip, self.log.take()))
+        return results
 
-        # test that category exists and check number of entries
+    def checkCategory(self, maincat, verbose=False):
+        '''
+        test that category exists and check number of entries
+        returns: the number of files in the category
+        raises: KillException
+        '''
         # /w/api.php?action=query&prop=categoryinfo&format=json&titles=Category%3AImages%20from%20Wiki%20Loves%20Monuments%202013%20in%20Sweden
-        jsonr = self.wpApi.httpGET("query", [('prop', 'categoryinfo'),
+        jsonr = self.apiGET("query", [('prop', 'categoryinfo'),
                                         ('titles', maincat.encode('utf-8'))
                                        ])
         jsonr = jsonr['query']['pages'].iteritems().next()[1]
@@ -306,67 +711,516 @@ class EuropeanaHarvester(object):
             raise KillException(u'The category "%s" does not exist' % maincat)
         total = jsonr['categoryinfo']['files']
         if verbose:
-            print u'The category "%s" contains %d files and %d subcategories (the latter will not be checked)' % (maincat, total, jsonr['categoryinfo']['subcats'])
-
-        # then start retrieving info
-        # /w/api.php?action=query&prop=imageinfo&format=json&iiprop=user%7Curl%7Cmime%7Cextmetadata&iilimit=1&generator=categorymembers&gcmtitle=Category%3AImages%20from%20Wiki%20Loves%20Monuments%202013%20in%20Sweden&gcmprop=title&gcmnamespace=6&gcmlimit=50
-        jsonr = self.wpApi.httpGET("query", [('prop', 'imageinfo'),
-                                        ('iiprop', 'user|url|mime|extmetadata'),
-                                        ('iilimit', '1'),
-                                        ('generator', 'categorymembers'),
-                                        ('gcmprop', 'title'),
-                                        ('gcmnamespace', '6'),
-                                        ('rawcontinue', ''),
-                                        ('gcmlimit', str(gcmlimit)),
-                                        ('gcmtitle', maincat.encode('utf-8'))
-                                       ])
-        # @TODO: check for error, if found raise KillException
-        # store (part of) the json
-        imageInfo.update(jsonr['query']['pages'])  # a dict where pageId is the key
+            print u'The category "%s" contains %d files and %d subcategories' % (maincat, total, jsonr['categoryinfo']['subcats'])
+        return total
 
-        # while continue get the rest
-        counter = 0
-        while('query-continue' in jsonr.keys()):
-            counter += gcmlimit
-            if verbose:
-                print u'Retrieved %d out of %d (roughly)' % (counter, total)
-            jsonr = self.wpApi.httpGET("query", [('prop', 'imageinfo'),
-                                            ('iiprop', 'user|url|mime|extmetadata'),
-                                            ('iilimit', '1'),
-                                            ('generator', 'categorymembers'),
-                                            ('gcmprop', 'title'),
-                                            ('gcmnamespace', '6'),
-                                            ('rawcontinue', ''),
-                                            ('gcmlimit', str(gcmlimit)),
-                                            ('gcmcontinue', jsonr['query-continue']['categorymembers']['gcmcontinue']),
-                                            ('gcmtitle', maincat.encode('utf-8'))
-                                           ])
-            # @TODO: check for error, if found raise KillException
-            # store (part of) json
-            imageInfo.update(jsonr['query']['pages'])
-            if testing and counter > self._test_limit:
-                break  # shorter runs for testing
-        # sucessfully reached end
+    def getSubcategories(self, maincat):
+        '''
+        given a single category this queries the MediaWiki api for
+        its subcategories
+        returns: list of category titles
+        raises: KillException
+        '''
+        # /w/api.php?action=query&list=categorymembers&format=json&cmtitle=Category%3AImages%20from%20Wiki%20Loves%20Monuments%202013%20in%20Sweden&cmtype=subcat&cmprop=title&cmlimit=max&continue=
+        params = [('list', 'categorymembers'),
+                  ('cmtype', 'subcat'),
+                  ('cmprop', 'title'),
+                  ('cmlimit', 'max'),
+                  ('cmtitle', maincat.encode('utf-8'))
+                  ]
+        subcats = []
+        cont = {'continue': ''}
+        while cont:
+            jsonr = self.apiGET("query", params + EuropeanaHarvester.continueParams(cont))
+            if 'error' in jsonr.keys():
+                raise KillException(u'API error when listing subcategories of "%s": %s' % (maincat, jsonr['error']['info']))
+            subcats += [v['title'] for v in jsonr['query']['categorymembers']]
+            cont = jsonr.get('continue')
+        return subcats
+
+    def expandCategories(self, verbose=False):
+        '''
+        walks the subcategories of the base categories breadth-first,
+        down to subcatDepth levels, retrieving the subcategories of all
+        categories on the same level concurrently. Excluded categories
+        (and their subcategories) are skipped and a category reached
+        through several paths, e.g. through a cycle, is only included
+        once.
+        returns: list of categories to harvest, base categories first
+        raises: KillException
+        '''
+        categories = list(self.baseCats)
+        visited = set(categories)
+        level = categories
+        for depth in range(self.subcatDepth):
+            if not level:
+                break
+            found = dict(self.pool.imap(self.getSubcategories, level))
+            nextLevel = []
+            for parent in level:  # in a stable order regardless of which reply came first
+                for cat in found[parent]:
+                    if cat in self.excludeCats:
+                        self.log.write(u'Skipping excluded subcategory "%s" of "%s"\n' % (cat, parent))
+                    elif cat in visited:
+                        if verbose:
+                            print u'The subcategory "%s" of "%s" has already been included' % (cat, parent)
+                    else:
+                        visited.add(cat)
+                        nextLevel.append(cat)
+            categories += nextLevel
+            level = nextLevel
+        if verbose and self.subcatDepth:
+            print u'Harvesting %d base categories and %d subcategories' % (len(self.baseCats), len(categories) - len(self.baseCats))
+        return categories
+
+    def listMembers(self, verbose=False, testing=False):
+        '''
+        lists the current files in all of the categories (including any
+        subcategories), each file only once even if found in several of
+        them. The revisions are only listed if needed for the cache or
+        an incremental harvest.
+        returns: dict of revIds (or None), with pageId as key
+        raises: KillException
+        '''
+        revisions = bool(self.cache) or self.incremental
+
+        def listCategory(maincat):
+            self.checkCategory(maincat, verbose=verbose)
+            return self.getMembers(maincat, testing=testing, revisions=revisions)
+
+        if verbose:
+            print u'Listing files in %d categories...' % len(self.categories)
+        members = {}
+        listed = 0
+        for basecat, m in self.pool.imap(listCategory, self.categories):
+            listed += len(m)
+            members.update(m)
+        if verbose:
+            print u'Found %d unique files out of %d listed' % (len(members), listed)
+        return members
 
-    def getContent(self, pageId):
+    def reuseState(self, members, verbose=False):
         '''
-        given a pageId this queries the MediaWiki api for the
-        parsed content of that page
-        returns: content
-        raises: SkipException, KillException
+        goes through the state of the previous harvest and compares it
+        to the current files. The records of unchanged files are output
+        again and those of removed files are listed as such.
+        returns: list of pageIds which are new or have changed
+        raises: KillException
         '''
-        # /w/api.php?action=parse&format=json&pageid=27970534&prop=categories%7Ctemplates%7Cexternallinks
-        jsonr = self.wpApi.httpGET("parse", [('prop', 'categories|templates|externallinks'),
-                                             ('pageid', str(pageId))
-                                            ])
+        unchanged = 0
+        removed = 0
+        if os.path.exists(self.stateFilename):
+            try:
+                f = codecs.open(self.stateFilename, 'r', 'utf-8')
+                for line in f:
+                    e = json.loads(line)
+                    k = e['pageid']
+                    if k not in members:
+                        removed += 1
+                        if e['record'] is not None:
+                            self.outputRemoved(self.fRemoved, k, e['record'])
+                    elif members[k] == e['revid'] and k not in self.seen:
+                        unchanged += 1
+                        self.seen.add(k)
+                        record = Record.fromDict(e['record']) if e['record'] is not None else None
+                        self.outputRecord(k, record, revId=e['revid'], harvested=e['harvested'], reason=e.get('reason'))
+                f.close()
+            except IOError, e:
+                raise KillException(u'Error opening state file: %s' % e)
+            except ValueError, e:
+                raise KillException(u'Error processing state file as json. Are you sure it is valid?: %s' % e)
+
+        changed = [k for k in members.iterkeys() if k not in self.seen]
+        if verbose:
+            print u'%d new or changed files, %d unchanged and %d removed since the last harvest' % (len(changed), unchanged, removed)
+        return changed
 
-        # check for error
-        if 'error' in jsonr.keys():
-            raise SkipException(jsonr['error']['info'])
-        elif 'parse' in jsonr.keys():
-            return jsonr['parse']
+    def getMembers(self, maincat, testing=False, revisions=True):
+        '''
+        given a single category this queries the MediaWiki api for
+        the current revision of all files in that category
+        revisions: whether to look up the revisions, otherwise only the
+                   pageIds are listed (up to 5000 per request)
+        returns: dict of revIds (or None), with pageId as key
+        raises: KillException
+        '''
+        limit = str(self._test_gcmlimit) if testing else 'max'
+        if revisions:
+            # /w/api.php?action=query&prop=info&format=json&generator=categorymembers&gcmtitle=Category%3AImages%20from%20Wiki%20Loves%20Monuments%202013%20in%20Sweden&gcmprop=ids&gcmnamespace=6&gcmlimit=max&continue=
+            params = [('prop', 'info'),
+                      ('generator', 'categorymembers'),
+                      ('gcmprop', 'ids'),
+                      ('gcmnamespace', '6'),
+                      ('gcmlimit', limit),
+                      ('gcmtitle', maincat.encode('utf-8'))
+                      ]
         else:
-            raise KillException(u'API parse reply did not contain "error"-key but also not "parse"-key. Unexpected and probably means something went really wrong')
+            # /w/api.php?action=query&list=categorymembers&format=json&cmtitle=Category%3AImages%20from%20Wiki%20Loves%20Monuments%202013%20in%20Sweden&cmprop=ids&cmtype=file&cmlimit=max&continue=
+            params = [('list', 'categorymembers'),
+                      ('cmprop', 'ids'),
+                      ('cmtype', 'file'),
+                      ('cmlimit', limit),
+                      ('cmtitle', maincat.encode('utf-8'))
+                      ]
+        members = {}
+        cont = {'continue': ''}
+        while cont:
+            jsonr = self.apiGET("query", params + EuropeanaHarvester.continueParams(cont))
+            if 'error' in jsonr.keys():
+                raise KillException(u'API error when listing "%s": %s' % (maincat, jsonr['error']['info']))
+            if revisions:
+                for v in jsonr.get('query', {}).get('pages', {}).itervalues():  # no query-key if the category is empty
+                    members[v['pageid']] = v['lastrevid']
+            else:
+                for v in jsonr['query']['categorymembers']:
+                    members[v['pageid']] = None
+            cont = jsonr.get('continue')
+            if testing and len(members) > self._test_limit:
+                break  # shorter runs for testing
+        return members
+
+    def getPageImageInfos(self, pageIds):
+        '''
+        given a list of pageIds this queries the MediaWiki api for
+        the imageinfo of those files
+        returns: dict of imageinfo, with pageId as key
+        raises: KillException
+        '''
+        # /w/api.php?action=query&prop=imageinfo%7Cinfo&format=json&iiprop=user%7Curl%7Cmime%7Cextmetadata&iilimit=1&iiextmetadatafilter=Artist%7CCredit&iiextmetadatalanguage=en&continue=&pageids=27970534%7C27970535
+        imageInfo = {}
+        i = 0
+        while i < len(pageIds):
+            # as many files per request as recent replies suggest, see PageSizer
+            part = pageIds[i:i + self.imageInfoSizer.size()]
+            i += len(part)
+            params = [('prop', 'imageinfo|info'),
+                      ('iiprop', 'user|url|mime|extmetadata'),
+                      ('iilimit', '1'),
+                      ('iiextmetadatafilter', self.extmetadataFilter),
+                      ('iiextmetadatalanguage', self.extmetadataLanguage),
+                      ('pageids', '|'.join(str(p) for p in part))
+                      ]
+            batch = {}
+            cont = {'continue': ''}
+            first = True
+            while cont:
+                jsonr, seconds, size = self.measuredGET("query", params + EuropeanaHarvester.continueParams(cont))
+                if 'error' in jsonr.keys():
+                    raise KillException(u'API error when retrieving imageInfos: %s' % jsonr['error']['info'])
+                for k, v in jsonr['query']['pages'].iteritems():
+                    if 'missing' not in v.keys() and 'invalid' not in v.keys():
+                        batch.setdefault(k, {}).update(v)
+                cont = jsonr.get('continue')
+                if 'warnings' in jsonr.keys():
+                    self.log.write(u'API warning when retrieving imageInfos for %d files: %s\n' % (len(part), jsonr['warnings']))
+                self.metrics.add('extmetadata-filtered-bytes', size)
+                if first:
+                    # a reply cut short by the size limit of the api (or with warnings) asks for fewer files
+                    if cont or 'warnings' in jsonr.keys():
+                        self.imageInfoSizer.backOff(len(part))
+                    else:
+                        self.imageInfoSizer.observe(len(part), seconds, size)
+                        self.probeExtmetadata(params, size)
+                    first = False
+            self.storeImageInfos(batch)
+            imageInfo.update(batch)
+        return imageInfo
+
+    def probeExtmetadata(self, params, size):
+        '''
+        send an imageinfo request again without the extmetadata filter,
+        to estimate the bytes saved by the filter. The result is kept in
+        the response cache, so that the request is only sent again once
+        it has been evicted, otherwise it is sent once per run.
+        params: the parameters of the (complete) filtered request
+        size: the size of its reply in bytes
+        returns: Nothing
+        '''
+        with self.probeLock:
+            if self.extmetadataProbe is not None:
+                return
+            self.extmetadataProbe = ()  # being probed
+            if self.cache:
+                cached = self.cache.get(self.probeKind, 0, 0)
+                if cached:
+                    self.extmetadataProbe = tuple(cached)
+                    return
+        jsonr, seconds, unfiltered = self.measuredGET("query", [p for p in params if p[0] != 'iiextmetadatafilter'])
+        self.metrics.add('extmetadata-probes')
+        if 'error' not in jsonr.keys() and 'continue' not in jsonr.keys():
+            self.extmetadataProbe = (size, unfiltered)
+            if self.cache:
+                self.cache.put(self.probeKind, [(0, 0, [size, unfiltered])])
+
+    def extmetadataSaved(self):
+        '''
+        estimate the bytes saved by the extmetadata filter during the
+        run, from the probed reply
+        returns: int
+        '''
+        if not self.extmetadataProbe:
+            return 0
+        filtered, unfiltered = self.extmetadataProbe
+        return max(0, int(self.metrics.counter('extmetadata-filtered-bytes') * (float(unfiltered) / filtered - 1)))
+
+    @staticmethod
+    def neededExtmetadata(fields):
+        '''
+        the extmetadata needed to parse the given record fields, in
+        addition to those always needed, see EXTMETADATA
+        returns: string for iiextmetadatafilter
+        '''
+        needed = set(['CommonsMetadataExtension'])  # checked for every file
+        for f in ('photographer', 'copyright') + tuple(fields):  # whether a file is skipped depends on these
+            needed.update(EuropeanaHarvester.EXTMETADATA.get(f, ()))
+        return '|'.join(sorted(needed))
+
+    def lookupImageInfos(self, members):
+        '''
+        given a dict of revIds (with pageId as key) this looks up the
+        imageinfo of those files in the cache and queries the MediaWiki
+        api for any which are not found there.
+        returns: dict of imageinfo, with pageId as key
+        raises: KillException
+        '''
+        imageInfo = {}
+        for pageId, revId in members.iteritems():
+            if revId is None:
+                continue  # only listed, the revision is found in the reply
+            self.revisions[pageId] = revId
+            if self.cache:
+                cached = self.cache.get(self.extmetadataKind, pageId, revId)
+                if cached is not None:
+                    imageInfo[str(pageId)] = cached
+        changed = [p for p in members.iterkeys() if str(p) not in imageInfo]
+        if changed:
+            imageInfo.update(self.getPageImageInfos(changed))
+        return imageInfo
+
+    def storeImageInfos(self, imageInfo):
+        '''
+        keep track of the revision of each file in an imageinfo reply
+        and store the reply in the cache
+        returns: Nothing
+        '''
+        entries = []
+        for v in imageInfo.itervalues():
+            if 'lastrevid' in v.keys():
+                self.revisions[v['pageid']] = v['lastrevid']
+                entries.append((v['pageid'], v['lastrevid'], v))
+        if self.cache:
+            self.cache.put(self.extmetadataKind, entries)
+
+    def apiGET(self, action, params):
+        '''
+        sends a request to the api, respecting the request rate
+        set for the project. Safe to call from the worker threads.
+        returns: the json reply
+        '''
+        return self.measuredGET(action, params, measure=False)[0]
+
+    def measuredGET(self, action, params, measure=True):
+        '''
+        sends a request to the api, see apiGET, and measures the reply.
+        Estimating the size of the reply means encoding it again (see
+        Metrics.replySize), so it is only done if measure is given.
+        The request is sent with maxlag and a request which fails in a
+        way that may pass (e.g. a timeout, a 503 or a reply refusing it
+        because of maxlag) is retried after an exponentially growing,
+        jittered, wait during which no other requests are sent either.
+        The wait is at least as long as any Retry-After of the reply.
+        returns: (the json reply, seconds taken, size of the reply in bytes or None)
+        raises: KillException
+        '''
+        if self.maxlag:
+            params = list(params) + [('maxlag', str(self.maxlag))]
+        kind = EuropeanaHarvester.requestKind(action, params)
+        attempt = 0
+        while True:
+            self.rateLimiter.wait()
+            start = time.time()
+            try:
+                jsonr = self.wpApi.httpGET(action, params)
+            except (IOError, httplib.HTTPException, ValueError), e:
+                code = EuropeanaHarvester.httpStatus(e)
+                if code is not None and code not in EuropeanaHarvester.RETRY_STATUSES:
+                    raise KillException(u'API request failed: %s' % e)
+                reason = u'http %d' % code if code else u'connection'
+                retryAfter = EuropeanaHarvester.retryAfter(e)
+                if attempt == self.retries:
+                    raise KillException(u'API request failed after %d attempts: %s' % (attempt + 1, e))
+            else:
+                seconds = time.time() - start
+                error = jsonr.get('error') if isinstance(jsonr, dict) else None
+                code = error.get('code', u'') if isinstance(error, dict) else u''
+                if not (code in EuropeanaHarvester.RETRY_ERRORS or code.startswith(u'internal_api_error')) \
+                        or attempt == self.retries:
+                    self.metrics.request(kind, seconds)
+                    size = Metrics.replySize(jsonr) if measure else None
+                    return jsonr, seconds, size
+                reason, retryAfter = code, error.get('lag')
+                e = error.get('info', code)
+            delay = min(self.maxBackoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+            try:
+                delay = max(delay, float(retryAfter or 0))
+            except (TypeError, ValueError):
+                pass
+            attempt += 1
+            self.metrics.retry(reason)
+            self.log.write(u'Retrying api request in %.1f s (attempt %d of %d): %s\n' % (delay, attempt + 1, self.retries + 1, e))
+            self.rateLimiter.pause(delay)
+
+    @staticmethod
+    def httpStatus(e):
+        '''
+        the http status of a failed request, if it got that far
+        returns: int or None
+        '''
+        code = getattr(e, 'code', None)
+        if code is None:
+            code = getattr(getattr(e, 'response', None), 'status_code', None)
+        return code if isinstance(code, int) else None
+
+    @staticmethod
+    def retryAfter(e):
+        '''
+        the Retry-After header of a failed request, if any
+        returns: string or None
+        '''
+        headers = getattr(e, 'headers', None) or getattr(getattr(e, 'response', None), 'headers', None)
+        try:
+            return headers.get('Retry-After')
+        except AttributeError:
+            return None
+
+    def setApiLimits(self):
+        '''
+        checks if the logged in account has apihighlimits and if so
+        raises the number of pageIds sent per request in getContents
+        and the limit of those sent in getPageImageInfos. Without
+        apihighlimits the api accepts no more than the 50 pageIds
+        getPageImageInfos starts from, so these can then only be
+        adapted downwards.
+        returns: Nothing
+        '''
+        # /w/api.php?action=query&meta=userinfo&format=json&uiprop=rights
+        jsonr = self.apiGET("query", [('meta', 'userinfo'),
+                                        ('uiprop', 'rights')
+                                       ])
+        if 'apihighlimits' in jsonr['query']['userinfo'].get('rights', []):
+            self.contentBatch = self.contentBatchHigh
+            self.pageIdLimit = self.pageIdLimitHigh
+        self.imageInfoSizer = PageSizer(min(self.imageInfoBatch, self.pageIdLimit), self.pageIdLimit,
+                                        self.imageInfoBytes, self.imageInfoSeconds)
+
+    def getContents(self, pageIds):
+        '''
+        given a list of pageIds this looks up their content in the cache
+        and queries the MediaWiki api for any which are not found there.
+        Pages which could not be found are not included in the reply.
+        returns: dict of content, with pageId as key
+        raises: KillException
+        '''
+        contents = {}
+        if self.cache:
+            for pageId in pageIds:
+                cached = self.cache.get('content', pageId, self.revisions.get(pageId))
+                if cached is not None:
+                    contents[pageId] = cached
+        changed = [p for p in pageIds if p not in contents]
+        if changed:
+            retrieved = {}
+            for i in range(0, len(changed), self.contentBatch):
+                retrieved.update(self.queryContents(changed[i:i + self.contentBatch]))
+            if self.cache:
+                self.cache.put('content', [(k, self.revisions[k], v) for k, v in retrieved.iteritems() if k in self.revisions])
+            contents.update(retrieved)
+        return contents
+
+    def queryContents(self, pageIds):
+        '''
+        given a list of pageIds this queries the MediaWiki api for the
+        categories, templates and external links of those pages.
+        The reply for each page is restructured to match the one
+        given by action=parse so that it can be sent to parseContent.
+        Pages which could not be found are not included in the reply.
+        returns: dict of content, with pageId as key
+        raises: KillException
+        '''
+        # /w/api.php?action=query&prop=categories%7Ctemplates%7Cextlinks&format=json&clprop=hidden&cllimit=max&tllimit=max&ellimit=max&continue=&pageids=27970534%7C27970535
+        params = [('prop', 'categories|templates|extlinks'),
+                  ('clprop', 'hidden'),
+                  ('cllimit', 'max'),
+                  ('tllimit', 'max'),
+                  ('ellimit', 'max'),
+                  ('pageids', '|'.join(str(p) for p in pageIds))
+                  ]
+        contents = {}
+        categories = {}  # raw category info, needed to look up missing categories
+        templates = {}  # raw template info, needed to look up missing templates
+        cont = {'continue': ''}
+        while cont:
+            jsonr = self.apiGET("query", params + EuropeanaHarvester.continueParams(cont))
+
+            # check for error
+            if 'error' in jsonr.keys():
+                raise KillException(u'API error when retrieving content: %s' % jsonr['error']['info'])
+            elif 'query' not in jsonr.keys():
+                raise KillException(u'API query reply did not contain "error"-key but also not "query"-key. Unexpected and probably means something went really wrong')
+
+            # merge this part of the reply, each sub-prop continues separately
+            for k, v in jsonr['query']['pages'].iteritems():
+                if 'missing' in v.keys() or 'invalid' in v.keys():
+                    continue
+                pageId = int(k)
+                if pageId not in contents.keys():
+                    contents[pageId] = {'templates': [], 'categories': [], 'externallinks': []}
+                    categories[pageId] = []
+                    templates[pageId] = []
+                templates[pageId] += v.get('templates', [])
+                categories[pageId] += v.get('categories', [])
+                for e in v.get('extlinks', []):
+                    contents[pageId]['externallinks'].append(e['*'])
+            cont = jsonr.get('continue')
+
+        # categories and templates are given as titles and need to be checked for existence
+        self.lookupPages([c['title'] for cats in categories.values() for c in cats] +
+                         [t['title'] for temps in templates.values() for t in temps])
+        for pageId, temps in templates.iteritems():
+            for t in temps:
+                template = {'ns': t['ns'], '*': t['title']}
+                if self.knownPages[t['title']]:
+                    template['exists'] = ''
+                contents[pageId]['templates'].append(template)
+        for pageId, cats in categories.iteritems():
+            for c in cats:
+                cat = {'*': c['title'][len('Category:'):].replace(' ', '_')}
+                if 'hidden' in c.keys():
+                    cat['hidden'] = ''
+                if not self.knownPages[c['title']]:
+                    cat['missing'] = ''
+                contents[pageId]['categories'].append(cat)
+
+        return contents
+
+    def lookupPages(self, titles):
+        '''
+        given a list of category and template titles this checks which
+        of these have a page, the result is stored in knownPages
+        returns: Nothing
+        raises: KillException
+        '''
+        # /w/api.php?action=query&prop=info&format=json&titles=Category%3AR%C3%B6da%20stugor%7CTemplate%3ABBR
+        titles = list(set(titles) - set(self.knownPages.keys()))
+        for i in range(0, len(titles), self.contentBatch):
+            batch = titles[i:i + self.contentBatch]
+            jsonr = self.apiGET("query", [('prop', 'info'),
+                                            ('titles', '|'.join(batch).encode('utf-8'))
+                                           ])
+            if 'error' in jsonr.keys():
+                raise KillException(u'API error when looking up pages: %s' % jsonr['error']['info'])
+            for k, v in jsonr['query']['pages'].iteritems():
+                self.knownPages[v['title']] = 'missing' not in v.keys()
 
     def parseImageInfo(self, imageJson):
         '''
@@ -392,10 +1246,10 @@ class EuropeanaHarvester(object):
             raise KillException(u'This uses a different version of the commonsMetadataExtension than the one the script was designed for. Expected: %s; Found: %s' % (self.commonsMetadataExtension, imageJson['extmetadata']['CommonsMetadataExtension']['value']))
         if not imageJson['mime'].split('/')[0].strip() == 'image':  # check that it is really an image
             # would probably only want to skip this image (or deal with it)
-            raise SkipException(u'%s is not an image but a %s' % (title, imageJson['mime'].split('/')[0].strip()))
+            raise SkipException(u'%s is not an image but a %s' % (title, imageJson['mime'].split('/')[0].strip()), u'not an image')
         if pageId in self.data.keys():  # check if image already in dictionary
             # would probably only want to skip this image (or deal with it)
-            raise SkipException(u'pageId (%s) already in data: old:%s new:%s' % (pageId, self.data[pageId]['title'], title))
+            raise SkipException(u'pageId (%s) already in data: old:%s new:%s' % (pageId, self.data[pageId]['title'], title), u'duplicate')
 
         # Prepare data object, not sent directly to data[pageId] in case errors are discovered downstream
         obj = {'title': title,
@@ -453,9 +1307,9 @@ class EuropeanaHarvester(object):
             # currently not allowed
             obj['photographer'] = None
             obj['uploader'] = user
-            raise SkipException(u'%s did not have any information about the creator apart from uploader (%s)' % (title, obj['uploader']))
+            raise SkipException(u'%s did not have any information about the creator apart from uploader (%s)' % (title, obj['uploader']), u'only uploader')
         else:  # no indication of creator
-            raise SkipException(u'%s did not have any information about the creator' % title)
+            raise SkipException(u'%s did not have any information about the creator' % title, u'no creator')
 
         # Deal with licenses
         # Only CC-licenses and PD allowed
@@ -465,12 +1319,12 @@ class EuropeanaHarvester(object):
             elif licenseurl.startswith(u'http://creativecommons.org/publicdomain/'):
                 obj[u'copyright'] = pdMark
             else:
-                raise SkipException(u'%s did not have a CC-license URL and is not PD: %s (%s)' % (title, licenseurl, licenseShortName))
+                raise SkipException(u'%s did not have a CC-license URL and is not PD: %s (%s)' % (title, licenseurl, licenseShortName), u'unsupported license')
         else:
             if copyrighted == u'False':
                 obj[u'copyright'] = pdMark
             else:
-                raise SkipException(u'%s did not have a license URL and is not PD: %s' % (title, licenseShortName))
+                raise SkipException(u'%s did not have a license URL and is not PD: %s' % (title, licenseShortName), u'no license')
 
         # isolate date giving preference to dateOrig
         if dateOrig:  # the date as described in the description
@@ -483,7 +1337,7 @@ class EuropeanaHarvester(object):
                     date += dateOrig.split('>,')[1]
                 obj['created'] = date
             elif u'<time' in dateOrig:  # weird
-                raise SkipException(u'%s did not have a recognised datestamp: %s' % (title, dateOrig))
+                raise SkipException(u'%s did not have a recognised datestamp: %s' % (title, dateOrig), u'unrecognised date')
             else:  # just plain text
                 self.log.write(u'%s has plain text date: %s\n' % (title, dateOrig))
                 obj['created'] = dateOrig
@@ -505,7 +1359,7 @@ class EuropeanaHarvester(object):
 
     def parseContent(self, pageId, contentJson):
         '''
-        parse a single parse reply from the API
+        parse the content of a single page (as given by getContents)
         with the aim of identifying the institution links,
         non-maintanance categories and used templates.
         adds to data: categories (list), sourcelinks (list)
@@ -513,10 +1367,10 @@ class EuropeanaHarvester(object):
         raises: SkipException, KillException
         '''
         # structure up info as simple lists
-        templates = []
+        templates = set()
         for t in contentJson['templates']:
             if 'exists' in t.keys():
-                templates.append(t['*'])
+                templates.add(t['*'])
         self.data[pageId][u'categories'] = []
         for c in contentJson['categories']:
             if 'hidden' not in c.keys() and 'missing' not in c.keys():
@@ -530,157 +1384,121 @@ class EuropeanaHarvester(object):
             if t in templates:
                 supported = True
         if not supported:
-            raise SkipException(u'Does not contain one of the supported information templates: %s' % ', '.join(self.infoTemplate))
+            raise SkipException(u'Does not contain one of the supported information templates: %s' % ', '.join(self.infoTemplate), u'no information template')
 
         # Isolate the source templates and identify the source links
+        found = {}  # source links per id-template
+        for e, keys in self.idPrefixes.matchAll(extLinks):
+            for k in keys:
+                if k in templates:
+                    found.setdefault(k, []).append(e)
         self.data[pageId][u'sourcelinks'] = []
-        for k, v in self.idTemplates.iteritems():
-            if k in templates:
-                for e in extLinks:
-                    if e.startswith(v):
-                        self.data[pageId][u'sourcelinks'].append(e)
+        for k in self.idTemplates.iterkeys():
+            if k in found:
+                self.data[pageId][u'sourcelinks'] += found[k]
         # successfully reached the end
 
-    def outputCSV(self, f):
-        '''
-        output the data as a csv for an easy overview.
-        Also allows outputting more fields than are included in xml.
-        '''
-        f.write(u'#mediatype|created|medialink|uploader|sourcelinks|identifier|categories|copyright|title|photographer|usageTerms|credit|description\n')
-        for k, v in self.data.iteritems():
-            for kk, vv in v.iteritems():
-                if vv is None:
-                    v[kk] = ''
-                elif type(vv) not in (unicode, str):  # because apparently this can also be the case
-                    self.log.write(u'Found non-string value for %s in %s' % (kk, v['title']))
-                    v[kk] = str(vv)
-                if kk in ['sourcelinks', 'categories']:
-                    v[kk] = ';'.join(v[kk])
-                v[kk] = v[kk].replace('|', '!').replace('\n', u' ')
-            f.write(u'%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s\n' % (v['mediatype'], v['created'], v['medialink'], v['uploader'], v['sourcelinks'], v['identifier'], v['categories'], v['copyright'], v['title'], v['photographer'], v['usageTerms'], v['credit'], v['description'], v['lat'], v['lon']))
-        f.close()
+    def startOutput(self):
+        '''
+        write the headers of the output files and start the outputs
+        '''
+        self.harvested = datetime.datetime.utcnow().isoformat()  # for the state of new or changed files
+        self.outputs.start(self.metrics, threads=self.threadedOutput and self.outputQueue)
+        if self.incremental:
+            self.fRemoved.write(u'#pageid|identifier\n')
 
-    def outputXML(self, f):
-        '''
-        output the data as xml acording to the desired format
-        '''
-        # lxml requieres namespaces to be declared
-        # Europeana wants them stripped (see later replacement)
-        NSMAP = {"dc": 'dummy'}
-
-        # proper declaration does not play nice with unicode
-        f.write(u"<?xml version='1.0' encoding='UTF-8'?>\n")
-        f.write(u"<output xmlns:dc=\"http://purl.org/dc/elements/1.1/\">\n")
-
-        for k, v in self.data.iteritems():
-            dc = etree.Element('{dummy}dc', nsmap=NSMAP)
-
-            # identifier - mandatory
-            child = etree.Element('identifier')
-            child.text = v['identifier']
-            dc.append(child)
-
-            # sourcelink - optional, multiple
-            for s in v['sourcelinks']:
-                child = etree.Element('sourcelink')
-                child.text = s
-                dc.append(child)
-
-            # title - mandatory
-            child = etree.Element('title')
-            child.text = v['title']
-            dc.append(child)
-
-            # photographer - mandatory
-            child = etree.Element('photographer')
-            child.text = v['photographer']
-            dc.append(child)
-
-            # creator - optional
-            if 'creator' in v.keys() and v['creator']:
-                child = etree.Element('creator')
-                child.text = v['creator']
-                dc.append(child)
-
-            # created - optional
-            if 'created' in v.keys() and v['created']:
-                child = etree.Element('created')
-                child.text = v['created']
-                dc.append(child)
-
-            # description (with credit) - optional
-            if 'description' in v.keys() and v['description']:
-                child = etree.Element('description')
-                child.text = v['description']
-                if 'credit' in v.keys() and v['credit']:
-                    child.text += u'\nSource info: %s' % v['credit']
-                dc.append(child)
-            elif 'credit' in v.keys() and v['credit']:
-                child = etree.Element('description')
-                child.text = u'Source info: %s' % v['credit']
-                dc.append(child)
-
-            # category - optional, multiple
-            for c in v['categories']:
-                child = etree.Element('category')
-                child.text = c
-                dc.append(child)
-
-            # link - mandatory (same as identifier)
-            child = etree.Element('link')
-            child.text = v['identifier']
-            dc.append(child)
-
-            # medialink - mandatory
-            child = etree.Element('medialink')
-            child.text = v['medialink']
-            dc.append(child)
-
-            # copyright - mandatory
-            child = etree.Element('copyright')
-            child.text = v['copyright']
-            dc.append(child)
-
-            # type - mandatory
-            child = etree.Element('type')
-            child.text = v['mediatype']
-            dc.append(child)
-
-            # coordinates - optional
-            if 'lat' in v.keys() and 'lon' in v.keys() and v['lat'] and v['lon']:
-                child = etree.Element('latitude')
-                child.text = v['lat']
-                dc.append(child)
-                child = etree.Element('longitude')
-                child.text = v['lon']
-                dc.append(child)
-
-            # end of single dc-element
-            f.write(etree.tostring(dc, pretty_print=True, encoding='unicode').replace(u' xmlns:dc="dummy"', ''))
-
-        # end of all dc-elements
-        f.write(u'</output>')
-        f.close()
+    def outputRecord(self, pageId, record, revId=None, harvested=None, reason=None):
+        '''
+        output a finished record to each of the outputs, see RecordFanOut,
+        and, for incremental harvests, to the new state.
+        record: the record or None if the file was skipped
+        revId: the revision of the file, if not in self.revisions
+        harvested: when the record was harvested, if not during this run
+        reason: why the file was skipped
+        '''
+        phase = self.metrics.phase
+        if self.incremental:
+            with phase('state'):
+                self.fState.write('%s\n' % json.dumps({'pageid': pageId,
+                                                       'revid': revId or self.revisions.get(pageId),
+                                                       'harvested': harvested or self.harvested,
+                                                       'record': record.toDict() if record else None,
+                                                       'reason': reason}))
+        self.revisions.pop(pageId, None)  # no longer needed
+        if record is None:
+            self.metrics.outcome(reason or u'unknown')
+            self.outputs.skip(reason)
+            return
+
+        self.metrics.outcome()
+        self.outputs.write(record, fresh=harvested is None)
+
+    def endOutput(self):
+        '''
+        write the footers of the output files and close them, then
+        output the statistics, the manifest and replace the state
+        '''
+        phase = self.metrics.phase
+        self.outputs.close()
+        if self.shard or self.compress:
+            self.writeManifest()
+        if self.incremental:
+            self.fRemoved.close()
+            with phase('state'):
+                self.fState.close()
+            os.rename(u'%s.tmp' % self.stateFilename, self.stateFilename)
+
+    def writeManifest(self):
+        '''
+        write the manifest of the output files to <output>-manifest.json,
+        listing the number of records, size and sha256 checksum of each
+        of them (e.g. of each xml shard), so that they can be verified
+        and processed separately
+        returns: Nothing
+        '''
+        files = []
+        for kind, sink in self.manifested:
+            for entry in sink.manifest():
+                entry['format'] = kind
+                files.append(entry)
+        manifest = {'project': self.projName,
+                    'harvested': self.harvested,
+                    'compression': self.compress,
+                    'records': sum(f['records'] for f in files if f['format'] == 'xml'),
+                    'files': files}
+        filename = u'%s-manifest.json' % self.output
+        try:
+            f = codecs.open(u'%s.tmp' % filename, 'w', 'utf-8')
+            json.dump(manifest, f, indent=2, sort_keys=True)
+            f.close()
+            os.rename(u'%s.tmp' % filename, filename)
+        except (IOError, OSError), e:
+            self.log.write(u'Error writing manifest: %s\n' % e)
 
-    def outputCatStat(self, f):
+    def replayJournal(self):
         '''
-        output the category statistics in the desired format
+        output the records journaled by an earlier run, the files of
+        which are then not retrieved again
+        returns: Nothing
         '''
-        allCats = {}
-        for k, v in self.data.iteritems():
-            for c in v['categories']:
-                if c in allCats.keys():
-                    allCats[c] += 1
+        records = 0
+        skipped = 0
+        for e in self.journal.replay():
+            if e['pageid'] not in self.seen:
+                self.seen.add(e['pageid'])
+                if e['type'] == 'record':
+                    records += 1
+                    self.outputRecord(e['pageid'], Record.fromDict(e['record']), revId=e['revid'])
                 else:
-                    allCats[c] = 1
+                    skipped += 1
+                    self.outputRecord(e['pageid'], None, revId=e['revid'], reason=e.get('reason'))
+        self.log.write(u'Resuming with %d records and %d skipped files\n' % (records, skipped))
 
-        sorted_allCats = EuropeanaHarvester.sortedDict(allCats)
-
-        # outputting
-        f.write(u'#frequency|category\n')
-        for k in sorted_allCats:
-            f.write(u'%d|%s\n' % (k[1], k[0]))
-        f.close()
+    def outputRemoved(self, f, pageId, record):
+        '''
+        output a record which was removed since the previous harvest
+        '''
+        f.write(u'%d|%s\n' % (pageId, record['identifier']))
 
     def linkCleanup(self, text):
         '''
@@ -713,48 +1531,22 @@ class EuropeanaHarvester(object):
     def descriptionFiltering(self, description, title):
         '''
         given a description string this filters out any tags which
-        likely indicate templates
+        likely indicate templates, then truncates it to cc0Length
+        visible characters
         returns: trimmed description or None
         '''
         filtertags = ['div', 'table']
         description = self.linkCleanup(description)
 
-        for t in filtertags:
-            # replace all occurences of tag
-            description = self.stripTag(description, t)
-            if len(description.strip()) == 0:
-                return None
-            # next tag
-        # all tags checked
-
-        # truncate at cc0Length characters and elipse with ...
-        if len(description) > self.cc0Length:
-            pos = self.cc0Length-3
-            cropped = description[pos:].strip()
-            # Need to be careful with cropped tags
-            if cropped.find('>') > 0:
-                if (cropped.find(u'<') < 0) or ( cropped.find(u'<') > 0 and ( cropped.find('>') < cropped.find(u'<') )):
-                    # found an open tag definition
-                    # search back to start of definition and truncate there
-                    pos = description[:pos].rfind('<')
-                    if pos >= 0:  # if found
-                        description = u'%s...' % description[:pos]
-                    else:
-                        self.log.write('Cropped description may have mauled tags "%s": %s... | %s\n' % (title, description[:self.cc0Length-3].replace('\n', ' '), description[self.cc0Length-3:].replace('\n', ' ')))
-                        description = u'%s...' % description[:self.cc0Length-3]
-                elif cropped.find('</') > 0:
-                    # found a possibly unclosed tag
-                    unclosed = self.findOpenTags(cropped)
-                    closing = u''
-                    for t in unclosed:
-                        closing += u'</%s>' % t
-                    description = u'%s...%s' % (description[:pos], closing)
-                else:
-                    self.log.write('Cropped description may have mauled tags "%s": %s... | %s\n' % (title, description[:pos].replace('\n', ' '), description[pos:].replace('\n', ' ')))
-                    description = u'%s...' % description[:pos]
-            else:
-                description = u'%s...' % description[:pos]
-            # truncation complete
+        # remove all occurences of the tags
+        description, unclosed = HtmlFilter.stripBlocks(description, filtertags)
+        if unclosed:
+            self.log.write(u'missmatched tags in description for "%s", not stripping unclosed %s\n' % (title, ', '.join(unclosed)))
+        if len(description.strip()) == 0:
+            return None
+
+        # truncate at cc0Length characters and elipse with ..., closing any cropped tags
+        description = HtmlFilter.truncate(description, self.cc0Length)
 
         return description.strip()
 
@@ -765,17 +1557,17 @@ class EuropeanaHarvester(object):
         '''
         credit = self.linkCleanup(credit)
 
-        for f in self.creditFilterStrings:
-            credit = credit.replace(f, '')
-            if len(credit.strip()) == 0:
-                return None
+        credit = self.creditFilter.remove(credit)
+        if len(credit.strip()) == 0:
+            return None
 
         # More advanced - do similar filtering as for descriptions
         if templateFilter:
             oldCredit = credit  # for the logs
             filtertags = ['div', 'table']
-            for t in filtertags:
-                credit = self.stripTag(credit, t)
+            credit, unclosed = HtmlFilter.stripBlocks(credit, filtertags)
+            if unclosed:
+                self.log.write(u'missmatched tags in credit for "%s", not stripping unclosed %s\n' % (title, ', '.join(unclosed)))
             if credit != oldCredit:
                 self.log.write('Removed tag from credit for "%s": %s\n' % (title, oldCredit.replace(credit, '').replace('\n', ' ')))
                 # This allows a post-process check that no relevant copyright information was removed
@@ -783,67 +1575,963 @@ class EuropeanaHarvester(object):
                 return None
         return credit.strip(' .,')
 
-    def stripTag(self, text, t):
-        '''
-        given a string and a tag this strips out all occurences of this tag from the text
-        assumes tag starts with "<tag" and ends "</tag>"
-        returns: stripped text
-        '''
-        if text.find('<%s' % t) >= 0:
-            # find all occurences of this tag
-            startpos = []
-            sp = text.find('<%s' % t)
-            while sp >= 0:
-                startpos.append(sp)
-                sp = text.find('<%s' % t, sp+1)
-            # find the matching end tags
-            while len(startpos) > 0:
-                sp = startpos.pop()  # gets the last one
-                ep = text.find('</%s>' % t, sp+1)  # get endposition
-                if ep < 0:
-                    self.log.write('missmatched tags, aborting search for %s tag\n' % t)
-                    break
+    @staticmethod
+    def requestKind(action, params):
+        '''
+        the kind of an api request, for the metrics: the generator or
+        module(s) queried, e.g. 'imageinfo|info', or else the action
+        '''
+        params = dict(params)
+        for k in ('generator', 'list', 'prop', 'meta'):
+            if k in params:
+                return params[k]
+        return action
+
+    @staticmethod
+    def continueParams(cont):
+        '''turns the continue-part of an api reply into request parameters'''
+        return [(k, unicode(v).encode('utf-8')) for k, v in cont.iteritems()]
+
+
+class BatchHarvester(EuropeanaHarvester):
+    '''
+    Harvests several projects in a single run sharing the api session,
+    the response cache and the parse processes. Each distinct category
+    is listed once and each file is retrieved once, the file is then
+    parsed for each of the projects including it and output to the
+    files of each of these.
+    '''
+    # attributes shared with the projects
+    SHARED = ('wpApi', 'rateLimiter', 'pool', 'parsePool', 'cache', 'contentBatch', 'pageIdLimit', 'imageInfoSizer', 'metrics')
+
+    def __init__(self, projects, verbose=False, test=False, cache=True, incremental=False, resume=False, parsers=0,
+                 api=None, record=None, prometheus=False, threadedOutput=False, compress=None, shard=0):
+        '''
+        Sets up environment, loads the project files, triggers run/test
+        Requires one parameter:
+        projects: list of (unicode)string relative pathnames to the project json files
+        Optional parameters: see EuropeanaHarvester
+        '''
+        self.versionInfo()
+        try:
+            self.loadVariables()  # also opens self.log
+        except KillException, e:
+            self.log.write(u'%s\n' % e)
+            exit(1)
+        self.knownPages = {}  # category or template title: whether the page exists
+        self.revisions = {}  # latest revision of each file being retrieved, using pageid as its key
+        self.incremental = incremental
+        self.resume = resume
+        self.metrics = Metrics()
+        self.prometheus = prometheus
+        self.compress = compress
+        self.shard = shard
+        self.log.write(u'-----------------------\n%s: Loading a batch of %d projects.\n' % (datetime.datetime.utcnow(), len(projects)))
+        self.projects = [EuropeanaHarvester(p, verbose=verbose, test=test, incremental=incremental, resume=resume,
+                                            prometheus=prometheus, threadedOutput=threadedOutput,
+                                            compress=compress, shard=shard, batch=self)
+                         for p in projects]
+        outputs = [h.output for h in self.projects]
+        if len(set(outputs)) < len(outputs):
+            self.log.write(u'Error loading batch: several projects have the same "output-pattern"\n')
+            exit(1)
+
+        # as many concurrent requests as the most demanding project, as slowly as the most restrictive one
+        self.workers = max(h.workers for h in self.projects)
+        rates = [h.maxRate for h in self.projects if h.maxRate]
+        self.maxRate = min(rates) if rates else None
+        self.burst = min(h.burst for h in self.projects)
+        self.startParsers(parsers)
+        self.pool = FetchPool(self.workers)
+        self.rateLimiter = RateLimiter(self.maxRate, self.burst)
+        self.connect(api, record)
+        self.openCache(cache)
+        for h in self.projects:
+            for k in BatchHarvester.SHARED:
+                setattr(h, k, getattr(self, k))
+
+        # ready to run
+        try:
+            if test:
+                self.run(verbose=True, testing=True)
+            else:
+                self.run(verbose=verbose)
+        except KillException, e:
+            if verbose:
+                print u'Terminated prematurely, please check log file'
+            self.log.write(u'Error during batch run: %s\n' % e)
+            for h in self.projects:
+                h.journal.close()
+            self.writeMetrics()
+            self.closeCache()
+            self.closeApi()
+            self.closeParsers(terminate=True)
+            exit(1)
+        else:
+            # confirm sucessful ending to log together with timestamp
+            if verbose:
+                print u'Successfully reached end of run'
+            self.log.write(u'%s: Successfully reached end of batch %srun.\n' % (datetime.datetime.utcnow(), 'test ' if test else ''))
+            for h in self.projects:
+                h.journal.close(remove=True)
+            self.writeMetrics(verbose=verbose)
+
+        # done
+        self.closeCache()
+        self.closeApi()
+        self.closeParsers()
+        self.log.close()
+
+    def run(self, verbose=False, testing=False):
+        '''
+        Lists the files in the categories of all of the projects, each
+        category only once, then retrieves the imageinfo and content of
+        each file once, one part at a time. Each part is handed to each
+        of the projects including the files, see EuropeanaHarvester.run
+        '''
+        for h in self.projects:
+            h.startOutput()
+            with self.metrics.phase('categories'):
+                h.categories = h.expandCategories(verbose=verbose)
+            # output the records of an earlier, terminated, run
+            if self.resume:
+                h.replayJournal()
+
+        # list each category once
+        categories = sorted(set(c for h in self.projects for c in h.categories))
+        with self.metrics.phase('categories'):
+            listed = self.listCategories(categories, verbose=verbose, testing=testing)
+
+        # the files to retrieve for each of the projects
+        wanted = {}  # projects, with pageId as key
+        members = {}
+        for h in self.projects:
+            m = {}
+            for c in h.categories:
+                m.update(listed[c][0])
+            if self.incremental:
+                pageIds = h.reuseState(m, verbose=verbose)
+            else:
+                pageIds = [p for p in m.iterkeys() if p not in h.seen]  # skip files output before resuming
+            for p in pageIds:
+                wanted.setdefault(p, []).append(h)
+            members.update(m)
+        pageIds = sorted(wanted.iterkeys())
+
+        # Retrieve all ImageInfos together with the content of those pages
+        start = self.rateLimiter.count
+        if verbose:
+            print u'Retrieving ImageInfo for %d files...' % len(pageIds)
+        batches = [dict((p, members[p]) for p in pageIds[i:i + self.pageIdLimit]) for i in range(0, len(pageIds), self.pageIdLimit)]
+        parts = self.pool.imap(self.harvestPages, batches)
+
+        # hand each part to the projects as soon as it has been retrieved
+        counter = 0
+        while True:
+            try:
+                batch, (imageInfo, contents) = parts.next()
+            except StopIteration:
+                break
+            except KillException, e:
+                self.log.write(u'Terminating: Error retrieving imageInfos/content: %s\n' % e)
+                raise
+            for h in self.projects:
+                part = dict((k, v) for k, v in imageInfo.iteritems() if h in wanted.get(int(k), ()))
+                for k in part.iterkeys():
+                    h.revisions[int(k)] = self.revisions.get(int(k))
+                h.processPart(part, contents)
+            for k in imageInfo.iterkeys():
+                self.revisions.pop(int(k), None)  # no longer needed
+            counter += len(imageInfo)
+            if verbose:
+                print u'Processed %d out of %d files' % (counter, len(pageIds))
+        retrieval = self.rateLimiter.count - start
+
+        # close filewriters
+        for h in self.projects:
+            h.endOutput()
+            if verbose:
+                print u'Wrote to %s, %s and %s-*Statistics.csv' % (h.xmlName, h.csvName, h.output)
+                if self.incremental:
+                    print u'Wrote changes to %s and %s-removed.csv' % (h.deltaName, h.output)
+                if self.shard or self.compress:
+                    print u'Listed the output files in %s-manifest.json' % h.output
+
+        # compare with running each project on its own (which would also log in once per project)
+        separate = self.rateLimiter.count
+        separate += len(self.projects) - 1  # checking the api limits
+        separate += sum(listed[c][1] * (len([h for h in self.projects if c in h.categories]) - 1) for c in categories)
+        if pageIds:
+            separate += int(round(retrieval * (sum(len(v) for v in wanted.itervalues()) / float(len(pageIds)) - 1)))
+        report = u'Batch of %d projects sent %d api requests, separate runs would have sent about %d' % (len(self.projects), self.rateLimiter.count, separate)
+        self.log.write(u'%s\n' % report)
+        if verbose:
+            print report
+        # success
+
+    def writeMetrics(self, verbose=False):
+        '''
+        write the metrics of the whole batch next to the output files
+        of each of the projects, see Metrics
+        returns: Nothing
+        '''
+        self.metrics.end()
+        self.metrics.add('extmetadata-bytes-saved', self.extmetadataSaved())
+        report = self.metrics.report()
+        self.log.write(u'Sent %d api requests (%d bytes of imageinfo, about %d fewer by filtering the extmetadata) and output %d records in %.1f s\n' % (report['total-requests'], report['counters'].get('extmetadata-filtered-bytes', 0), report['counters']['extmetadata-bytes-saved'], report['records'], report['seconds']))
+        names = [h.projName for h in self.projects]
+        for h in self.projects:
+            try:
+                self.metrics.write(h.output, h.projName, prometheus=self.prometheus, batch=names)
+            except (IOError, OSError), e:
+                self.log.write(u'Error writing metrics: %s\n' % e)
+                continue
+            if verbose:
+                print u'Wrote metrics to %s-metrics.json' % h.output
+
+    def listCategories(self, categories, verbose=False, testing=False):
+        '''
+        lists the current files in each of the categories
+        returns: dict of (dict of revIds (or None) with pageId as key,
+                 number of api requests needed), with category as key
+        raises: KillException
+        '''
+        revisions = bool(self.cache) or self.incremental
+
+        def listCategory(maincat):
+            start = self.rateLimiter.threadCount()
+            self.checkCategory(maincat, verbose=verbose)
+            members = self.getMembers(maincat, testing=testing, revisions=revisions)
+            return members, self.rateLimiter.threadCount() - start
+
+        if verbose:
+            print u'Listing files in %d categories...' % len(categories)
+        return dict(self.pool.imap(listCategory, categories))
+
+
+class OutputFile(object):
+    '''
+    An output file, compressed as it is written if so asked, which keeps
+    count of the records and of the size (and, if asked, sha256 checksum)
+    of what is written to disk, for the manifest. It is written to
+    <filename>.tmp and only renamed once closed, so that a run which is
+    terminated prematurely leaves no truncated output behind (but any
+    earlier, complete, one).
+    '''
+    EXTENSIONS = {None: u'', 'gzip': u'.gz', 'xz': u'.xz'}
+
+    def __init__(self, filename, buffering=-1, compression=None, checksum=False):
+        '''
+        Opens the file
+        filename: the pathname, without the extension of the compression
+        buffering: the size (in bytes) of the file buffer, -1 for the default
+        compression: None, 'gzip' or 'xz'
+        checksum: whether to compute the sha256 checksum, i.e. whether the
+                  file is listed in a manifest
+        raises: IOError
+        '''
+        self.filename = u'%s%s' % (filename, OutputFile.EXTENSIONS[compression])
+        self.compressor = None
+        if compression == 'gzip':
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # with a gzip header
+        elif compression == 'xz':
+            try:
+                import lzma  # only needed for xz
+            except ImportError:
+                try:
+                    from backports import lzma
+                except ImportError:
+                    raise IOError(u'xz compression needs the lzma module (backports.lzma for python 2)')
+            self.compressor = lzma.LZMACompressor()
+        self.f = open(u'%s.tmp' % self.filename, 'wb', buffering)
+        self.records = 0
+        self.size = 0
+        self.checksum = hashlib.sha256() if checksum else None
+
+    def write(self, data):
+        '''write (and compress) a string of bytes'''
+        if self.compressor:
+            data = self.compressor.compress(data)
+        self.writeRaw(data)
+
+    def writeRaw(self, data):
+        '''write a string of bytes to disk'''
+        if data:
+            self.size += len(data)
+            if self.checksum:
+                self.checksum.update(data)
+            self.f.write(data)
+
+    def close(self):
+        '''finish the compression, close the file and rename it'''
+        if self.compressor:
+            self.writeRaw(self.compressor.flush())
+        self.f.close()
+        os.rename(u'%s.tmp' % self.filename, self.filename)
+
+    def entry(self):
+        '''the entry of the file in the manifest'''
+        return {'file': os.path.basename(self.filename),
+                'records': self.records,
+                'bytes': self.size,
+                'sha256': self.checksum and self.checksum.hexdigest()}
+
+
+class XMLWriter(RecordSink):
+    '''
+    Writes records, as xml acording to the desired format, one at a
+    time to the (utf-8) output file, see OutputFile.
+    '''
+    DC = 'http://purl.org/dc/elements/1.1/'
+    # the record fields which are output, see fields()
+    FIELDS = ('identifier', 'sourcelinks', 'title', 'photographer', 'creator', 'created',
+              'description', 'credit', 'categories', 'medialink', 'copyright', 'mediatype',
+              'lat', 'lon')
+
+    def __init__(self, filename, buffering=-1, compression=None, checksum=False):
+        '''
+        Opens the output file and writes the start of the xml
+        buffering, compression, checksum: see OutputFile
+        raises: IOError
+        '''
+        self.f = OutputFile(filename, buffering, compression, checksum)
+        self.writer = self.xmlWriter()
+        self.writer.next()
+
+    def xmlWriter(self):
+        '''
+        keeps the xml document open, receiving records through send()
+        until closed
+        '''
+        with etree.xmlfile(self.f, encoding='UTF-8') as xf:
+            xf.write_declaration()
+            with xf.element('output', nsmap={'dc': XMLWriter.DC}):
+                xf.write(u'\n')
+                try:
+                    while True:
+                        self.writeRecord(xf, (yield))
+                except GeneratorExit:
+                    pass
+
+    def write(self, record):
+        '''output a single record'''
+        self.writer.send(record)
+        self.f.records += 1
+
+    def close(self):
+        '''write the end of the xml and close the file'''
+        self.writer.close()
+        self.f.close()
+
+    def manifest(self):
+        return [self.f.entry()]
+
+    def writeRecord(self, xf, v):
+        '''output a single record as a dc-element'''
+        write = xf.write
+        element = xf.element
+        with element('{%s}dc' % XMLWriter.DC):
+            for tag, text in XMLWriter.fields(v):
+                write(u'\n  ')
+                if text is None:
+                    write(etree.Element(tag))
                 else:
-                    # strip out this occurence of the tag
-                    text = text[:sp] + text[ep + len('</%s>' % t):]
-        return text
-
-    def findOpenTags(self, text):
-        '''
-        given a string this identifies any unclosed tags
-        returns: a list of tags to close
-        '''
-        # find all closing tags
-        findings = []
-        tClose = text.find('</')
-        while tClose > 0:
-            tag = text[tClose + len('</'):text.find('>', tClose)].strip()
-            tStart = text.find('<'+tag)
-            # yes this only find the first of these
-            # if weirdly nested things are going on
-            # then someone else is to blame
-            findings.append({'tClose': tClose, 'tag': tag, 'tStart': tStart})
-            tClose = text.find('</', tClose+len('</'))
-
-        # find unclosed tags
-        unclosed = []
-        for f in findings:
-            if f['tStart'] > 0 and f['tStart'] < f['tClose']:
-                # tag not opened yet
-                pass
+                    with element(tag):
+                        write(text)
+            write(u'\n')
+        # end of single dc-element
+        write(u'\n')
+
+    @staticmethod
+    def fields(v):
+        '''
+        list the elements of a record in the desired order
+        returns: list of (tag, text) tuples
+        '''
+        # identifier - mandatory
+        fields = [('identifier', v.identifier)]
+
+        # sourcelink - optional, multiple
+        for s in v.sourcelinks:
+            fields.append(('sourcelink', s))
+
+        # title, photographer - mandatory
+        fields.append(('title', v.title))
+        fields.append(('photographer', v.photographer))
+
+        # creator - optional
+        if v.creator:
+            fields.append(('creator', v.creator))
+
+        # created - optional
+        if v.created:
+            fields.append(('created', v.created))
+
+        # description (with credit) - optional
+        if v.description:
+            text = v.description
+            if v.credit:
+                text += u'\nSource info: %s' % v.credit
+            fields.append(('description', text))
+        elif v.credit:
+            fields.append(('description', u'Source info: %s' % v.credit))
+
+        # category - optional, multiple
+        for c in v.categories:
+            fields.append(('category', c))
+
+        # link (same as identifier), medialink, copyright, type - mandatory
+        fields.append(('link', v.identifier))
+        fields.append(('medialink', v.medialink))
+        fields.append(('copyright', v.copyright))
+        fields.append(('type', v.mediatype))
+
+        # coordinates - optional
+        if v.lat and v.lon:
+            fields.append(('latitude', v.lat))
+            fields.append(('longitude', v.lon))
+        return fields
+
+
+class ShardedXMLWriter(RecordSink):
+    '''
+    Writes records as xml, see XMLWriter, split over several files
+    ("shards") of at most "size" records each: <output>-00001.xml,
+    <output>-00002.xml etc. The shards are filled in order, the next one
+    being opened once the current one is full. If written on threads the
+    full shards are finished (e.g. compressed) on their own threads while
+    the next one is filled, with at most "writers" shards in progress.
+    '''
+    def __init__(self, output, size, writers=1, buffering=-1, compression=None, queue=0):
+        '''
+        Opens the first shard
+        output: the output-pattern of the project
+        size: the max number of records per shard
+        writers: the max number of shards written at once, if on threads
+        buffering, compression: see OutputFile
+        queue: if not 0, write each shard on a thread of its own, with a
+               queue of this many records, see ThreadedSink
+        raises: IOError
+        '''
+        self.output = output
+        self.size = size
+        self.writers = writers
+        self.buffering = buffering
+        self.compression = compression
+        self.queue = queue
+        self.shards = []  # all XMLWriters, in order
+        self.pending = []  # the sinks of the full shards still being written
+        self.count = 0  # records written to the current shard
+        self.current = self.openShard()
+
+    def openShard(self):
+        '''open the next shard, as a sink'''
+        shard = XMLWriter(u'%s-%05d.xml' % (self.output, len(self.shards) + 1), self.buffering, self.compression,
+                          checksum=True)
+        self.shards.append(shard)
+        if self.queue:
+            return ThreadedSink(shard, self.queue)
+        return shard
+
+    def write(self, record):
+        if self.count == self.size:
+            # only opened once there is a record for it
+            if self.queue:
+                self.pending.append(self.current)
+                while len(self.pending) >= self.writers:
+                    self.pending.pop(0).close()
             else:
-                unclosed.append(f['tag'])
+                self.current.close()
+            self.current = self.openShard()
+            self.count = 0
+        self.current.write(record)
+        self.count += 1
+
+    def close(self):
+        for sink in self.pending + [self.current]:
+            sink.close()
+        self.pending = []
+
+    def manifest(self):
+        return [shard.f.entry() for shard in self.shards]
+
+
+class CSVWriter(RecordSink):
+    '''
+    Writes records, as lines of csv for an easy overview, to the
+    (utf-8) output file, see OutputFile. Also allows outputting more
+    fields than are included in xml.
+    '''
+    FIELDS = ('mediatype', 'created', 'medialink', 'uploader', 'sourcelinks',
+              'identifier', 'categories', 'copyright', 'title', 'photographer',
+              'usageTerms', 'credit', 'description', 'lat', 'lon')
+
+    def __init__(self, filename, buffering=-1, compression=None, checksum=False):
+        '''
+        Opens the output file and writes the header
+        buffering, compression, checksum: see OutputFile
+        raises: IOError
+        '''
+        self.out = OutputFile(filename, buffering, compression, checksum)
+        self.f = codecs.getwriter('utf-8')(self.out)
+        self.f.write(u'#%s\n' % '|'.join(CSVWriter.FIELDS))
+
+    def write(self, record):
+        '''output a single record'''
+        values = []
+        for k in CSVWriter.FIELDS:
+            v = getattr(record, k)
+            if v is None:
+                v = u''
+            elif k in Record.LISTS:
+                v = u';'.join(v)
+            values.append(v.replace(u'|', u'!').replace(u'\n', u' '))
+        self.f.write(u'%s\n' % u'|'.join(values))
+        self.out.records += 1
+
+    def close(self):
+        '''close the file'''
+        self.out.close()
+
+    def manifest(self):
+        return [self.out.entry()]
+
+
+class RecordFanOut(object):
+    '''
+    Hands each finished record (or skipped file) once to each of a
+    number of sinks, e.g. XMLWriter, CSVWriter and Statistics, so that
+    all outputs are written in a single pass over the records. The time
+    spent in each sink is its own phase of the metrics. As the records
+    are immutable each sink can also be run on a thread of its own, see
+    ThreadedSink.
+    '''
+    def __init__(self):
+        self.sinks = []  # (phase, sink, whether it only takes records harvested during this run)
+        self.metrics = None
+        self.threaded = False
+
+    def add(self, name, sink, fresh=False):
+        '''
+        add a sink, before start()
+        name: the phase in which the sink is timed
+        sink: see RecordSink
+        fresh: whether to only hand it the records harvested during this
+               run (and not those reused from a previous run)
+        '''
+        self.sinks.append((name, sink, fresh))
 
-        return unclosed
+    def start(self, metrics, threads=0):
+        '''
+        start handing records to the sinks
+        metrics: the Metrics in which to time the sinks
+        threads: if not 0, run each sink on a thread of its own, with a
+                 queue of this many records
+        '''
+        self.metrics = metrics
+        if threads:
+            self.threaded = True
+            self.sinks = [(name, ThreadedSink(sink, threads, metrics, name), fresh)
+                          for name, sink, fresh in self.sinks]
+
+    def write(self, record, fresh=True):
+        '''
+        output a record to each of the sinks
+        fresh: whether the record was harvested during this run
+        '''
+        for name, sink, onlyFresh in self.sinks:
+            if onlyFresh and not fresh:
+                continue
+            if self.threaded:
+                sink.write(record)  # timed on its thread
+            else:
+                with self.metrics.phase(name):
+                    sink.write(record)
+
+    def skip(self, reason):
+        '''note a skipped file in each of the sinks'''
+        for name, sink, onlyFresh in self.sinks:
+            if self.threaded:
+                sink.skip(reason)
+            else:
+                with self.metrics.phase(name):
+                    sink.skip(reason)
+
+    def close(self):
+        '''close each of the sinks, once all records have been written'''
+        for name, sink, onlyFresh in self.sinks:
+            with self.metrics.phase(name):
+                sink.close()
+
+
+class ThreadedSink(RecordSink):
+    '''
+    Runs a sink on a thread of its own, handing it the records through a
+    bounded queue, so that each output is written alongside the others
+    and the harvest. An error of the sink is raised again by the next
+    call (and by close()).
+    '''
+    def __init__(self, sink, size, metrics=None, name=None):
+        '''
+        sink: see RecordSink
+        size: the max number of records queued
+        metrics: the Metrics in which to time the sink, if any
+        name: the phase in which the sink is timed
+        '''
+        self.sink = sink
+        self.name = name
+        self.metrics = metrics
+        self.queue = Queue.Queue(size)
+        self.error = None  # exc_info of an error of the sink
+        self.thread = threading.Thread(target=self.work)
+        self.thread.daemon = True  # not to hold up a terminated run
+        self.thread.start()
+
+    def work(self):
+        '''hand the queued records to the sink until closed'''
+        while True:
+            method, value = self.queue.get()
+            if method is None:
+                return
+            if self.error is None:  # the sink is not written to after an error
+                try:
+                    if self.metrics:
+                        with self.metrics.phase(self.name):
+                            method(value)
+                    else:
+                        method(value)
+                except Exception:
+                    self.error = sys.exc_info()
+
+    def raiseError(self):
+        '''raise any error of the sink again'''
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def write(self, record):
+        self.raiseError()
+        self.queue.put((self.sink.write, record))
+
+    def skip(self, reason):
+        self.raiseError()
+        self.queue.put((self.sink.skip, reason))
+
+    def close(self):
+        '''wait for the queued records to be written, then close the sink'''
+        self.queue.put((None, None))
+        self.thread.join()
+        self.raiseError()
+        self.sink.close()
+
+    def manifest(self):
+        return self.sink.manifest()
+
+
+class PrefixIndex(object):
+    '''
+    Finds which of several groups of prefixes each of a list of strings
+    starts with, using a single pass of a regex over all of them.
+    '''
+    def __init__(self, groups):
+        '''
+        groups: dict of prefixes (list), with the group key as key
+        '''
+        prefixes = sorted(set(p for v in groups.itervalues() for p in v))
+        # the longest matching prefix also starts with any other matching one
+        self.keys = {}  # prefix: keys of the groups matched by a string starting with it
+        for p in prefixes:
+            self.keys[p] = tuple(k for k, v in groups.iteritems() if p.startswith(tuple(v)))
+        self.regex = None
+        if prefixes:
+            self.regex = re.compile(u'^(%s).*$' % HtmlFilter.prefixRegex(prefixes), re.MULTILINE | re.UNICODE)
+
+    def matchAll(self, texts):
+        '''
+        given a list of (single line) strings this finds those starting
+        with any of the prefixes
+        returns: generator of (string, tuple of group keys) in the same order
+        '''
+        if self.regex is None:
+            return
+        for m in self.regex.finditer(u'\n'.join(texts)):
+            yield m.group(0), self.keys[m.group(1)]
+
+
+class LogBuffer(object):
+    '''
+    Stands in for the log file in a parse process, holding on to the
+    messages until they can be written by the main process.
+    '''
+    def __init__(self):
+        self.messages = []
+
+    def write(self, text):
+        self.messages.append(text)
+
+    def take(self):
+        '''returns and forgets the messages written so far'''
+        messages = self.messages
+        self.messages = []
+        return messages
+
+
+_parser = None  # the EuropeanaHarvester used for parsing in a parse process
+
+
+def initParser(settings):
+    '''
+    set up a parse process with the settings needed by parseImageInfo
+    settings: dict of attribute values, see PARSER_SETTINGS
+    '''
+    global _parser
+    _parser = EuropeanaHarvester.__new__(EuropeanaHarvester)  # without loading/running anything
+    _parser.__dict__.update(settings)
+    _parser.data = {}
+    _parser.log = LogBuffer()
+
+
+def parseImageInfoChunk(chunk):
+    '''parse a chunk of imageinfo in a parse process, see parseChunk'''
+    return _parser.parseChunk(chunk)
+
+
+class FetchPool(object):
+    '''
+    A bounded pool of worker threads for running api requests
+    concurrently. At most "workers" requests are in flight at any time
+    and results are handed back to the calling thread for parsing.
+    '''
+    def __init__(self, workers=1):
+        self.workers = workers
+
+    def imap(self, func, items):
+        '''
+        applies func to each of the items using the worker threads
+        returns: generator of (item, result) in the order they are completed
+        raises: any exception raised by func, once its result is reached
+        '''
+        for item, result in self.istream(lambda i: (func(i), ), items):
+            yield item, result
+
+    def istream(self, func, items):
+        '''
+        as imap but for a func returning an iterable, each part of
+        which is handed back as soon as it has been produced
+        returns: generator of (item, part) in the order they are produced
+        raises: any exception raised by func, once its result is reached
+        '''
+        items = list(items)
+        if self.workers < 2 or len(items) < 2:
+            # no need for threads
+            for item in items:
+                for part in func(item):
+                    yield item, part
+            return
+
+        tasks = Queue.Queue()
+        for item in items:
+            tasks.put(item)
+        results = Queue.Queue(maxsize=self.workers)  # blocks workers if parsing falls behind
+        done = object()  # marks the end of the parts of an item
+
+        def worker():
+            while True:
+                try:
+                    item = tasks.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    for part in func(item):
+                        results.put((item, part, None))
+                    results.put((item, done, None))
+                except Exception:
+                    results.put((item, None, sys.exc_info()))
+
+        threads = [threading.Thread(target=worker) for i in range(min(self.workers, len(items)))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            remaining = len(items)
+            while remaining:
+                try:
+                    item, part, error = results.get(timeout=1)  # timeout allows for KeyboardInterrupt
+                except Queue.Empty:
+                    continue
+                if error:
+                    raise error[0], error[1], error[2]
+                if part is done:
+                    remaining -= 1
+                else:
+                    yield item, part
+        finally:
+            # stop handing out new tasks and let running ones finish
+            while not tasks.empty():
+                try:
+                    tasks.get_nowait()
+                except Queue.Empty:
+                    pass
+            while any(t.is_alive() for t in threads):
+                try:
+                    results.get(timeout=0.1)
+                except Queue.Empty:
+                    pass
+
+
+class RateLimiter(object):
+    '''
+    A token bucket letting through at most "rate" calls to wait() per
+    second on average, and at most "burst" of them at once. A rate of
+    None means no limit. All calls can also be held back for a while,
+    see pause(). The calls are also counted, in total and per thread.
+    '''
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)  # may go negative, as calls reserve the coming tokens
+        self.updated = time.time()
+        self.pausedUntil = 0
+        self.lock = threading.Lock()
+        self.count = 0
+        self.local = threading.local()
+
+    def wait(self):
+        '''blocks until the next request may be sent'''
+        self.local.count = self.threadCount() + 1
+        with self.lock:
+            self.count += 1
+            now = time.time()
+            delay = self.pausedUntil - now
+            if self.rate:
+                start = max(now, self.pausedUntil)
+                self.tokens = min(self.burst, self.tokens + (start - self.updated) * self.rate) - 1
+                self.updated = start
+                if self.tokens < 0:
+                    delay = start - now - self.tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        '''hold back all calls for (at least) a number of seconds'''
+        with self.lock:
+            self.pausedUntil = max(self.pausedUntil, time.time() + seconds)
+
+    def threadCount(self):
+        '''the number of calls made by the current thread'''
+        return getattr(self.local, 'count', 0)
+
+
+class PageSizer(object):
+    '''
+    Adapts the number of pages queried per api request to the replies:
+    grows (at most doubling) towards the number for which a reply would
+    reach the targeted size or time, and halves after a reply which was
+    cut short or came with warnings. It never exceeds its limit (that of
+    the api), so when starting at the limit it can only shrink. Shared
+    by the worker threads.
+    '''
+    def __init__(self, size, limit, targetBytes, targetSeconds):
+        self.current = size
+        self.limit = limit
+        self.targetBytes = targetBytes
+        self.targetSeconds = targetSeconds
+        self.lock = threading.Lock()
+
+    def size(self):
+        '''the number of pages to query in the next request'''
+        with self.lock:
+            return self.current
+
+    def observe(self, pages, seconds, size):
+        '''
+        adapt to a complete reply
+        pages: the number of pages queried
+        seconds: the time the reply took
+        size: the size of the reply in bytes
+        '''
+        fitting = pages * 2
+        if size:
+            fitting = min(fitting, pages * self.targetBytes // size)
+        if seconds:
+            fitting = min(fitting, int(pages * self.targetSeconds / seconds))
+        with self.lock:
+            self.current = max(1, min(self.limit, fitting))
+
+    def backOff(self, pages):
+        '''adapt to a reply for a number of pages which was cut short or came with warnings'''
+        with self.lock:
+            self.current = max(1, min(self.current, pages // 2))
+
+
+class Journal(object):
+    '''
+    An append-only file of json entries recording the progress of a
+    run, so that it can be resumed if terminated prematurely.
+    '''
+    def __init__(self, filename, resume=False, flushEvery=1):
+        '''
+        Opens the journal, if resuming then new entries are appended
+        to those of the earlier run(s) otherwise it is emptied
+        flushEvery: the number of entries written between flushes
+        raises: IOError
+        '''
+        self.filename = filename
+        self.flushEvery = flushEvery
+        self.unflushed = 0
+        self.resumeSize = 0  # the size of the earlier entries
+        if resume and os.path.exists(filename):
+            self.resumeSize = Journal.dropPartialEntry(filename)
+        self.f = open(filename, 'a' if resume else 'w')
 
     @staticmethod
-    def sortedDict(ddict):
-        '''turns a dict into a sorted list of tuples'''
-        sorted_ddict = sorted(ddict.iteritems(),
-                              key=operator.itemgetter(1),
-                              reverse=True
-                              )
-        return sorted_ddict
+    def dropPartialEntry(filename):
+        '''
+        truncates the journal after the last complete entry, since a
+        run may be terminated while writing
+        returns: the size of the journal
+        '''
+        f = open(filename, 'r+b')
+        f.seek(0, 2)
+        end = f.tell()
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            pos = f.read(end - start).rfind('\n')
+            if pos >= 0:
+                end = start + pos + 1
+                break
+            end = start
+        f.truncate(end)
+        f.close()
+        return end
+
+    def replay(self):
+        '''
+        read the entries written by the earlier run(s)
+        returns: generator of entries
+        '''
+        f = open(self.filename, 'r')
+        size = 0
+        for line in f:
+            size += len(line)
+            if size > self.resumeSize:
+                break
+            yield json.loads(line)
+        f.close()
+
+    def write(self, **entry):
+        '''append an entry, making sure it reaches the file once flushEvery entries are written'''
+        self.f.write('%s\n' % json.dumps(entry))
+        self.unflushed += 1
+        if self.unflushed >= self.flushEvery:
+            self.f.flush()
+            self.unflushed = 0
+
+    def close(self, remove=False):
+        '''close the journal, removing it if no longer needed'''
+        self.f.close()
+        if remove:
+            os.remove(self.filename)
 
 
 class KillException(Exception):
@@ -853,26 +2541,80 @@ class KillException(Exception):
 
 class SkipException(Exception):
     '''An exception which should skip the current item'''
-    pass
+    def __init__(self, message, reason=None):
+        '''
+        message: what went wrong, for the log
+        reason: short description used to group skipped files in the statistics
+        '''
+        Exception.__init__(self, message)
+        self.reason = reason or u'other'
 
 
 if __name__ == '__main__':
-    import sys
-    usage = '''Usage: python Europeana.py filename option
-\tfilename (required):\t the (unicode)string relative pathname to the json file for the project
-\toption (optional): can be set to:
+    usage = '''Usage: python Europeana.py filename [filename ...] options
+\tfilename (required):\t the (unicode)string relative pathname to the json file for the project,
+\t\t\t\t several files (or a directory of them) are harvested together as a batch
+\toptions (optional): any of:
 \t\tverbose:\t toggles on verbose mode with additional output to the terminal
-\t\ttest:\t\t toggles on testing (a verbose and limited run)'''
+\t\ttest:\t\t toggles on testing (a verbose and limited run)
+\t\tnocache:\t toggles off the persistent response cache
+\t\tincremental:\t only processes files added or changed since the previous incremental harvest
+\t\tresume:\t continues from where an earlier, prematurely terminated, run stopped
+\t\tparsers=N:\t parses the imageinfo in N separate processes
+\t\trecord=FILE:\t saves all api requests and replies to the (gzipped) archive FILE
+\t\treplay=FILE:\t runs offline, serving the api replies saved in FILE
+\t\tsynthetic=N:\t runs offline, against generated api replies for N files
+\t\tdumps=DIR:\t runs offline, against the Commons database dumps in DIR
+\t\tprometheus:\t also writes the metrics of the run as a Prometheus textfile
+\t\tthreadedoutput:\t writes each of the output files on a thread of its own
+\t\tcompress=gzip|xz: compresses the xml and csv output files as they are written
+\t\tshard=N:\t splits the xml output into files of N records, listed in a manifest'''
     argv = sys.argv[1:]
-    if len(argv) == 1:
-        EuropeanaHarvester(argv[0])
-    elif len(argv) == 2:
-        if argv[1] == 'test':
-            EuropeanaHarvester(argv[0], test=True)
-        elif argv[1] == 'verbose':
-            EuropeanaHarvester(argv[0], verbose=True)
-        else:
-            print usage
-    else:
+    options = ('verbose', 'test', 'nocache', 'incremental', 'resume', 'prometheus', 'threadedoutput')
+    valued = dict(a.split('=', 1) for a in argv if a.split('=', 1)[0] in ('parsers', 'record', 'replay', 'synthetic', 'dumps',
+                                                                          'compress', 'shard') and '=' in a)
+    filenames = [a for a in argv if a not in options and a.split('=', 1)[0] not in valued]
+    if not filenames or any(not os.path.exists(f) for f in filenames) \
+            or len(valued) != len([a for a in argv if '=' in a]) \
+            or any(not valued[k].isdigit() for k in ('parsers', 'synthetic', 'shard') if k in valued) \
+            or valued.get('shard') == '0' or valued.get('compress', 'gzip') not in ('gzip', 'xz') \
+            or len([k for k in ('record', 'replay', 'synthetic', 'dumps') if k in valued]) > 1 \
+            or ('replay' in valued and not os.path.exists(valued['replay'])) \
+            or ('dumps' in valued and not os.path.isdir(valued['dumps'])):
         print usage
+    else:
+        projects = []
+        for f in filenames:
+            if os.path.isdir(f):
+                projects += sorted(os.path.join(f, p) for p in os.listdir(f) if p.endswith('.json'))
+            else:
+                projects.append(f)
+        api = None
+        if 'replay' in valued:
+            api = ReplayApi(valued['replay'])
+        elif 'synthetic' in valued:
+            api = SyntheticApi(int(valued['synthetic']))
+        elif 'dumps' in valued:
+            from DumpBackend import DumpApi  # only needed for dumps
+            try:
+                api = DumpApi.fromProjects(valued['dumps'], projects, verbose='verbose' in argv or 'test' in argv)
+            except IOError, e:
+                print u'Error reading the dumps: %s' % e
+                sys.exit(1)
+        kwargs = {'verbose': 'verbose' in argv,
+                  'test': 'test' in argv,
+                  'cache': 'nocache' not in argv,
+                  'incremental': 'incremental' in argv,
+                  'resume': 'resume' in argv,
+                  'parsers': int(valued.get('parsers', 0)),
+                  'api': api,
+                  'record': valued.get('record'),
+                  'prometheus': 'prometheus' in argv,
+                  'threadedOutput': 'threadedoutput' in argv,
+                  'compress': valued.get('compress'),
+                  'shard': int(valued.get('shard', 0))}
+        if len(projects) == 1:
+            EuropeanaHarvester(projects[0], **kwargs)
+        else:
+            BatchHarvester(projects, **kwargs)
 # EoF
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Filtering of the html found in the extmetadata of Commons files
+
+stripBlocks() and truncate() make a single pass over the tags and
+entities of the text, so they run in linear time regardless of how many
+tags there are. A Remover strips a set of strings and patterns (such as
+the credit lines of creditStrings.json) from texts, also in a single
+pass, using one regular expression built by prefixRegex() in which
+strings sharing a prefix are grouped together.
+'''
+
+import os
+import re
+
+# a start/end tag (name and whether it is an end or self-closing tag) or an entity
+TOKEN = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9]*)(?:\s[^<>]*?)?(/?)>|&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);')
+# start/end tags of specific elements, by tuple of element names
+BLOCKS = {}
+# elements which are never closed
+VOID = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                  'link', 'meta', 'param', 'source', 'track', 'wbr'])
+
+
+def stripBlocks(text, tags):
+    '''
+    given a string and a list of tags this strips out all blocks of
+    these tags, i.e. everything from <tag ...> to the matching </tag>
+    including any nested blocks.
+    A block which is never closed is left as it is.
+    returns: (stripped text, list of the tags left unclosed)
+    '''
+    lowered = text.lower()
+    if not any(u'<%s' % t in lowered for t in tags):
+        return text, []  # nothing to strip
+    tags = tuple(tags)
+    if tags not in BLOCKS:
+        BLOCKS[tags] = re.compile(r'<(/?)(%s)(?:\s[^<>]*?)?(/?)>' % '|'.join(re.escape(t) for t in tags), re.IGNORECASE)
+    parts = []
+    pos = 0  # start of the text not yet added to parts
+    blockStart = 0  # start of the outermost open block
+    stack = []  # open blocks
+    for m in BLOCKS[tags].finditer(text):
+        name = m.group(2).lower()
+        if not m.group(1):
+            if not stack:
+                parts.append(text[pos:m.start()])
+                blockStart = m.start()
+            if not m.group(3):
+                stack.append(name)
+            elif not stack:
+                pos = m.end()  # a self-closed block is simply dropped
+        elif name in stack:
+            # also closes any blocks opened, but not closed, within this one
+            while stack.pop() != name:
+                pass
+            if not stack:
+                pos = m.end()
+        # else a stray end tag which is left as it is
+    if stack:
+        parts.append(text[blockStart:])
+    else:
+        parts.append(text[pos:])
+    return u''.join(parts), stack
+
+
+def truncate(text, length, ellipsis=u'...'):
+    '''
+    given a string this truncates it to at most length visible
+    characters, where tags are not counted and an entity counts as a
+    single character. The ellipsis is added where the text was cut and
+    any tags left open at that point are then closed.
+    returns: truncated text (or the same text if short enough)
+    '''
+    if len(text) <= length:
+        return text  # can't have more visible characters than that
+    limit = length - len(ellipsis)  # visible characters kept if truncated
+    visible = 0
+    pos = 0  # end of the last token
+    stack = []  # open tags
+    cut = None  # (position, open tags) once the limit is passed
+    for m in TOKEN.finditer(text):
+        n = m.start() - pos  # plain text since the last token
+        if cut is None and visible + n > limit:
+            cut = (pos + limit - visible, list(stack))
+        visible += n
+        name = m.group(2)
+        if not name:
+            # an entity
+            if cut is None and visible + 1 > limit:
+                cut = (m.start(), list(stack))
+            visible += 1
+        elif m.group(1):
+            name = name.lower()
+            if name in stack:
+                while stack.pop() != name:
+                    pass
+        elif not m.group(3) and name.lower() not in VOID:
+            stack.append(name.lower())
+        pos = m.end()
+        if visible > length:
+            break  # no need to look further
+    else:
+        n = len(text) - pos
+        if cut is None and visible + n > limit:
+            cut = (pos + limit - visible, list(stack))
+        visible += n
+
+    if visible <= length:
+        return text
+    pos, unclosed = cut
+    return u'%s%s%s' % (text[:pos], ellipsis, u''.join(u'</%s>' % t for t in reversed(unclosed)))
+
+
+def prefixRegex(strings):
+    '''
+    given a sorted list of unique strings this builds a regular
+    expression matching any of them, preferring the longest match
+    returns: (unicode)string regex
+    '''
+    end = strings[0] == u''  # whether the empty string is included
+    if end:
+        strings = strings[1:]
+    alternatives = []
+    i = 0
+    while i < len(strings):
+        # group the strings with the same first character
+        j = i + 1
+        while j < len(strings) and strings[j][0] == strings[i][0]:
+            j += 1
+        prefix = os.path.commonprefix(strings[i:j])
+        rest = [s[len(prefix):] for s in strings[i:j]]
+        if len(rest) == 1:
+            alternatives.append(re.escape(prefix))
+        else:
+            alternatives.append(u'%s%s' % (re.escape(prefix), prefixRegex(rest)))
+        i = j
+    if not alternatives:
+        return u''
+    return u'(?:%s)%s' % (u'|'.join(alternatives), u'?' if end else u'')
+
+
+class Remover(object):
+    '''
+    Removes all occurences of a set of strings, and of patterns, from
+    texts in a single pass.
+    The strings are compiled into one regular expression, factored by
+    their common prefixes, so that each position of the text is only
+    compared once against the strings sharing the same start.
+    In a pattern {version} matches any version number (e.g. 1.2.2 or
+    1.3-1) and the whitespace between tags is ignored, so that a pattern
+    is unaffected by new versions of an otherwise unchanged html blob.
+    '''
+    VERSION = u'{version}'
+
+    def __init__(self, strings=(), patterns=()):
+        alternatives = []
+        strings = sorted(set(s for s in strings if s))
+        if strings:
+            alternatives.append(prefixRegex(strings))
+        for p in patterns:
+            alternatives.append(Remover.compilePattern(p))
+        self.regex = None
+        if alternatives:
+            self.regex = re.compile(u'|'.join(u'(?:%s)' % a for a in alternatives), re.UNICODE)
+
+    def remove(self, text):
+        '''
+        given a string this removes all occurences of the strings and
+        patterns
+        returns: the remaining text
+        '''
+        if self.regex is None:
+            return text
+        return self.regex.sub(u'', text)
+
+    @staticmethod
+    def compilePattern(pattern):
+        '''
+        turn a pattern into a regular expression, see Remover
+        returns: (unicode)string regex
+        '''
+        regex = []
+        for i, part in enumerate(pattern.split(Remover.VERSION)):
+            if i > 0:
+                regex.append(u'[0-9]+(?:[.\-][0-9]+)*')
+            # whitespace between tags is ignored
+            for j, chunk in enumerate(re.split(r'>\s*<', part)):
+                if j > 0:
+                    regex.append(u'>\\s*<')
+                regex.append(re.escape(chunk))
+        return u''.join(regex)
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Instrumentation of the runs of EuropeanaHarvester
+
+Collects the time spent in each phase of a run, the api requests (count
+and latency) per kind of request, the retried requests by reason and
+the outcome of each file. At the end of a run these are written as a
+json report:
+<output>-metrics.json
+and optionally as a Prometheus textfile (for the node exporter):
+<output>.prom
+For a batch the metrics are those of the whole batch, written next to
+the output files of each of its projects.
+
+The raw replies are not available from WikiApi, so the size of a reply
+can only be estimated, from its json encoding (see replySize). This is
+only done for the imageinfo replies, whose size is used by the harvest
+and is counted as extmetadata-filtered-bytes. Phases running in the
+worker threads are summed over the threads, so they may add up to more
+than the run took.
+'''
+
+import codecs
+import json
+import os
+import threading
+import time
+
+
+class Phase(object):
+    '''times a phase, as a context manager'''
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc):
+        self.metrics.addTime(self.name, time.time() - self.start)
+
+
+class Metrics(object):
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self):
+        self.lock = threading.Lock()  # shared by the worker threads
+        self.started = time.time()
+        self.ended = None
+        self.phases = {}  # name: [calls, seconds]
+        self.requests = {}  # kind: [count, list of latencies]
+        self.outcomes = {}  # u'record' or reason for skipping: count
+        self.retries = {}  # reason for retrying a request: count
+        self.counters = {}  # name: value, for anything else worth reporting
+
+    def phase(self, name):
+        '''
+        time the with-block as (part of) a phase
+        returns: context manager
+        '''
+        return Phase(self, name)
+
+    def addTime(self, name, seconds):
+        '''add time spent in a phase'''
+        with self.lock:
+            p = self.phases.get(name)
+            if p is None:
+                p = self.phases[name] = [0, 0.0]
+            p[0] += 1
+            p[1] += seconds
+
+    def request(self, kind, seconds):
+        '''
+        count an api request
+        kind: the kind of request, e.g. the prop queried
+        seconds: the latency of the request
+        '''
+        with self.lock:
+            r = self.requests.get(kind)
+            if r is None:
+                r = self.requests[kind] = [0, []]
+            r[0] += 1
+            r[1].append(seconds)
+
+    @staticmethod
+    def replySize(reply):
+        '''
+        estimate the size of a reply, from its json encoding
+        reply: the decoded reply
+        returns: int
+        '''
+        return len(json.dumps(reply, separators=(',', ':')))
+
+    def retry(self, reason):
+        '''count a retried api request, reason is why it failed'''
+        with self.lock:
+            self.retries[reason] = self.retries.get(reason, 0) + 1
+
+    def add(self, name, value=1):
+        '''add to a named counter'''
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def counter(self, name):
+        '''the value of a named counter'''
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def outcome(self, reason=None):
+        '''count an output file, reason is why it was skipped (None for a record)'''
+        key = reason or u'record'
+        with self.lock:
+            self.outcomes[key] = self.outcomes.get(key, 0) + 1
+
+    def end(self):
+        '''mark the end of the run'''
+        self.ended = time.time()
+
+    @staticmethod
+    def quantile(values, q):
+        '''the q-quantile (nearest rank) of sorted values'''
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def report(self):
+        '''
+        summarise the metrics
+        returns: dict
+        '''
+        with self.lock:
+            seconds = (self.ended or time.time()) - self.started
+            records = self.outcomes.get(u'record', 0)
+            requests = {}
+            for kind, (count, latencies) in self.requests.iteritems():
+                latencies = sorted(latencies)
+                requests[kind] = {'count': count,
+                                  'seconds': round(sum(latencies), 3),
+                                  'latency': dict(('p%d' % round(q * 100), round(Metrics.quantile(latencies, q), 4)) for q in Metrics.QUANTILES)}
+            return {'seconds': round(seconds, 3),
+                    'records': records,
+                    'records-per-second': round(records / seconds, 2) if seconds else 0.0,
+                    'skipped': dict((k, v) for k, v in self.outcomes.iteritems() if k != u'record'),
+                    'phases': dict((k, {'calls': c, 'seconds': round(s, 3)}) for k, (c, s) in self.phases.iteritems()),
+                    'requests': requests,
+                    'retries': dict(self.retries),
+                    'counters': dict(self.counters),
+                    'total-requests': sum(r['count'] for r in requests.itervalues())}
+
+    def write(self, output, project, prometheus=False, batch=None):
+        '''
+        write the json report and, if requested, the Prometheus textfile
+        output: the output-pattern of the project
+        project: the name of the project, used as label
+        batch: the names of the projects, if the metrics are those of a batch
+        raises: IOError, OSError
+        '''
+        report = self.report()
+        report['project'] = project
+        if batch:
+            report['batch'] = batch
+        f = codecs.open(u'%s-metrics.json' % output, 'w', 'utf-8')
+        f.write(json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False))
+        f.close()
+        if prometheus:
+            # written to a temporary file first, since the exporter may read it at any time
+            f = codecs.open(u'%s.prom.tmp' % output, 'w', 'utf-8')
+            f.write(Metrics.prometheusText(report, project))
+            f.close()
+            os.rename(u'%s.prom.tmp' % output, u'%s.prom' % output)
+
+    @staticmethod
+    def prometheusText(report, project):
+        '''
+        the report in the Prometheus text format
+        returns: (unicode)string
+        '''
+        def label(v):
+            return unicode(v).replace(u'\\', u'\\\\').replace(u'"', u'\\"').replace(u'\n', u'\\n')
+
+        lines = []
+
+        def metric(name, help, samples):
+            lines.append(u'# HELP europeana_harvester_%s %s' % (name, help))
+            lines.append(u'# TYPE europeana_harvester_%s gauge' % name)
+            for labels, value in samples:
+                labels = [(u'project', project)] + labels
+                lines.append(u'europeana_harvester_%s{%s} %s' % (name, u','.join(u'%s="%s"' % (k, label(v)) for k, v in labels), value))
+
+        metric(u'run_seconds', u'Duration of the last run', [([], report['seconds'])])
+        metric(u'records_per_second', u'Records output per second in the last run', [([], report['records-per-second'])])
+        metric(u'files', u'Files output in the last run, by outcome',
+               [([(u'outcome', u'record')], report['records'])] +
+               [([(u'outcome', u'skipped'), (u'reason', k)], v) for k, v in sorted(report['skipped'].iteritems())])
+        metric(u'phase_seconds', u'Time spent in each phase of the last run',
+               [([(u'phase', k)], v['seconds']) for k, v in sorted(report['phases'].iteritems())])
+        metric(u'requests', u'Api requests sent in the last run, by kind',
+               [([(u'kind', k)], v['count']) for k, v in sorted(report['requests'].iteritems())])
+        metric(u'retries', u'Api requests retried in the last run, by reason',
+               [([(u'reason', k)], v) for k, v in sorted(report['retries'].iteritems())])
+        metric(u'request_latency_seconds', u'Latency of the api requests in the last run, by kind and quantile',
+               [([(u'kind', k), (u'quantile', u'%g' % q)], v['latency']['p%d' % round(q * 100)])
+                for k, v in sorted(report['requests'].iteritems()) for q in Metrics.QUANTILES])
+        for k, v in sorted(report['counters'].iteritems()):
+            metric(k.replace(u'-', u'_'), u'%s in the last run' % k.capitalize().replace(u'-', u' '), [([], v)])
+        metric(u'last_run_timestamp_seconds', u'When the last run ended', [([], int(time.time()))])
+        return u'%s\n' % u'\n'.join(lines)
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+The record of a single harvested file as used by EuropeanaHarvester
+
+A Record is immutable once created so that it can safely be handed to
+several output writers. Text fields are unicode (or None if not
+available) and the multi-valued fields are tuples of unicode.
+'''
+
+
+class Record(object):
+    # text fields, None if not available
+    TEXT = ('title', 'medialink', 'identifier', 'mediatype', 'description',
+            'credit', 'usageTerms', 'lat', 'lon', 'uploader', 'photographer',
+            'creator', 'copyright', 'created')
+    # multi-valued fields
+    LISTS = ('categories', 'sourcelinks')
+    __slots__ = TEXT + LISTS
+
+    def __init__(self, **fields):
+        '''
+        Creates a record from the given fields, any text field not
+        given is None and any multi-valued field is empty
+        raises: TypeError if given an unknown field
+        '''
+        for k in Record.TEXT:
+            v = fields.pop(k, None)
+            if v is not None and not isinstance(v, unicode):
+                v = v.decode('utf-8') if isinstance(v, str) else unicode(v)
+            object.__setattr__(self, k, v)
+        for k in Record.LISTS:
+            object.__setattr__(self, k, tuple(unicode(v) for v in fields.pop(k, ())))
+        if fields:
+            raise TypeError(u'Unknown record fields: %s' % ', '.join(fields.keys()))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(u'Record is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(u'Record is immutable')
+
+    def __repr__(self):
+        return 'Record(%s)' % ', '.join('%s=%r' % (k, getattr(self, k)) for k in Record.__slots__)
+
+    def toDict(self):
+        '''
+        the record as a (json serialisable) dict
+        returns: dict
+        '''
+        d = dict((k, getattr(self, k)) for k in Record.TEXT)
+        for k in Record.LISTS:
+            d[k] = list(getattr(self, k))
+        return d
+
+    @staticmethod
+    def fromDict(d):
+        '''
+        the record of a dict, as given by toDict
+        returns: Record
+        '''
+        return Record(**dict((str(k), v) for k, v in d.iteritems()))
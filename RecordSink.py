@@ -0,0 +1,41 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+The base class of the outputs of EuropeanaHarvester
+
+Each output (e.g. the xml, the csv and the statistics) is a RecordSink
+handed the records by Europeana.RecordFanOut. It is kept in a module of
+its own so that outputs outside of Europeana.py can derive from it.
+'''
+
+
+class RecordSink(object):
+    '''
+    An output of the records, see Europeana.RecordFanOut: it is handed
+    each of the finished records through write() and the reason for each
+    skipped file through skip(), then closed. Each method does nothing
+    unless overridden, so that a sink only implements what it outputs.
+    '''
+    def write(self, record):
+        '''output a single record'''
+        pass
+
+    def skip(self, reason):
+        '''note a skipped file, ignored unless the output counts them'''
+        pass
+
+    def close(self):
+        '''finish the output'''
+        pass
+
+    def manifest(self):
+        '''
+        the files written, once closed, see Europeana.OutputFile.entry
+        returns: list of dicts
+        '''
+        return []
@@ -0,0 +1,123 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Persistent cache of api replies used by EuropeanaHarvester
+
+Each entry is stored per kind of reply (e.g. imageinfo or content) and
+pageId together with the revision of the page at the time it was
+stored. An entry is only handed back if the page is still at the same
+revision, so a changed page always triggers a new api request.
+
+Entries are evicted once they have not been used for maxAge seconds
+and, if the cache grows beyond maxSize bytes, the least recently used
+entries are evicted until it fits.
+'''
+
+import json
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache(object):
+    def __init__(self, filename, maxAge=None, maxSize=None):
+        '''
+        Opens (or creates) the cache database
+        filename: the (unicode)string pathname to the sqlite database
+        maxAge: seconds an unused entry is kept (None for no limit)
+        maxSize: max total size, in bytes, of the stored replies (None for no limit)
+        raises: sqlite3.Error
+        '''
+        self.maxAge = maxAge
+        self.maxSize = maxSize
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()  # the connection is shared by the worker threads
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS responses (
+                               kind TEXT NOT NULL,
+                               pageid INTEGER NOT NULL,
+                               revid INTEGER NOT NULL,
+                               accessed REAL NOT NULL,
+                               size INTEGER NOT NULL,
+                               data TEXT NOT NULL,
+                               PRIMARY KEY (kind, pageid))''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.db.commit()
+
+    def get(self, kind, pageId, revId):
+        '''
+        look up the stored reply for a page
+        returns: the decoded reply or None if missing or outdated
+        '''
+        with self.lock:
+            row = self.db.execute('SELECT data FROM responses WHERE kind=? AND pageid=? AND revid=?',
+                                  (kind, pageId, revId)).fetchone()
+            if row is None:
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+                return None
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+            self.db.execute('UPDATE responses SET accessed=? WHERE kind=? AND pageid=?',
+                            (time.time(), kind, pageId))
+        return json.loads(row[0])
+
+    def put(self, kind, entries):
+        '''
+        store replies, replacing any older revision of the same pages
+        entries: list of (pageId, revId, reply) tuples
+        returns: Nothing
+        '''
+        now = time.time()
+        rows = []
+        for pageId, revId, reply in entries:
+            data = json.dumps(reply, ensure_ascii=False)
+            rows.append((kind, pageId, revId, now, len(data), data))
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.db.commit()
+
+    def evict(self):
+        '''
+        remove entries which are too old and, if needed, the least
+        recently used ones until the cache fits within maxSize
+        returns: number of evicted entries
+        '''
+        evicted = 0
+        with self.lock:
+            if self.maxAge is not None:
+                evicted += self.db.execute('DELETE FROM responses WHERE accessed < ?',
+                                           (time.time() - self.maxAge, )).rowcount
+            if self.maxSize is not None:
+                total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+                if total > self.maxSize:
+                    excess = total - self.maxSize
+                    doomed = []
+                    for kind, pageId, size in self.db.execute('SELECT kind, pageid, size FROM responses ORDER BY accessed'):
+                        doomed.append((kind, pageId))
+                        excess -= size
+                        if excess <= 0:
+                            break
+                    self.db.executemany('DELETE FROM responses WHERE kind=? AND pageid=?', doomed)
+                    evicted += len(doomed)
+            self.db.commit()
+        return evicted
+
+    def stats(self):
+        '''
+        summarise hits and misses per kind of reply
+        returns: (unicode)string
+        '''
+        kinds = sorted(set(self.hits.keys() + self.misses.keys()))
+        return u', '.join(u'%s: %d hits, %d misses' % (k, self.hits.get(k, 0), self.misses.get(k, 0)) for k in kinds)
+
+    def close(self):
+        '''evict outdated entries and close the database'''
+        evicted = self.evict()
+        with self.lock:
+            self.db.close()
+        return evicted
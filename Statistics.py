@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Statistics about the output of EuropeanaHarvester
+
+The statistics are collected one record (or skipped file) at a time, as
+one of the outputs of the records (see Europeana.RecordFanOut), and each
+is output as its own csv file when closed:
+<output>-<Name>Statistics.csv
+'''
+
+import codecs
+import collections
+import re
+from RecordSink import RecordSink
+
+YEAR = re.compile(r'(?<![0-9])([0-9]{4})(?![0-9])')
+
+
+class Statistics(RecordSink):
+    # name of each statistic: (column header, whether to sort by value rather than frequency)
+    FILES = (('Category', u'category', False),
+             ('License', u'copyright', False),
+             ('Photographer', u'photographer', False),
+             ('Uploader', u'uploader', False),
+             ('Year', u'year', True),
+             ('Coordinate', u'coordinates', False),
+             ('Skip', u'reason', False))
+
+    def __init__(self, output):
+        '''
+        Opens the output files (so that any errors occur before the run)
+        output: the output-pattern of the project
+        raises: IOError
+        '''
+        self.counts = {}  # name: Counter of {value: frequency}
+        self.files = {}  # name: file
+        for name, header, byValue in Statistics.FILES:
+            self.counts[name] = collections.Counter()
+            self.files[name] = codecs.open(u'%s-%sStatistics.csv' % (output, name), 'w', 'utf-8')
+
+    def count(self, name, value):
+        '''add one to the frequency of a value'''
+        self.counts[name][value] += 1
+
+    def write(self, record):
+        '''
+        count an output record
+        returns: Nothing
+        '''
+        for c in record.categories:
+            self.count('Category', c)
+        self.count('License', record.copyright)
+        if record.photographer:
+            self.count('Photographer', record.photographer)
+        if record.uploader:
+            self.count('Uploader', record.uploader)
+        year = YEAR.search(record.created) if record.created else None
+        self.count('Year', year.group(1) if year else u'unknown')
+        if record.lat and record.lon:
+            self.count('Coordinate', u'with coordinates')
+        else:
+            self.count('Coordinate', u'without coordinates')
+
+    def skip(self, reason):
+        '''
+        count a skipped file
+        returns: Nothing
+        '''
+        self.count('Skip', reason or u'unknown')
+
+    def close(self):
+        '''
+        output each of the statistics, by descending frequency or
+        by value, then close the files
+        '''
+        for name, header, byValue in Statistics.FILES:
+            f = self.files[name]
+            if byValue:
+                rows = sorted(self.counts[name].iteritems())
+            else:
+                rows = self.counts[name].most_common()
+            f.write(u'#frequency|%s\n' % header)
+            for k, v in rows:
+                f.write(u'%d|%s\n' % (v, k))
+            f.close()
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Benchmark of the credit filtering of EuropeanaHarvester
+
+Compares the compiled HtmlFilter.Remover with the earlier loop calling
+replace() once per entry in creditStrings.json, as the list grows. The
+longer lists are padded with variants of the real entries (as if every
+new version of an app added a new html blob).
+
+Usage: python benchmarks/creditstrings.py [credits]
+\tcredits: number of synthetic credits filtered per list (default 10000)
+'''
+
+import codecs
+import json
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HtmlFilter
+
+
+def legacyFiltering(credit, strings):
+    '''the earlier filtering, as found in EuropeanaHarvester'''
+    for f in strings:
+        credit = credit.replace(f, '')
+        if len(credit.strip()) == 0:
+            return None
+    return credit
+
+
+def newFiltering(credit, remover):
+    '''the filtering using HtmlFilter.Remover, as in EuropeanaHarvester'''
+    credit = remover.remove(credit)
+    if len(credit.strip()) == 0:
+        return None
+    return credit
+
+
+def paddedStrings(strings, n):
+    '''pad the list of strings with versioned variants up to n entries'''
+    padded = list(strings)
+    i = 0
+    while len(padded) < n:
+        s = strings[i % len(strings)]
+        padded.append(s.replace(u'</', u'<!-- v%d --></' % i, 1))
+        i += 1
+    return padded[:n]
+
+
+def syntheticCredits(n, strings):
+    '''credits with plain text, some of which contain one of the strings'''
+    credits = []
+    for i in range(n):
+        credit = u'<span>Photograph by <a href="//commons.wikimedia.org/wiki/User:U%d">User %d</a>, Some archive</span>' % (i, i)
+        if i % 3 == 0:
+            credit += strings[i % len(strings)]
+        credits.append(credit)
+    return credits
+
+
+def timeIt(func, credits, arg):
+    '''time func over all of the credits'''
+    start = time.time()
+    for c in credits:
+        func(c, arg)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    f = codecs.open(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'creditStrings.json'), 'r', 'utf-8')
+    strings = json.load(f)['creditStrings']
+    f.close()
+    print u'Filtering %d synthetic credits' % n
+    print u'%8s %12s %12s %12s %8s' % (u'entries', u'compile (s)', u'legacy (s)', u'Remover (s)', u'speedup')
+    for size in (len(strings), 50, 100, 200, 500):
+        padded = paddedStrings(strings, size)
+        credits = syntheticCredits(n, padded)
+        start = time.time()
+        remover = HtmlFilter.Remover(padded)
+        compiled = time.time() - start
+        before = timeIt(legacyFiltering, credits, padded)
+        after = timeIt(newFiltering, credits, remover)
+        print u'%8d %12.3f %12.3f %12.3f %7.1fx' % (size, compiled, before, after, before / after)
@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Benchmark of the concurrent api requests of EuropeanaHarvester
+
+Serves the replies of ApiBackend.SyntheticApi from a stub http server on
+localhost, which answers each request after a fixed latency, and
+harvests the same files through it with a single worker and with several
+(see FetchPool), comparing the outputs of the two runs. A further run,
+limited to a number of requests per second (see RateLimiter), checks
+from the times at which the server received the requests that the limit
+held. Differing outputs, or a rate above the limit, make the exit
+status 1.
+
+Usage: python benchmarks/fetchpool.py [files] [workers] [latency] [rate]
+\tfiles: number of synthetic files (default 2000)
+\tworkers: concurrent requests of the parallel run (default 8)
+\tlatency: seconds taken by the server to answer a request (default 0.05)
+\trate: max requests per second of the rate limited run (default 20)
+'''
+
+import BaseHTTPServer
+import SocketServer
+import codecs
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from Europeana import EuropeanaHarvester
+from ApiBackend import SyntheticApi
+
+PROJECT = {u'project-name': u'fetchpool',
+           u'id-templates': {u'Template:BBR': [u'http://kulturarvsdata.se/raa/bbr/html/']},
+           u'base-categories': [u'Category:Images from Wiki Loves Monuments 2013 in Sweden'],
+           u'output-pattern': u'output/fetchpool'}
+SLACK = 0.01  # seconds by which the arrival of a request may vary, when checking the rate
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''answers a request with the reply of the synthetic api, after the latency of the server'''
+    def do_GET(self):
+        params = urlparse.parse_qsl(urlparse.urlparse(self.path).query, keep_blank_values=True)
+        action = dict(params).get('action')
+        params = [(k, v) for k, v in params if k not in ('action', 'format')]
+        with self.server.lock:
+            self.server.times.append(time.time())
+        body = json.dumps(self.server.api.httpGET(action, params))
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # not to drown the results
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''a local http server of canned replies, answering each request on a thread of its own'''
+    daemon_threads = True
+    request_queue_size = 64
+
+    def __init__(self, api, latency):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.api = api
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.times = []  # when each request was received
+
+    def url(self):
+        return 'http://127.0.0.1:%d/w/api.php' % self.server_address[1]
+
+
+class HttpApi(object):
+    '''sends each request over http, as the httpGET of WikiApi'''
+    def __init__(self, url):
+        self.url = url
+
+    def httpGET(self, action, params):
+        query = [('action', action), ('format', 'json')]
+        query += [(k, v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in params]
+        return json.load(urllib2.urlopen('%s?%s' % (self.url, urllib.urlencode(query))))
+
+
+def harvest(server, settings):
+    '''
+    harvest the files served by the server in a scratch directory
+    settings: dict of the optional parameters of the project file
+    returns: (seconds taken, sorted lines of the csv output, request times)
+    '''
+    project = dict(PROJECT)
+    project.update(settings)
+    directory = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(ROOT, 'creditStrings.json'), directory)
+        os.chdir(directory)
+        os.mkdir('output')
+        f = codecs.open('project.json', 'w', 'utf-8')
+        json.dump(project, f)
+        f.close()
+        server.times = []
+        start = time.time()
+        EuropeanaHarvester(u'project.json', cache=False, api=HttpApi(server.url()))
+        seconds = time.time() - start
+        f = codecs.open('output/fetchpool.csv', 'r', 'utf-8')
+        lines = sorted(f.read().splitlines())
+        f.close()
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(directory)
+    return seconds, lines, list(server.times)
+
+
+def maxExcess(times, rate, burst):
+    '''
+    the most requests, within any stretch of time, above those let
+    through by a token bucket of the rate and burst
+    returns: float, not above 0 if the limit held
+    '''
+    excess = float('-inf')
+    for i in range(len(times)):
+        for j in range(i, len(times)):
+            excess = max(excess, (j - i + 1) - burst - rate * (times[j] - times[i] + SLACK))
+    return excess
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    rate = float(sys.argv[4]) if len(sys.argv) > 4 else 20
+    credits = json.load(codecs.open(os.path.join(ROOT, 'creditStrings.json'), 'r', 'utf-8'))['creditStrings']
+    server = StubServer(SyntheticApi(n, idTemplates=PROJECT[u'id-templates'], credits=credits), latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    failures = []
+    print u'Harvesting %d synthetic files, with a latency of %.3f s per request' % (n, latency)
+    print u'%-24s %8s %9s %12s' % (u'run', u'seconds', u'requests', u'requests/s')
+    results = {}
+    for name, settings in ((u'workers=1', {}), (u'workers=%d' % workers, {u'workers': workers})):
+        seconds, lines, times = harvest(server, settings)
+        results[name] = lines
+        print u'%-24s %8.2f %9d %12.1f' % (name, seconds, len(times), len(times) / seconds)
+        if name == u'workers=1':
+            before = seconds
+    print u'Speedup: %.2fx' % (before / seconds)
+    if len(set(tuple(v) for v in results.itervalues())) != 1:
+        failures.append(u'the outputs of the runs differ')
+
+    name = u'workers=%d, %g/s' % (workers, rate)
+    seconds, lines, times = harvest(server, {u'workers': workers, u'max-requests-per-second': rate})
+    print u'%-24s %8.2f %9d %12.1f' % (name, seconds, len(times), (len(times) - 1) / (times[-1] - times[0]))
+    excess = maxExcess(times, rate, 1)
+    if excess > 0:
+        failures.append(u'the rate limit was exceeded by %.1f requests' % excess)
+    if lines != results[u'workers=1']:
+        failures.append(u'the output of the rate limited run differs')
+    server.shutdown()
+    if failures:
+        print u'Failures:\n%s' % u'\n'.join(failures)
+        sys.exit(1)
+    print u'Same output from all runs and the rate limit held'
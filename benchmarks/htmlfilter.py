@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Benchmark of the description filtering of EuropeanaHarvester
+
+Compares HtmlFilter with the earlier stripTag/findOpenTags based
+filtering, both on a corpus of descriptions and on single descriptions
+of increasing size (to show how the running time grows).
+
+The corpus is read from the ImageDescription of the imageinfo stored in
+the response cache (i.e. real Commons descriptions from earlier runs)
+or from a json file containing a list of descriptions.
+
+Usage: python benchmarks/htmlfilter.py [corpus]
+\tcorpus: the response cache or json file (default EuropeanaHarvester.cache)
+'''
+
+import json
+import os
+import sqlite3
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HtmlFilter
+
+CC0LENGTH = 200
+FILTERTAGS = ['div', 'table']
+
+
+class NullLog(object):
+    def write(self, text):
+        pass
+
+
+class LegacyFilter(object):
+    '''the earlier filtering, as found in EuropeanaHarvester'''
+    log = NullLog()
+    cc0Length = CC0LENGTH
+
+    def descriptionFiltering(self, description):
+        for t in FILTERTAGS:
+            description = self.stripTag(description, t)
+            if len(description.strip()) == 0:
+                return None
+        if len(description) > self.cc0Length:
+            pos = self.cc0Length-3
+            cropped = description[pos:].strip()
+            if cropped.find('>') > 0:
+                if (cropped.find(u'<') < 0) or (cropped.find(u'<') > 0 and (cropped.find('>') < cropped.find(u'<'))):
+                    pos = description[:pos].rfind('<')
+                    if pos >= 0:
+                        description = u'%s...' % description[:pos]
+                    else:
+                        description = u'%s...' % description[:self.cc0Length-3]
+                elif cropped.find('</') > 0:
+                    unclosed = self.findOpenTags(cropped)
+                    closing = u''
+                    for t in unclosed:
+                        closing += u'</%s>' % t
+                    description = u'%s...%s' % (description[:pos], closing)
+                else:
+                    description = u'%s...' % description[:pos]
+            else:
+                description = u'%s...' % description[:pos]
+        return description.strip()
+
+    def stripTag(self, text, t):
+        if text.find('<%s' % t) >= 0:
+            startpos = []
+            sp = text.find('<%s' % t)
+            while sp >= 0:
+                startpos.append(sp)
+                sp = text.find('<%s' % t, sp+1)
+            while len(startpos) > 0:
+                sp = startpos.pop()
+                ep = text.find('</%s>' % t, sp+1)
+                if ep < 0:
+                    break
+                else:
+                    text = text[:sp] + text[ep + len('</%s>' % t):]
+        return text
+
+    def findOpenTags(self, text):
+        findings = []
+        tClose = text.find('</')
+        while tClose > 0:
+            tag = text[tClose + len('</'):text.find('>', tClose)].strip()
+            tStart = text.find('<'+tag)
+            findings.append({'tClose': tClose, 'tag': tag, 'tStart': tStart})
+            tClose = text.find('</', tClose+len('</'))
+        unclosed = []
+        for f in findings:
+            if f['tStart'] > 0 and f['tStart'] < f['tClose']:
+                pass
+            else:
+                unclosed.append(f['tag'])
+        return unclosed
+
+
+def newFiltering(description):
+    '''the filtering using HtmlFilter, as in EuropeanaHarvester'''
+    description, unclosed = HtmlFilter.stripBlocks(description, FILTERTAGS)
+    if len(description.strip()) == 0:
+        return None
+    return HtmlFilter.truncate(description, CC0LENGTH).strip()
+
+
+def loadCorpus(filename):
+    '''
+    load the descriptions from the response cache or a json file
+    returns: list of (unicode)strings
+    '''
+    if not os.path.exists(filename):
+        return []
+    if filename.endswith('.json'):
+        return json.load(open(filename))
+    db = sqlite3.connect(filename)
+    corpus = []
+    for (data, ) in db.execute("SELECT data FROM responses WHERE kind='imageinfo'"):
+        extmetadata = json.loads(data)['imageinfo'][0]['extmetadata']
+        if 'ImageDescription' in extmetadata:
+            corpus.append(extmetadata['ImageDescription']['value'])
+    db.close()
+    return corpus
+
+
+def timeIt(func, texts, repeats=3):
+    '''best time of running func over the texts'''
+    best = None
+    for i in range(repeats):
+        start = time.time()
+        for t in texts:
+            func(t)
+        t = time.time() - start
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def nestedDescription(blocks):
+    '''a description built like those of templates nested in tables and divs'''
+    block = u'<div class="description"><table><tr><td><b>Label</b></td><td>Value with <a href="//commons">a link</a></td></tr></table></div>'
+    return u'<p>Some <i>text</i> to keep</p>%s<p>More text &amp; %s</p>' % (block * blocks, u'words ' * blocks)
+
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else u'EuropeanaHarvester.cache'
+    legacy = LegacyFilter().descriptionFiltering
+    corpus = loadCorpus(filename)
+    if corpus:
+        print u'Corpus of %d descriptions (%.2f kB on average) from %s' % (len(corpus), sum(len(c) for c in corpus) / 1024.0 / len(corpus), filename)
+        rounds = max(1, 10000 / len(corpus))  # for measurable times
+        before = timeIt(legacy, corpus * rounds)
+        after = timeIt(newFiltering, corpus * rounds)
+        print u'%-12s %8.3f s' % (u'legacy', before)
+        print u'%-12s %8.3f s' % (u'HtmlFilter', after)
+        print u'Speedup: %.2fx' % (before / after)
+    else:
+        print u'No corpus found in %s' % filename
+
+    print u'Single descriptions of increasing size:'
+    print u'%10s %12s %12s' % (u'kB', u'legacy (s)', u'HtmlFilter (s)')
+    for blocks in (100, 1000, 5000, 20000):
+        text = nestedDescription(blocks)
+        print u'%10.0f %12.4f %12.4f' % (len(text) / 1024.0, timeIt(legacy, [text], 1), timeIt(newFiltering, [text], 1))
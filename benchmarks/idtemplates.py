@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Micro-benchmark of the sourcelink matching of EuropeanaHarvester
+
+Compares the PrefixIndex based matching with the earlier nested loop
+over the id-templates and external links, for pages with an increasing
+number of id-templates and external links.
+
+Usage: python benchmarks/idtemplates.py [pages]
+\tpages: number of pages matched per case (default 2000)
+'''
+
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Europeana import PrefixIndex
+
+
+def idTemplates(n):
+    '''id-templates similar to those of the heritage registries'''
+    registries = [u'raa/bbr', u'raa/fmi', u'raa/kfartyg', u'shm/site', u'nm/object']
+    templates = {}
+    for i in range(n):
+        r = registries[i % len(registries)]
+        templates[u'Template:Registry %d' % i] = (u'http://kulturarvsdata.se/%s/html/%d/' % (r, i),
+                                                  u'http://www.registry%d.se/' % i)
+    return templates
+
+
+def page(templates, links):
+    '''the templates (list) and external links of a synthetic page'''
+    extLinks = [u'http://example.org/page/%d' % i for i in range(links)]
+    for i, prefixes in enumerate(templates.itervalues()):
+        extLinks[i % links] = u'%s%d' % (prefixes[0], i)
+    return [u'Template:Information'] + templates.keys(), extLinks
+
+
+def legacyMatching(idTemplates, templates, extLinks):
+    '''the earlier matching, as found in EuropeanaHarvester'''
+    sourcelinks = []
+    for k, v in idTemplates.iteritems():
+        if k in templates:
+            for e in extLinks:
+                if e.startswith(v):
+                    sourcelinks.append(e)
+    return sourcelinks
+
+
+def newMatching(idTemplates, idPrefixes, templates, extLinks):
+    '''the matching using PrefixIndex, as in EuropeanaHarvester'''
+    templates = set(templates)
+    found = {}
+    for e, keys in idPrefixes.matchAll(extLinks):
+        for k in keys:
+            if k in templates:
+                found.setdefault(k, []).append(e)
+    sourcelinks = []
+    for k in idTemplates.iterkeys():
+        if k in found:
+            sourcelinks += found[k]
+    return sourcelinks
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print u'Matching %d pages per case' % n
+    print u'%10s %8s %12s %12s %8s' % (u'templates', u'links', u'legacy (s)', u'index (s)', u'speedup')
+    for nTemplates, nLinks in ((1, 10), (5, 50), (10, 200), (30, 500)):
+        templates = idTemplates(nTemplates)
+        idPrefixes = PrefixIndex(templates)
+        pageTemplates, extLinks = page(templates, nLinks)
+        assert legacyMatching(templates, pageTemplates, extLinks) == newMatching(templates, idPrefixes, pageTemplates, extLinks)
+        start = time.time()
+        for i in range(n):
+            legacyMatching(templates, pageTemplates, extLinks)
+        before = time.time() - start
+        start = time.time()
+        for i in range(n):
+            newMatching(templates, idPrefixes, pageTemplates, extLinks)
+        after = time.time() - start
+        print u'%10d %8d %12.3f %12.3f %7.1fx' % (nTemplates, nLinks, before, after, before / after)
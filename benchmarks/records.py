@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Benchmark of the memory used by the records of EuropeanaHarvester
+
+Compares the slotted Record with the plain dicts previously used for
+each harvested file. The size of every object reachable from the
+records (containers as well as the strings) is counted once.
+
+Usage: python benchmarks/records.py [records]
+\trecords: number of synthetic records (default 200000)
+'''
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Record import Record
+
+
+def syntheticFields(n):
+    '''generate the fields of n records similar to those of the harvester'''
+    for i in range(n):
+        yield {'title': u'Object %d, Malmö' % i,
+               'medialink': u'https://upload.wikimedia.org/%d.jpg' % i,
+               'identifier': u'https://commons.wikimedia.org/wiki/File:Image_%d.jpg' % i,
+               'mediatype': 'IMAGE',
+               'description': u'Description of object %d with <b>bold</b> text' % i,
+               'credit': u'Some archive %d' % (i % 7),
+               'usageTerms': u'Creative Commons Attribution-Share Alike 3.0',
+               'lat': u'59.%d' % i,
+               'lon': u'18.%d' % i,
+               'uploader': None,
+               'photographer': u'<a href="//commons.wikimedia.org/wiki/User:U%d">User %d</a>' % (i % 50, i % 50),
+               'copyright': u'http://creativecommons.org/licenses/by-sa/3.0',
+               'created': u'2013-08-%02d 09:51:00' % (i % 28 + 1),
+               'categories': [u'Category %d' % (i % 30), u'Extra category %d' % i],
+               'sourcelinks': [u'http://kulturarvsdata.se/raa/bbr/html/%d' % i]}
+
+
+def deepSize(objects):
+    '''
+    the total size of the objects and everything reachable from them
+    returns: size in bytes
+    '''
+    seen = set()
+    stack = list(objects)
+    size = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.iterkeys())
+            stack.extend(o.itervalues())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+        elif isinstance(o, Record):
+            stack.extend(getattr(o, k) for k in Record.__slots__)
+    return size
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print u'Measuring %d synthetic records' % n
+    dicts = list(syntheticFields(n))
+    records = [Record(**d) for d in dicts]
+    before = deepSize(dicts)
+    after = deepSize(records)
+    print u'%-8s %7.1f MB %6d bytes/record' % (u'dict', before / 1024.0 ** 2, before / n)
+    print u'%-8s %7.1f MB %6d bytes/record' % (u'Record', after / 1024.0 ** 2, after / n)
+    print u'Saving: %.0f%%' % (100.0 * (before - after) / before)
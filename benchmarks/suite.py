@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Benchmark suite of the phases of a harvest by EuropeanaHarvester
+
+Runs complete, offline, harvests against ApiBackend.SyntheticApi for
+each corpus size, timing each phase separately along with the peak
+memory of the run. Each size is run in its own process so that the
+peak memory is that of the harvest alone. The phases are:
+fetch: the api requests (including generating the synthetic replies)
+parseImageInfo: parsing the imageinfo, including the filtering below
+descriptionFiltering, creditFiltering: the filtering of these fields
+parseContent: parsing the categories, templates and external links
+outputXML, outputCSV, statistics: writing each of the outputs
+
+The results are compared against a stored baseline and any phase
+slower (or peak memory larger) than the baseline by more than the
+threshold is reported as a regression, making the exit status 1.
+
+Usage: python benchmarks/suite.py [sizes=N,N,...] [baseline=FILE] [threshold=X] [memory-threshold=X] [save]
+\tsizes: number of files of each corpus (default 1000,10000,100000)
+\tbaseline: the json file of the baseline (default benchmarks/baseline.json)
+\tthreshold: allowed slow down of a phase, as a fraction (default 0.25)
+\tmemory-threshold: allowed increase of the peak memory, as a fraction (default 0.1)
+\tsave: store the results as the new baseline
+'''
+
+import codecs
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from Europeana import EuropeanaHarvester
+from ApiBackend import SyntheticApi
+
+PHASES = ('fetch', 'parseImageInfo', 'descriptionFiltering', 'creditFiltering',
+          'parseContent', 'outputXML', 'outputCSV', 'statistics', 'total')
+MIN_SECONDS = 0.05  # differences smaller than this are noise
+PROJECT = {u'project-name': u'benchmark',
+           u'id-templates': {u'Template:BBR': [u'http://kulturarvsdata.se/raa/bbr/html/',
+                                               u'http://kulturarvsdata.se/raa/bbra/html/'],
+                             u'Template:Fornminne': [u'http://kulturarvsdata.se/raa/fmi/html/']},
+           u'base-categories': [u'Category:Images from Wiki Loves Monuments 2013 in Sweden',
+                                u'Category:Images from Wiki Loves Monuments 2014 in Sweden'],
+           u'output-pattern': u'output/benchmark'}
+
+
+def timed(times, phase, func):
+    '''wrap func so that the time spent in it is added to times[phase]'''
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            times[phase] = times.get(phase, 0) + time.time() - start
+    return wrapper
+
+
+class TimedHarvester(EuropeanaHarvester):
+    '''a harvester timing the phases of its run'''
+    times = {}
+
+    def run(self, verbose=False, testing=False):
+        t = TimedHarvester.times
+        self.measuredGET = timed(t, 'fetch', self.measuredGET)
+        self.parseImageInfo = timed(t, 'parseImageInfo', self.parseImageInfo)
+        self.descriptionFiltering = timed(t, 'descriptionFiltering', self.descriptionFiltering)
+        self.creditFiltering = timed(t, 'creditFiltering', self.creditFiltering)
+        self.parseContent = timed(t, 'parseContent', self.parseContent)
+        phases = {'xml': 'outputXML', 'csv': 'outputCSV', 'statistics': 'statistics'}
+        for name, sink, fresh in self.outputs.sinks:
+            for method in ('write', 'skip', 'close'):
+                setattr(sink, method, timed(t, phases[name], getattr(sink, method)))
+        timed(t, 'total', EuropeanaHarvester.run)(self, verbose=verbose, testing=testing)
+
+
+def runSize(n):
+    '''
+    harvest a corpus of n synthetic files in a scratch directory
+    returns: dict of seconds per phase and the peak memory in MB
+    '''
+    directory = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(ROOT, 'creditStrings.json'), directory)
+        os.chdir(directory)
+        os.mkdir('output')
+        f = codecs.open('project.json', 'w', 'utf-8')
+        json.dump(PROJECT, f)
+        f.close()
+        credits = json.load(codecs.open('creditStrings.json', 'r', 'utf-8'))['creditStrings']
+        api = SyntheticApi(n, idTemplates=PROJECT[u'id-templates'], credits=credits)
+        TimedHarvester(u'project.json', cache=False, api=api)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(directory)
+    result = dict((p, round(TimedHarvester.times.get(p, 0), 3)) for p in PHASES)
+    result['peak-mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+    return result
+
+
+def compare(results, baseline, threshold, memoryThreshold):
+    '''
+    print the results next to the baseline
+    returns: list of regressions
+    '''
+    regressions = []
+    for n in sorted(results, key=int):
+        base = baseline.get(n, {})
+        print u'%d files' % int(n)
+        for phase in PHASES + ('peak-mb', ):
+            value = results[n][phase]
+            unit = u'MB' if phase == 'peak-mb' else u's'
+            if phase not in base:
+                print u'  %-22s %9.3f %s' % (phase, value, unit)
+                continue
+            change = (value - base[phase]) / base[phase] if base[phase] else 0
+            allowed = memoryThreshold if phase == 'peak-mb' else threshold
+            regressed = change > allowed and (phase == 'peak-mb' or value - base[phase] > MIN_SECONDS)
+            print u'  %-22s %9.3f %s (baseline %.3f, %+.0f%%)%s' % (phase, value, unit, base[phase], 100 * change,
+                                                                     u' REGRESSION' if regressed else u'')
+            if regressed:
+                regressions.append(u'%s files: %s' % (n, phase))
+    return regressions
+
+
+if __name__ == '__main__':
+    args = dict(a.split('=', 1) if '=' in a else (a, True) for a in sys.argv[1:])
+    if 'run' in args:
+        # a single size, in its own process
+        print json.dumps(runSize(int(args['run'])))
+        sys.exit(0)
+    sizes = args.get('sizes', '1000,10000,100000').split(',')
+    baselineFile = args.get('baseline', os.path.join(ROOT, 'benchmarks', 'baseline.json'))
+    threshold = float(args.get('threshold', 0.25))
+    memoryThreshold = float(args.get('memory-threshold', 0.1))
+
+    results = {}
+    for n in sizes:
+        print u'Harvesting %s synthetic files...' % n
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__), 'run=%s' % n])
+        results[n] = json.loads(out.strip().split('\n')[-1])
+    baseline = {}
+    if os.path.exists(baselineFile):
+        baseline = json.load(open(baselineFile))
+    regressions = compare(results, baseline, threshold, memoryThreshold)
+    if 'save' in args:
+        baseline.update(results)
+        f = open(baselineFile, 'w')
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.close()
+        print u'Saved the baseline to %s' % baselineFile
+    if regressions:
+        print u'Regressions: %s' % u', '.join(regressions)
+        sys.exit(1)
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Benchmark of the xml output of EuropeanaHarvester
+
+Compares the incremental XMLWriter with the earlier approach of
+building and serialising a separate element tree for each record.
+
+Usage: python benchmarks/xmlwriter.py [records]
+\trecords: number of synthetic records (default 100000)
+'''
+
+import codecs
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Europeana import XMLWriter
+from Record import Record
+from lxml import etree
+
+
+def syntheticRecords(n):
+    '''generate n records similar to those output by the harvester'''
+    for i in range(n):
+        yield {'identifier': u'https://commons.wikimedia.org/wiki/File:Image_%d.jpg' % i,
+               'sourcelinks': [u'http://kulturarvsdata.se/raa/bbr/html/%d' % i],
+               'title': u'Object %d, Malmö' % i,
+               'photographer': u'<a href="//commons.wikimedia.org/wiki/User:U%d">User %d</a>' % (i % 50, i % 50),
+               'creator': None,
+               'created': u'2013-08-%02d 09:51:00' % (i % 28 + 1),
+               'description': u'Description of object %d with <b>bold</b> text' % i,
+               'credit': u'Some archive %d' % (i % 7),
+               'categories': [u'Category %d' % (i % 30), u'Extra category %d' % i],
+               'medialink': u'https://upload.wikimedia.org/%d.jpg' % i,
+               'copyright': u'http://creativecommons.org/licenses/by-sa/3.0',
+               'mediatype': u'IMAGE',
+               'lat': u'59.%d' % i,
+               'lon': u'18.%d' % i}
+
+
+def treeWriter(filename, records):
+    '''the earlier output: one element tree, tostring and replace per record'''
+    f = codecs.open(filename, 'w', 'utf-8')
+    f.write(u"<?xml version='1.0' encoding='UTF-8'?>\n")
+    f.write(u"<output xmlns:dc=\"http://purl.org/dc/elements/1.1/\">\n")
+    for v in records:
+        dc = etree.Element('{dummy}dc', nsmap={'dc': 'dummy'})
+        fields = [('identifier', v['identifier'])]
+        fields += [('sourcelink', s) for s in v['sourcelinks']]
+        fields += [('title', v['title']), ('photographer', v['photographer']),
+                   ('created', v['created']),
+                   ('description', u'%s\nSource info: %s' % (v['description'], v['credit']))]
+        fields += [('category', c) for c in v['categories']]
+        fields += [('link', v['identifier']), ('medialink', v['medialink']),
+                   ('copyright', v['copyright']), ('type', v['mediatype']),
+                   ('latitude', v['lat']), ('longitude', v['lon'])]
+        for tag, text in fields:
+            child = etree.Element(tag)
+            child.text = text
+            dc.append(child)
+        f.write(etree.tostring(dc, pretty_print=True, encoding='unicode').replace(u' xmlns:dc="dummy"', ''))
+    f.write(u'</output>')
+    f.close()
+
+
+def xmlWriter(filename, records):
+    '''the incremental XMLWriter, given Records'''
+    writer = XMLWriter(filename)
+    for v in records:
+        writer.write(v)
+    writer.close()
+
+
+def benchmark(name, func, records, repeats):
+    '''time func on the records and print the best throughput'''
+    fd, filename = tempfile.mkstemp(suffix='.xml')
+    os.close(fd)
+    elapsed = None
+    for i in range(repeats):
+        start = time.time()
+        func(filename, records)
+        t = time.time() - start
+        if elapsed is None or t < elapsed:
+            elapsed = t
+    size = os.path.getsize(filename)
+    os.remove(filename)
+    print u'%-12s %7.2f s %9.0f records/s %7.1f MB' % (name, elapsed, len(records) / elapsed, size / 1024.0 ** 2)
+    return elapsed
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    records = list(syntheticRecords(n))
+    print u'Writing %d synthetic records, best of %d' % (n, repeats)
+    before = benchmark(u'tree', treeWriter, records, repeats)
+    after = benchmark(u'XMLWriter', xmlWriter, [Record.fromDict(d) for d in records], repeats)
+    print u'Speedup: %.2fx' % (before / after)
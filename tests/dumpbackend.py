@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Check of the offline harvest from database dumps (DumpBackend)
+
+Harvests the fixture dumps of tests/dumps (see tests/makedumps.py), of
+both the older and the newer schema, in a scratch directory and checks
+the records and the skipped files against those expected. Any mismatch
+is reported and makes the exit status 1.
+
+Usage: python tests/dumpbackend.py
+'''
+
+import codecs
+import json
+import os
+import shutil
+import sys
+import tempfile
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from Europeana import EuropeanaHarvester
+from DumpBackend import DumpApi
+
+PROJECT = {u'project-name': u'dumps',
+           u'id-templates': {u'Template:BBR': [u'http://kulturarvsdata.se/raa/bbr/html/'],
+                             u'Template:Fornminne': [u'http://kulturarvsdata.se/raa/fmi/html/'],
+                             u'Template:Kmb': [u'http://kulturarvsdata.se/raa/kmb/']},
+           u'base-categories': [u'Category:Images from Wiki Loves Monuments 2013 in Sweden'],
+           u'subcategory-depth': 1,
+           u'output-pattern': u'output/dumps'}
+COMMONS = u'https://commons.wikimedia.org/wiki/File:'
+BASE = u'Images from Wiki Loves Monuments 2013 in Sweden'
+# identifier: the fields checked of its record
+RECORDS = {
+    COMMONS + u'Kyrka_1.jpg': {
+        u'title': u'Kyrka 1',
+        u'photographer': u'<a href="//commons.wikimedia.org/wiki/User:Example" title="User:Example">Example</a>',
+        u'created': u'2013-08-26 09:51',
+        u'description': u'A <b>church</b> in <a href="//commons.wikimedia.org/wiki/Stockholm" title="Stockholm">'
+                        u'the capital</a>, see <a rel="nofollow" class="external text" href="http://example.org">'
+                        u'the site</a>',
+        u'categories': u'%s;Kyrkor i Sverige' % BASE,  # not the hidden one
+        u'copyright': u'http://creativecommons.org/licenses/by-sa/3.0',
+        u'sourcelinks': u'http://kulturarvsdata.se/raa/bbr/html/21300000012345',
+        u'mediatype': u'IMAGE',
+        u'lat': u'59.329444',
+        u'lon': u'18.068611'},
+    COMMONS + u'Bro_%28gammal%29_2.jpg': {
+        u'title': u'Bro (gammal) 2',
+        u'photographer': u'Anna A',
+        u'created': u'2012-05-01',
+        u'description': u'Bro över ån',
+        u'credit': u'Riksantikvarieämbetet',
+        u'categories': BASE,  # not the one without a category page
+        u'copyright': u'https://creativecommons.org/publicdomain/mark/1.0/',
+        u'sourcelinks': u'',  # Template:Kmb has no page
+        u'lat': u'57.700000',
+        u'lon': u'11.970000'},
+    COMMONS + u'Fyr%27s_3.jpg': {
+        u'title': u"Fyr's 3",
+        u'created': u'ca. 1890s',
+        u'description': u'Fyr',
+        u'categories': BASE,
+        u'copyright': u'https://creativecommons.org/publicdomain/mark/1.0/',
+        u'sourcelinks': u'http://kulturarvsdata.se/raa/fmi/html/10028201230001',
+        u'lat': u''}}
+# reason: number of skipped files (Kvarn 4.jpg is found through the subcategory)
+SKIPPED = {u'not an image': 1, u'only uploader': 1}
+
+
+def harvest(dumps):
+    '''
+    harvest the dumps in a scratch directory
+    returns: (dict of records by identifier, dict of skipped files by reason)
+    '''
+    directory = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(ROOT, 'creditStrings.json'), directory)
+        os.chdir(directory)
+        os.mkdir('output')
+        f = codecs.open('project.json', 'w', 'utf-8')
+        json.dump(PROJECT, f)
+        f.close()
+        api = DumpApi.fromProjects(dumps, [u'project.json'])
+        EuropeanaHarvester(u'project.json', cache=False, api=api)
+        f = codecs.open('output/dumps.csv', 'r', 'utf-8')
+        lines = f.read().splitlines()
+        f.close()
+        header = lines[0][1:].split(u'|')
+        records = dict((r[u'identifier'], r) for r in (dict(zip(header, l.split(u'|'))) for l in lines[1:]))
+        f = codecs.open('output/dumps-SkipStatistics.csv', 'r', 'utf-8')
+        skipped = dict((l.split(u'|', 1)[1], int(l.split(u'|', 1)[0])) for l in f.read().splitlines()[1:])
+        f.close()
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(directory)
+    return records, skipped
+
+
+def check(schema):
+    '''
+    harvest the dumps of a schema and compare with those expected
+    returns: list of mismatches
+    '''
+    records, skipped = harvest(os.path.join(ROOT, 'tests', 'dumps', schema))
+    mismatches = []
+    if sorted(records) != sorted(RECORDS):
+        mismatches.append(u'%s: records of %s' % (schema, u', '.join(sorted(records))))
+    for identifier, fields in sorted(RECORDS.iteritems()):
+        for k, v in sorted(fields.iteritems()):
+            found = records.get(identifier, {}).get(k)
+            if identifier in records and found != v:
+                mismatches.append(u'%s: %s of %s is "%s", not "%s"' % (schema, k, identifier, found, v))
+    if skipped != SKIPPED:
+        mismatches.append(u'%s: skipped %s' % (schema, skipped))
+    return mismatches
+
+
+if __name__ == '__main__':
+    mismatches = []
+    for schema in ('old', 'new'):
+        print u'Harvesting the %s dumps...' % schema
+        mismatches += check(schema)
+    if mismatches:
+        print u'Mismatches:\n%s' % u'\n'.join(mismatches)
+        sys.exit(1)
+    print u'All records as expected'
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+#
+# By: André Costa, Wikimedia Sverige
+# License: MIT
+# 2014
+#
+'''
+Writes the tiny fixture dumps read by tests/dumpbackend.py
+
+The same six files, three categories and their templates (all but
+Template:Kmb having a page) and links are written as the dumps of the
+older schema (cl_to, tl_namespace/tl_title, el_to, img_user_text) to
+tests/dumps/old and of the newer one (linktarget,
+el_to_domain_index/el_to_path, img_actor) to tests/dumps/new.
+
+Usage: python tests/makedumps.py
+'''
+
+import bz2
+import gzip
+import os
+from xml.sax.saxutils import escape
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dumps')
+PREFIX = 'commonswiki-20141001'
+BASE = 'Images_from_Wiki_Loves_Monuments_2013_in_Sweden'
+FILES = {1: 'Kyrka_1.jpg', 2: 'Bro_(gammal)_2.jpg', 3: "Fyr's_3.jpg",
+         4: 'Kvarn_4.jpg', 5: 'Other_5.jpg', 6: 'Movie_6.ogv'}
+PAGES = [(i, 6, t, 1000 + i, 1500 + i) for i, t in sorted(FILES.items())] + \
+        [(100, 14, 'Churches_in_Uppland', 2000, 10), (101, 14, BASE, 2001, 10),
+         (102, 14, 'Hidden_maintenance', 2002, 10), (103, 14, 'Kyrkor_i_Sverige', 2003, 10),
+         (200, 0, 'Not_a_file', 3000, 10)] + \
+        [(300 + n, 10, t, 4000 + n, 10) for n, t in enumerate(['Information', 'Self', 'Cc-by-sa-3.0', 'BBR', 'Location',
+                                                              'Cc-zero', 'PD-old', 'Fornminne', 'GFDL', 'Cc-by-2.0',
+                                                              'Cc-by-sa-4.0'])]
+# cl_from, category, cl_type (Red_link_category and Elsewhere have no category page)
+CATEGORYLINKS = [(1, BASE, 'file'), (2, BASE, 'file'), (3, BASE, 'file'), (6, BASE, 'file'),
+                 (100, BASE, 'subcat'), (4, 'Churches_in_Uppland', 'file'), (5, 'Elsewhere', 'file'),
+                 (1, 'Hidden_maintenance', 'file'), (1, 'Kyrkor_i_Sverige', 'file'),
+                 (2, 'Red_link_category', 'file'), (200, BASE, 'page')]
+# (Kmb is an id-template without a page, so its link is no sourcelink)
+TEMPLATES = {1: ['Information', 'Self', 'Cc-by-sa-3.0', 'BBR', 'Location'], 2: ['Information', 'Cc-zero', 'Kmb'],
+             3: ['Information', 'PD-old', 'Fornminne'], 4: ['Information', 'GFDL', 'Cc-by-2.0'],
+             5: ['Information'], 6: ['Information', 'Cc-by-sa-4.0']}
+LINKS = [(1, 'http://kulturarvsdata.se/raa/bbr/html/21300000012345'), (1, 'http://example.org/x'),
+         (2, 'http://kulturarvsdata.se/raa/kmb/16000300012345'),
+         (3, 'http://kulturarvsdata.se/raa/fmi/html/10028201230001'), (4, 'https://sv.wikipedia.org/wiki/Kvarn')]
+TEXTS = {
+    1: u'''=={{int:filedesc}}==
+{{Information
+|description={{en|1=A \'\'\'church\'\'\' in [[Stockholm|the capital]], see [http://example.org the site]}}{{sv|1=En kyrka}}
+|date=2013-08-26 09:51
+|source={{own}}
+|author=[[User:Example|Example]]
+|permission=
+|other versions=
+}}
+{{Location|59|19|46|N|18|04|07|E}}
+{{BBR|21300000012345}}
+{{self|cc-by-sa-3.0}}''',
+    2: u'{{Information|description=Bro över ån|date={{according to EXIF data|2012-05-01}}'
+       u'|source=Riksantikvarieämbetet|author=Anna A}}{{Location dec|57.7|11.97}}{{cc-zero}}{{Kmb|16000300012345}}',
+    3: u'{{Information|Description={{sv|Fyr}}|Date=ca. 1890s|Source=Own|Author=[[User:Uploader|Uploader]]}}'
+       u'{{PD-old}}{{Fornminne|10028201230001}}',
+    4: u'{{Information|description=Kvarn|date=2014|source=x|author=}}{{GFDL}}{{cc-by-2.0}}',
+    5: u'{{Information|description=Other|date=2014|source=x|author=Someone}}',
+    6: u'{{Information|description=Film|date=2014|source=x|author=Someone}}{{cc-by-sa-4.0}}'}
+
+
+def quote(v):
+    '''a value as an sql literal'''
+    if v is None:
+        return 'NULL'
+    if isinstance(v, int):
+        return str(v)
+    return "'%s'" % v.replace('\\', '\\\\').replace("'", "\\'")
+
+
+def writeTable(directory, table, columns, rows):
+    '''write the gzipped sql dump of a table, two rows per INSERT'''
+    lines = ['-- MySQL dump', 'DROP TABLE IF EXISTS `%s`;' % table, 'CREATE TABLE `%s` (' % table]
+    lines += ['  `%s` varbinary(255) DEFAULT NULL,' % c for c in columns]
+    lines += ['  PRIMARY KEY (`%s`)' % columns[0], ') ENGINE=InnoDB DEFAULT CHARSET=binary;', '']
+    for i in range(0, len(rows), 2):
+        values = ','.join('(%s)' % ','.join(quote(v) for v in r) for r in rows[i:i + 2])
+        lines.append('INSERT INTO `%s` VALUES %s;' % (table, values))
+    f = gzip.GzipFile(os.path.join(directory, '%s-%s.sql.gz' % (PREFIX, table)), 'wb', mtime=0)
+    f.write('\n'.join(lines) + '\n')
+    f.close()
+
+
+def mime(name):
+    '''the major and minor mime type of a file'''
+    return ('video', 'ogg') if name.endswith('.ogv') else ('image', 'jpeg')
+
+
+def writeTexts(directory):
+    '''write the bzipped pages-articles dump'''
+    xml = [u'<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.9/" version="0.9" xml:lang="en">',
+           u'<siteinfo><sitename>Wikimedia Commons</sitename></siteinfo>']
+    for i, name in sorted(FILES.items()):
+        xml.append(u'<page><title>File:%s</title><ns>6</ns><id>%d</id><revision><id>%d</id>'
+                   u'<contributor><username>Editor</username><id>3</id></contributor>'
+                   u'<text xml:space="preserve">%s</text></revision></page>'
+                   % (escape(name.decode('utf-8').replace(u'_', u' ')), i, 1000 + i, escape(TEXTS[i])))
+    xml.append(u'<page><title>Not a file</title><ns>0</ns><id>200</id><revision><id>3000</id>'
+               u'<text>x</text></revision></page></mediawiki>')
+    f = bz2.BZ2File(os.path.join(directory, '%s-pages-articles.xml.bz2' % PREFIX), 'wb')
+    f.write(u'\n'.join(xml).encode('utf-8'))
+    f.close()
+
+
+def writeDumps(directory, newer):
+    '''write all of the dumps, of the newer schema or not'''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    writeTable(directory, 'page', ['page_id', 'page_namespace', 'page_title', 'page_restrictions',
+                                   'page_is_redirect', 'page_latest', 'page_len'],
+               [(i, ns, t, '', 0, latest, length) for i, ns, t, latest, length in PAGES])
+    writeTable(directory, 'page_props', ['pp_page', 'pp_propname', 'pp_value'],
+               [(102, 'hiddencat', ''), (1, 'page_image', 'x')])
+    templateLinks = [(i, t) for i, ts in sorted(TEMPLATES.items()) for t in ts]
+    if newer:
+        # the link targets: categories, then templates
+        targets = sorted(set((14, c) for f, c, k in CATEGORYLINKS)) + \
+            sorted(set((10, t) for f, t in templateLinks))
+        ids = dict((t, n + 1) for n, t in enumerate(targets))
+        writeTable(directory, 'linktarget', ['lt_id', 'lt_namespace', 'lt_title'],
+                   [(ids[t], t[0], t[1]) for t in targets])
+        writeTable(directory, 'categorylinks', ['cl_from', 'cl_sortkey', 'cl_timestamp', 'cl_type', 'cl_target_id'],
+                   [(f, 'X', '2014-01-01 00:00:00', k, ids[(14, c)]) for f, c, k in CATEGORYLINKS])
+        writeTable(directory, 'templatelinks', ['tl_from', 'tl_from_namespace', 'tl_target_id'],
+                   [(f, 6, ids[(10, t)]) for f, t in templateLinks])
+        rows = []
+        for n, (f, link) in enumerate(LINKS):
+            scheme, rest = link.split('://')
+            host, path = rest.split('/', 1)
+            rows.append((n + 1, f, '%s://%s.' % (scheme, '.'.join(reversed(host.split('.')))), '/' + path))
+        rows.append((len(LINKS) + 1, 1, None, None))  # a row without any link
+        writeTable(directory, 'externallinks', ['el_id', 'el_from', 'el_to_domain_index', 'el_to_path'], rows)
+        writeTable(directory, 'image', ['img_name', 'img_size', 'img_major_mime', 'img_minor_mime',
+                                        'img_description_id', 'img_actor', 'img_timestamp'],
+                   [(t, 100) + mime(t) + (1, 7, '20130901120000') for i, t in sorted(FILES.items())])
+    else:
+        writeTable(directory, 'categorylinks', ['cl_from', 'cl_to', 'cl_sortkey', 'cl_timestamp', 'cl_type'],
+                   [(f, c, 'X', '2014-01-01 00:00:00', k) for f, c, k in CATEGORYLINKS])
+        writeTable(directory, 'templatelinks', ['tl_from', 'tl_namespace', 'tl_title', 'tl_from_namespace'],
+                   [(f, 10, t, 6) for f, t in templateLinks])
+        writeTable(directory, 'externallinks', ['el_id', 'el_from', 'el_to', 'el_index'],
+                   [(n + 1, f, link, '') for n, (f, link) in enumerate(LINKS)])
+        writeTable(directory, 'image', ['img_name', 'img_size', 'img_major_mime', 'img_minor_mime',
+                                        'img_description', 'img_user', 'img_user_text', 'img_timestamp'],
+                   [(t, 100) + mime(t) + ('desc', 7, 'Uploader', '20130901120000') for i, t in sorted(FILES.items())])
+    writeTexts(directory)
+
+
+if __name__ == '__main__':
+    writeDumps(os.path.join(ROOT, 'old'), False)
+    writeDumps(os.path.join(ROOT, 'new'), True)
+    print u'Wrote the fixture dumps to %s' % ROOT